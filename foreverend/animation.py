@@ -0,0 +1,152 @@
+import math
+
+
+def linear(t):
+    return t
+
+
+def ease_in_quad(t):
+    return t * t
+
+
+def ease_out_quad(t):
+    return t * (2 - t)
+
+
+def ease_in_out_quad(t):
+    if t < 0.5:
+        return 2 * t * t
+    else:
+        return -1 + (4 - 2 * t) * t
+
+
+def ease_in_out_sine(t):
+    return -(math.cos(math.pi * t) - 1) / 2
+
+
+class Tween(object):
+    """Interpolates between two values over a period of time.
+
+    The values can be numbers or tuples of numbers (such as positions).
+    """
+    def __init__(self, start, end, duration_ms, easing=linear):
+        self.start = start
+        self.end = end
+        self.duration_ms = duration_ms
+        self.easing = easing
+
+    def is_done(self, elapsed_ms):
+        return elapsed_ms >= self.duration_ms
+
+    def get_value(self, elapsed_ms):
+        if self.duration_ms <= 0:
+            t = 1.0
+        else:
+            t = min(float(elapsed_ms) / self.duration_ms, 1.0)
+
+        t = self.easing(t)
+
+        if isinstance(self.start, tuple):
+            return tuple([
+                start + (end - start) * t
+                for start, end in zip(self.start, self.end)
+            ])
+        else:
+            return self.start + (self.end - self.start) * t
+
+
+class AnimationManager(object):
+    """Advances all running animations once per engine tick.
+
+    Animations (effects) are stepped in a single pass. Any sprite
+    movement they make goes through move_by/move_to here, which collects
+    the movement and applies it all at once at the end of the tick.
+
+    Applying it writes every new position directly, re-indexes each
+    layer's quad tree once for all the moved sprites, and then runs a
+    single collision pass against the new positions, rather than doing
+    all of that per move, per axis.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.animations = []
+        self.pending_moves = {}
+
+    def add(self, animation):
+        assert animation not in self.animations
+        animation.elapsed_ms = 0
+        animation.step_elapsed_ms = 0
+        self.animations.append(animation)
+
+    def remove(self, animation):
+        try:
+            self.animations.remove(animation)
+        except ValueError:
+            # It was already removed.
+            pass
+
+    def clear(self):
+        self.animations = []
+        self.pending_moves = {}
+
+    def move_by(self, sprite, dx, dy, check_collisions=True):
+        if sprite in self.pending_moves:
+            old_dx, old_dy, old_check_collisions = self.pending_moves[sprite]
+            dx += old_dx
+            dy += old_dy
+            check_collisions = check_collisions or old_check_collisions
+
+        self.pending_moves[sprite] = (dx, dy, check_collisions)
+
+    def move_to(self, sprite, x, y, check_collisions=False):
+        dx, dy, _ = self.pending_moves.get(sprite, (0, 0, False))
+
+        self.move_by(sprite,
+                     x - sprite.rect.x - dx,
+                     y - sprite.rect.y - dy,
+                     check_collisions)
+
+    def tick(self):
+        ms = 1000.0 / self.engine.FPS
+
+        for animation in list(self.animations):
+            # An earlier animation may have stopped this one.
+            if animation in self.animations:
+                animation.advance(ms)
+
+        self.flush()
+
+    def flush(self):
+        pending_moves = self.pending_moves
+        self.pending_moves = {}
+        moves = []
+        layer_sprites = {}
+
+        for sprite, (dx, dy, check_collisions) in pending_moves.iteritems():
+            if dx or dy:
+                sprite.rect.move_ip(dx, dy)
+                moves.append((sprite, dx, dy, check_collisions))
+
+                if sprite.quad_trees:
+                    layer_sprites.setdefault(sprite.layer, []).append(sprite)
+
+        if not moves:
+            return
+
+        for layer, sprites in layer_sprites.iteritems():
+            layer.quad_tree.reindex_sprites(sprites)
+
+        for sprite, dx, dy, check_collisions in moves:
+            if check_collisions and sprite.layer:
+                sprite.rect.left = max(sprite.rect.left, 0)
+                sprite.rect.right = min(sprite.rect.right,
+                                        sprite.layer.area.size[0])
+                sprite.check_collisions(dx, dy)
+
+        # The moved signals won't re-index anything again, unless a
+        # collision moved it.
+        for sprite, dx, dy, check_collisions in moves:
+            sprite.on_moved(dx, dy)
+
+        for layer in layer_sprites.iterkeys():
+            layer.quad_tree.done_reindexing()
@@ -0,0 +1,158 @@
+"""Packs the small images in data/ into a few shared atlas sheets.
+
+This is run at startup whenever the atlas is missing or out of date
+with the art, and can also be run by hand:
+
+    python -m foreverend.atlas
+
+The sheets and an index are written to data/atlas/, and load_image will
+then return packed images as subsurfaces of their sheet.
+"""
+import json
+import os
+
+import pygame
+
+from foreverend import resources
+from foreverend.resources import ATLAS_DIR, ATLAS_INDEX_FILENAME, \
+                                 IMAGE_MODES, detect_image_mode, \
+                                 list_all_images, load_image_file
+
+
+# Only images this small (in both dimensions) are packed.
+MAX_IMAGE_SIZE = 128
+SHEET_SIZE = 1024
+
+# Space left between images, so they never bleed into each other.
+PADDING = 1
+
+
+def pack(sizes, sheet_size=SHEET_SIZE, padding=PADDING):
+    """Packs rectangles into sheets, placing the tallest first on shelves.
+
+    sizes maps names to (width, height). This returns a mapping of names
+    to (sheet index, x, y), along with the height used on each sheet.
+    """
+    positions = {}
+    sheet_heights = []
+    sheet = -1
+    x = y = shelf_height = sheet_size
+
+    for name in sorted(sizes.iterkeys(),
+                       key=lambda name: (sizes[name][1], sizes[name][0]),
+                       reverse=True):
+        width, height = sizes[name]
+
+        if x + width > sheet_size:
+            # Start a new shelf.
+            x = 0
+            y += shelf_height + padding
+            shelf_height = height
+
+        if y + height > sheet_size:
+            # Start a new sheet.
+            sheet += 1
+            sheet_heights.append(0)
+            x = y = 0
+            shelf_height = height
+
+        positions[name] = (sheet, x, y)
+        sheet_heights[sheet] = max(sheet_heights[sheet], y + height)
+        x += width + padding
+
+    return positions, sheet_heights
+
+
+def build_atlases(filename=ATLAS_INDEX_FILENAME):
+    """Packs the images and writes the sheets, along with the index.
+
+    Images are packed onto separate sheets for each blit mode, so that
+    opaque and colorkeyed images don't pay for per-pixel alpha. The
+    index lists the images too big to pack as well, so that images
+    added later can be spotted. This returns the index.
+    """
+    atlas_dir = os.path.join(resources.DATA_DIR, ATLAS_DIR)
+    images = {}
+    unpacked = []
+
+    for name in list_all_images():
+        if name.startswith(ATLAS_DIR + '/'):
+            continue
+
+        if not name.endswith('.jpg'):
+            image = load_image_file(name)
+            width, height = image.get_size()
+
+            if width <= MAX_IMAGE_SIZE and height <= MAX_IMAGE_SIZE:
+                images[name] = image
+                continue
+
+        unpacked.append(name)
+
+    sizes_by_mode = dict([(mode, {}) for mode in IMAGE_MODES])
+
+    for name, image in images.iteritems():
+        mode = resources.image_modes.get(name) or detect_image_mode(image)
+        sizes_by_mode[mode][name] = image.get_size()
+
+    positions = {}
+    sheet_heights = []
+    sheet_modes = []
+
+    for mode in IMAGE_MODES:
+        mode_positions, mode_sheet_heights = pack(sizes_by_mode[mode])
+
+        for name, (sheet, x, y) in mode_positions.iteritems():
+            positions[name] = (len(sheet_heights) + sheet, x, y)
+
+        sheet_heights += mode_sheet_heights
+        sheet_modes += [mode] * len(mode_sheet_heights)
+
+    sheets = [
+        pygame.Surface((SHEET_SIZE, height), pygame.SRCALPHA, 32)
+        for height in sheet_heights
+    ]
+
+    for sheet in sheets:
+        sheet.fill((0, 0, 0, 0))
+
+    index = {
+        'sheets': [],
+        'sheet_modes': sheet_modes,
+        'images': {},
+        'unpacked': unpacked,
+    }
+
+    for name, (sheet, x, y) in positions.iteritems():
+        image = images[name]
+
+        # The sheets start out fully transparent, so taking the maximum
+        # of each channel copies the image's pixels (and alpha) exactly.
+        sheets[sheet].blit(image, (x, y), None, pygame.BLEND_RGBA_MAX)
+        index['images'][name] = [sheet, x, y] + list(image.get_size())
+
+    if os.path.exists(atlas_dir):
+        # Clear out sheets from any previous build.
+        for sheet_filename in os.listdir(atlas_dir):
+            if (sheet_filename.startswith('sheet') and
+                sheet_filename.endswith('.png')):
+                os.unlink(os.path.join(atlas_dir, sheet_filename))
+    else:
+        os.makedirs(atlas_dir)
+
+    for i, sheet in enumerate(sheets):
+        sheet_name = '%s/sheet%s' % (ATLAS_DIR, i)
+        pygame.image.save(sheet, os.path.join(resources.DATA_DIR,
+                                              sheet_name + '.png'))
+        index['sheets'].append(sheet_name)
+
+    with open(filename, 'w') as fp:
+        json.dump(index, fp, indent=2, sort_keys=True)
+
+    return index
+
+
+if __name__ == '__main__':
+    index = build_atlases()
+    print 'Packed %s images into %s sheets.' % (len(index['images']),
+                                                len(index['sheets']))
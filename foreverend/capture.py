@@ -0,0 +1,175 @@
+import mmap
+import Queue
+import subprocess
+import threading
+
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+
+class FrameCapture(object):
+    """Streams rendered frames to disk, or to an encoder, for videos.
+
+    Frames are written as raw RGB, a row at a time. They either go into
+    a file with room for a fixed number of frames, which is preallocated
+    and memory-mapped, or to the standard input of an encoder process
+    (such as ffmpeg reading rawvideo from a pipe).
+
+    All the writing is done on a writer thread. The game only copies
+    each frame into one of a few spare buffers and queues it, so it never
+    waits on the disk or the encoder. If the writer falls too far behind
+    and there's no spare buffer, the frame is dropped, and counted in
+    frames_dropped.
+
+    Blocking captures wait for a spare buffer instead, so no frame is
+    ever dropped. This holds the game up to the writer's pace, which is
+    what's wanted headless, or when making a video of a replay.
+
+    Frames are captured by calling capture() once a frame has been
+    drawn. The main loop does this when the engine has a frame_capture.
+    Headless callers can call it after each tick, which lets captures
+    run faster than real time.
+    """
+    NUM_BUFFERS = 8
+
+    def __init__(self, engine, size=None, block=False):
+        if not has_numpy:
+            raise RuntimeError('Capturing frames requires numpy')
+
+        self.engine = engine
+        self.size = size or engine.camera.rect.size
+        self.block = block
+        width, height = self.size
+        self.frame_bytes = width * height * 3
+        self.free_buffers = Queue.Queue()
+        self.pending = Queue.Queue()
+        self.max_frames = None
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.file = None
+        self.mmap = None
+        self.frames = None
+        self.process = None
+        self.thread = None
+        self.error = None
+
+        for i in xrange(self.NUM_BUFFERS):
+            self.free_buffers.put(numpy.empty((height, width, 3),
+                                              numpy.uint8))
+
+    def open_file(self, filename, max_frames):
+        """Captures up to max_frames frames into filename.
+
+        The file is truncated to the frames actually captured when it's
+        closed.
+        """
+        assert not self.thread
+        assert max_frames > 0
+        width, height = self.size
+
+        self.file = open(filename, 'w+b')
+        self.file.truncate(max_frames * self.frame_bytes)
+        self.mmap = mmap.mmap(self.file.fileno(),
+                              max_frames * self.frame_bytes)
+        self.frames = numpy.frombuffer(self.mmap, numpy.uint8).reshape(
+            (max_frames, height, width, 3))
+        self.max_frames = max_frames
+        self._start()
+
+    def open_process(self, args):
+        """Captures frames to the standard input of a new process.
+
+        args is the command line, which should read raw RGB frames of
+        self.size from standard input.
+        """
+        assert not self.thread
+
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE)
+        self._start()
+
+    def capture(self):
+        """Queues the current frame to be written.
+
+        Returns False if the frame had to be dropped. Blocking captures
+        only drop frames once the output is full or has failed.
+        """
+        if ((self.max_frames is not None and
+             self.frames_captured >= self.max_frames) or
+            self.error):
+            self.frames_dropped += 1
+            return False
+
+        try:
+            frame = self.free_buffers.get(self.block)
+        except Queue.Empty:
+            self.frames_dropped += 1
+            return False
+
+        if self.size == self.engine.camera.rect.size:
+            view = self.engine.get_frame()
+        else:
+            view = self.engine.get_frame(self.size)
+
+        # The view is column-major (x, y). The copy puts it in row order.
+        frame[...] = view.swapaxes(0, 1)
+        self.pending.put((self.frames_captured, frame))
+        self.frames_captured += 1
+
+        return True
+
+    def close(self):
+        """Waits for the queued frames to be written, and closes the output.
+        """
+        if self.thread:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+
+        if self.mmap:
+            self.frames = None
+            self.mmap.flush()
+            self.mmap.close()
+            self.mmap = None
+
+            self.file.truncate(self.frames_captured * self.frame_bytes)
+            self.file.close()
+            self.file = None
+
+        if self.process:
+            try:
+                self.process.stdin.close()
+            except IOError:
+                pass
+
+            self.process.wait()
+            self.process = None
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+
+            if item is None:
+                return
+
+            index, frame = item
+
+            if not self.error:
+                try:
+                    if self.frames is not None:
+                        self.frames[index] = frame
+                    else:
+                        self.process.stdin.write(frame.data)
+                except (IOError, OSError), e:
+                    # The encoder went away, or the disk is full. Nothing
+                    # more will be captured.
+                    self.error = e
+
+            self.free_buffers.put(frame)
@@ -212,4 +212,6 @@ class ClosingCutscene(Cutscene):
         surface.blit(self.earth,
                      (surface.get_width() - self.earth.get_width(), 0))
         surface.blit(self.probe, (150, 60))
-        surface.blit(self.fade_effect.sprite.image, (0, 0))
+
+        if self.fade_effect.alpha > 0:
+            surface.blit(self.fade_effect.sprite.image, (0, 0))
@@ -1,14 +1,21 @@
 import pygame
 
+from foreverend import get_engine
+from foreverend.animation import Tween, linear
 from foreverend.signals import Signal
 from foreverend.sprites.base import Direction, Sprite
-from foreverend.timer import Timer
 
 
 class Effect(object):
+    # The dynamic state saved in save states, in order.
+    STATE_FIELDS = ('elapsed_ms', 'step_elapsed_ms')
+
     def __init__(self):
-        self.timer = None
+        self.animation_manager = get_engine().animation_manager
+        self.running = False
         self.timer_ms = 150
+        self.elapsed_ms = 0
+        self.step_elapsed_ms = 0
 
         # Signals
         self.started = Signal()
@@ -21,19 +28,27 @@ class Effect(object):
         pass
 
     def start(self):
-        assert not self.timer
+        assert not self.running
         self.pre_start()
-        self.timer = Timer(self.timer_ms, self.on_tick)
-        self.timer.start()
+        self.running = True
+        self.animation_manager.add(self)
         self.started.emit()
 
     def stop(self):
-        assert self.timer
+        assert self.running
         self.pre_stop()
-        self.timer.stop()
-        self.timer = None
+        self.running = False
+        self.animation_manager.remove(self)
         self.stopped.emit()
 
+    def advance(self, ms):
+        self.elapsed_ms += ms
+        self.step_elapsed_ms += ms
+
+        if self.step_elapsed_ms >= self.timer_ms:
+            self.step_elapsed_ms = 0
+            self.on_tick()
+
     def on_tick(self):
         pass
 
@@ -42,42 +57,48 @@ class ScreenEffect(Effect):
     def __init__(self, layer, rect):
         super(ScreenEffect, self).__init__()
         self.rect = rect
+        self.color = (0, 0, 0)
 
+        # This is a solid surface without per-pixel alpha. The color is
+        # painted once on start, and only the surface alpha changes after
+        # that, so each step is just a single blit.
         self.sprite = Sprite(None)
-        self.sprite.image = pygame.Surface(rect.size).convert_alpha()
+        self.sprite.image = pygame.Surface(rect.size).convert()
+        self.sprite.image.set_alpha(0)
         self.sprite.move_to(*rect.topleft)
 
         if layer:
             layer.add(self.sprite)
 
+    def pre_start(self):
+        self.sprite.image.fill(self.color)
+        self.sprite.show()
+
+    def set_alpha(self, alpha):
+        self.sprite.image.set_alpha(alpha)
+
 
 class ScreenFadeEffect(ScreenEffect):
     def __init__(self, *args, **kwargs):
         super(ScreenFadeEffect, self).__init__(*args, **kwargs)
-        self.color = (0, 0, 0)
         self.fade_from_alpha = 0
         self.fade_to_alpha = 255
         self.fade_time_ms = 500
+        self.easing = linear
         self.timer_ms = 30
 
     def pre_start(self):
-        self.sprite.show()
+        super(ScreenFadeEffect, self).pre_start()
         self.alpha = self.fade_from_alpha
-        self.alpha_delta = ((self.fade_to_alpha - self.fade_from_alpha) /
-                            (self.fade_time_ms / self.timer_ms))
-        self.sprite.image.fill(
-            (self.color[0], self.color[1], self.color[2], self.alpha))
+        self.alpha_tween = Tween(self.fade_from_alpha, self.fade_to_alpha,
+                                 self.fade_time_ms, self.easing)
+        self.set_alpha(self.alpha)
 
     def on_tick(self):
-        self.sprite.image.fill(
-            (self.color[0], self.color[1], self.color[2], self.alpha))
-
-        self.alpha += self.alpha_delta
+        self.alpha = int(self.alpha_tween.get_value(self.elapsed_ms))
+        self.set_alpha(self.alpha)
 
-        if ((self.fade_from_alpha > self.fade_to_alpha and
-             self.alpha <= self.fade_to_alpha) or
-            (self.fade_from_alpha < self.fade_to_alpha and
-             self.alpha >= self.fade_to_alpha)):
+        if self.alpha_tween.is_done(self.elapsed_ms):
             self.stop()
 
 
@@ -90,18 +111,14 @@ class ScreenFlashEffect(ScreenEffect):
         self.flash_peaked = Signal()
 
     def pre_start(self):
+        super(ScreenFlashEffect, self).pre_start()
         self.hit_peak = False
         self.alpha = 100
-        self.sprite.show()
-
-        self._fill(0)
 
-    def _fill(self, alpha):
-        self.sprite.image.fill((self.color[0], self.color[1], self.color[2],
-                                alpha))
+        self.set_alpha(0)
 
     def on_tick(self):
-        self._fill(self.alpha)
+        self.set_alpha(self.alpha)
 
         if self.hit_peak:
             self.alpha = max(self.alpha - 20, 0)
@@ -134,6 +151,7 @@ class MoveEffect(TransitionEffect):
         self.start_x = 0
         self.start_y = 0
         self.total_time_ms = 3000
+        self.easing = linear
 
     def pre_start(self):
         assert self.destination
@@ -146,33 +164,27 @@ class MoveEffect(TransitionEffect):
 
         self.start_x = self.obj.rect.left
         self.start_y = self.obj.rect.top
-        self.gradient = (float(self.destination[1] - self.start_y) /
-                         float(self.destination[0] - self.start_x))
-
-        self.step = 0
-        self.num_steps = self.total_time_ms / self.timer_ms
-        assert self.num_steps > 0
-
-        diff_x = self.destination[0] - self.start_x
-        self.dx = float(diff_x) / self.num_steps
-        self.dy = (diff_x * self.gradient) / self.num_steps
+        self.position_tween = Tween((self.start_x, self.start_y),
+                                    tuple(self.destination),
+                                    self.total_time_ms, self.easing)
 
     def pre_stop(self):
         self.obj.collidable = self.old_collidable
         self.obj.obey_gravity = self.old_obey_gravity
 
     def on_tick(self):
-        if self.step == self.num_steps:
-            self.stop()
-            return
-
-        self.obj.move_to(int(self.start_x + self.dx * self.step),
-                         int(self.start_y + self.dy * self.step))
+        x, y = self.position_tween.get_value(self.elapsed_ms)
+        self.animation_manager.move_to(self.obj, int(x), int(y))
 
-        self.step += 1
+        if self.position_tween.is_done(self.elapsed_ms):
+            self.stop()
 
 
 class FloatEffect(TransitionEffect):
+    STATE_FIELDS = Effect.STATE_FIELDS + ('up_count', 'down_count',
+                                          'pause_count', 'float_paused',
+                                          'direction')
+
     def __init__(self, obj):
         super(FloatEffect, self).__init__(obj)
         self.up_count = 0
@@ -213,7 +225,7 @@ class FloatEffect(TransitionEffect):
             dy = -dy
 
         if dy != 0:
-            self.obj.move_by(0, dy)
+            self.animation_manager.move_by(self.obj, 0, dy)
 
 
 class SlideHideEffect(TransitionEffect):
@@ -311,6 +323,8 @@ class SlideShowEffect(TransitionEffect):
 
 
 class ShakeEffect(TransitionEffect):
+    STATE_FIELDS = Effect.STATE_FIELDS + ('dx',)
+
     def __init__(self, *args, **kwargs):
         super(ShakeEffect, self).__init__(*args, **kwargs)
         self.shake_distance = 2
@@ -318,8 +332,8 @@ class ShakeEffect(TransitionEffect):
 
     def pre_start(self):
         self.dx = self.shake_distance
-        self.obj.move_by(self.dx, 0)
+        self.animation_manager.move_by(self.obj, self.dx, 0)
 
     def on_tick(self):
         self.dx = -self.dx
-        self.obj.move_by(self.dx, 0)
+        self.animation_manager.move_by(self.obj, self.dx, 0)
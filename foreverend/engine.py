@@ -10,11 +10,19 @@ except:
     has_mixer = False
 
 from foreverend import set_engine
+from foreverend.animation import AnimationManager
 from foreverend.cutscenes import ClosingCutscene, OpeningCutscene, \
                                  TutorialCutscene
+from foreverend.frames import FrameExporter
 from foreverend.levels import get_levels
-from foreverend.resources import get_music_filename, unload_images
+from foreverend.resources import get_music_filename, list_images, \
+                                 load_image_atlas, load_image_bundle, \
+                                 prefetch_images, process_prefetched_images, \
+                                 warm_up_images
+from foreverend.rewind import RewindBuffer
+from foreverend.savestate import can_save_state, save_state
 from foreverend.signals import Signal
+from foreverend.simulation import Fork
 from foreverend.sprites import Player, TiledSprite
 from foreverend.timer import Timer
 from foreverend.ui import UIManager
@@ -55,6 +63,20 @@ class Camera(object):
 class ForeverEndEngine(object):
     FPS = 30
 
+    # The keys that switch to each time period.
+    TIME_PERIOD_KEYS = {
+        K_1: 0,
+        K_a: 0,
+        K_2: 1,
+        K_s: 1,
+        K_3: 2,
+        K_d: 2,
+    }
+
+    # How long to spend adding background-decoded images to the cache
+    # each tick.
+    PREFETCH_BUDGET_MS = 4
+
     def __init__(self, screen):
         set_engine(self)
 
@@ -66,10 +88,26 @@ class ForeverEndEngine(object):
         self.active_level = None
         self.active_cutscene = None
         self.paused = False
+        self.held_keys = frozenset()
+        self.simulation = None
+
+        # The player's key presses and releases this tick, in order, as
+        # (pressed, key).
+        self.key_edges = []
         self.screen = screen
         self.clock = pygame.time.Clock()
         self.player = Player()
         self.ui_manager = UIManager(self)
+        self.animation_manager = AnimationManager(self)
+        self.rewind_buffer = RewindBuffer(self)
+        self.frame_exporter = FrameExporter(self)
+        self.frame_num = 0
+
+        # A FrameCapture to write each frame drawn to, if capturing.
+        self.frame_capture = None
+
+        # A ReplayRecorder to record each tick played to, if recording.
+        self.replay_recorder = None
         self.camera = None
 
         # Debug flags
@@ -81,6 +119,18 @@ class ForeverEndEngine(object):
         self.ui_ready_cnx = None
 
     def run(self):
+        load_image_atlas()
+        load_image_bundle()
+
+        # Load the shared images and the first level up front. Anything
+        # not in the image bundle is decoded across all cores. The
+        # remaining levels are prefetched in the background.
+        levels = get_levels()
+        warm_up_images(list_images('') + levels[0].get_assets())
+
+        for level in levels[1:]:
+            prefetch_images(level.get_assets())
+
         self.active_cutscene = OpeningCutscene()
         self.active_cutscene.done.connect(self._setup_game)
         self.active_cutscene.start()
@@ -88,10 +138,60 @@ class ForeverEndEngine(object):
         self._mainloop()
 
     def quit(self):
+        if self.frame_capture:
+            self.frame_capture.close()
+
+            if self.frame_capture.frames_dropped:
+                print 'Dropped %s of %s captured frames.' % (
+                    self.frame_capture.frames_dropped,
+                    self.frame_capture.frames_captured +
+                    self.frame_capture.frames_dropped)
+
+            self.frame_capture = None
+
         pygame.quit()
         sys.exit(0)
 
+    def clone(self):
+        """Returns a Fork of the simulation at the current tick."""
+        return Fork(self, save_state(self), self.held_keys)
+
+    def simulate_tick(self, keys):
+        """Runs a single tick headless, with the given keys held down."""
+        self.key_edges = []
+
+        for key in self.held_keys - keys:
+            self.handle_player_event(pygame.event.Event(KEYUP, key=key))
+
+        for key in keys - self.held_keys:
+            self.handle_player_event(pygame.event.Event(KEYDOWN, key=key))
+
+            if key in self.TIME_PERIOD_KEYS:
+                self.switch_time_period(self.TIME_PERIOD_KEYS[key])
+
+        self.tick.emit()
+        self.animation_manager.tick()
+        self.frame_num += 1
+
+    def get_frame(self, size=None, greyscale=False):
+        """Returns a NumPy view of the current frame, without copying it.
+
+        See FrameExporter.get_frame. The view is only valid for the
+        current tick.
+        """
+        return self.frame_exporter.get_frame(size, greyscale)
+
+    def draw_level(self):
+        self.frame_exporter.release()
+        self.surface.set_clip(self.camera.rect)
+        self.active_level.draw(self.surface)
+        self.frame_exporter.frame_num = self.frame_num
+
     def dead(self):
+        if self.simulation:
+            self.simulation.end('dead')
+            return
+
         def on_timeout():
             widget.close()
             self.restart_level()
@@ -104,10 +204,20 @@ class ForeverEndEngine(object):
 
         timer = Timer(2000, on_timeout, one_shot=True)
 
+    def switch_time_period(self, num):
+        level = self.active_level
+
+        if num < len(level.time_periods):
+            level.switch_time_period(num)
+
     def restart_level(self):
         self.switch_level(self.levels.index(self.active_level))
 
     def game_over(self):
+        if self.simulation:
+            self.simulation.end('game_over')
+            return
+
         def on_timeout():
             widget.close()
             self._setup_game()
@@ -124,17 +234,29 @@ class ForeverEndEngine(object):
         self.active_cutscene = ClosingCutscene()
         self.active_cutscene.start()
 
-    def _setup_game(self):
+    def new_game(self):
+        """Resets the player and the levels for a new game.
+
+        This doesn't switch to a level or show the tutorial, so it's also
+        used to set up the game for running headless.
+        """
         self.ui_manager.add_control_panel()
         self.camera = Camera(self)
         self.tick.clear()
+        self.animation_manager.clear()
 
         self.active_cutscene = None
 
         self.player.lives = self.player.MAX_LIVES
         self.player.health = self.player.MAX_HEALTH
         self.player.update_image()
-        self.levels = [level(self) for level in get_levels()]
+
+        # Levels are only constructed once they're played.
+        self.level_classes = get_levels()
+        self.levels = [None] * len(self.level_classes)
+
+    def _setup_game(self):
+        self.new_game()
         self.switch_level(0)
 
         if self.ui_ready_cnx:
@@ -165,8 +287,38 @@ class ForeverEndEngine(object):
         self.player.jumping = False
         self.player.falling = False
         self.player.fall()
+
+        if not self.levels[num]:
+            self.levels[num] = self.level_classes[num](self)
+
+        old_level = self.active_level
+
+        if old_level and old_level is not self.levels[num]:
+            # Stop everything going on in the old level. Anything started
+            # during its setup is started again if it's restored.
+            old_level.clear_crossovers()
+
+            for callback in list(self.tick.callbacks):
+                timer = getattr(callback, '__self__', None)
+
+                if isinstance(timer, Timer) and timer.level == old_level:
+                    timer.stop()
+
+            for animation in self.animation_manager.animations:
+                animation.running = False
+
+            self.animation_manager.clear()
+
+            if old_level.active_area and self.player.quad_trees:
+                # Otherwise the old level's quad tree would keep the
+                # player, and restoring that level later would trip over
+                # it.
+                old_level.active_area.main_layer.remove(self.player)
+
         self.active_level = self.levels[num]
         self.active_level.reset()
+        self.rewind_buffer.clear()
+        self.held_keys = frozenset()
 
         if self.area_changed_cnx:
             self.area_changed_cnx.disconnect()
@@ -189,10 +341,16 @@ class ForeverEndEngine(object):
 
         self.level_changed.emit()
 
+        if num + 1 < len(self.levels):
+            prefetch_images(self.level_classes[num + 1].get_assets())
+
     def next_level(self):
+        if self.simulation:
+            self.simulation.end('level_complete')
+            return
+
         def on_timeout():
             widget.close()
-            unload_images()
             self.switch_level(next_level)
 
         next_level = self.levels.index(self.active_level) + 1
@@ -213,14 +371,46 @@ class ForeverEndEngine(object):
 
     def _mainloop(self):
         while 1:
+            self.key_edges = []
+
             for event in pygame.event.get():
                 if not self._handle_event(event):
                     return
 
-            self.tick.emit()
+            process_prefetched_images(self.PREFETCH_BUDGET_MS)
+
+            if (self._can_rewind() and
+                pygame.key.get_pressed()[K_BACKSPACE] and
+                can_save_state(self)):
+                # Holding backspace scrubs back through the recent past,
+                # one recorded frame per tick. Scripted sequences play
+                # out regardless.
+                self.rewind_buffer.rewind(1)
+
+                if self.replay_recorder:
+                    self.replay_recorder.mark_discontinuity()
+            else:
+                if self.replay_recorder and self._can_rewind():
+                    self.replay_recorder.record_tick()
+
+                self.tick.emit()
+                self.animation_manager.tick()
+                self.frame_num += 1
+
+                if self._can_rewind():
+                    self.rewind_buffer.record()
+
             self._paint()
+
+            if self.frame_capture and self.active_level:
+                self.frame_capture.capture()
+
             self.clock.tick(self.FPS)
 
+    def _can_rewind(self):
+        return (self.active_level is not None and not self.paused and
+                not self.active_cutscene)
+
     def _handle_event(self, event):
         if event.type == QUIT:
             self.quit()
@@ -248,12 +438,9 @@ class ForeverEndEngine(object):
                 else:
                     self._pause()
             elif not self.paused:
-                if event.type == KEYDOWN and event.key in (K_1, K_a):
-                    self.active_level.switch_time_period(0)
-                elif event.type == KEYDOWN and event.key in (K_2, K_s):
-                    self.active_level.switch_time_period(1)
-                elif event.type == KEYDOWN and event.key in (K_3, K_d):
-                    self.active_level.switch_time_period(2)
+                if (event.type == KEYDOWN and
+                    event.key in self.TIME_PERIOD_KEYS):
+                    self.switch_time_period(self.TIME_PERIOD_KEYS[event.key])
                 elif event.type == KEYDOWN and event.key == K_F5:
                     # XXX For debugging only.
                     i = self.levels.index(self.active_level)
@@ -264,20 +451,31 @@ class ForeverEndEngine(object):
                         self.switch_level(i + 1)
                 elif event.type == KEYDOWN and event.key == K_ESCAPE:
                     self.ui_manager.confirm_quit()
-                elif not self.player.handle_event(event):
-                    area = self.active_level.active_area
+                else:
+                    self.handle_player_event(event)
 
-                    for box in area.event_handlers:
-                        if hasattr(box, 'rects'):
-                            rects = box.rects
-                        else:
-                            rects = [box.rect]
+        return True
 
-                        if (self.player.rect.collidelist(rects) != -1 and
-                            box.handle_event(event)):
-                            break
+    def handle_player_event(self, event):
+        if event.type == KEYDOWN:
+            self.held_keys = self.held_keys | set([event.key])
+            self.key_edges.append((True, event.key))
+        elif event.type == KEYUP:
+            self.held_keys = self.held_keys - set([event.key])
+            self.key_edges.append((False, event.key))
 
-        return True
+        if not self.player.handle_event(event):
+            area = self.active_level.active_area
+
+            for box in area.event_handlers:
+                if hasattr(box, 'rects'):
+                    rects = box.rects
+                else:
+                    rects = [box.rect]
+
+                if (self.player.rect.collidelist(rects) != -1 and
+                    box.handle_event(event)):
+                    break
 
     def _pause(self):
         self.paused = True
@@ -299,8 +497,7 @@ class ForeverEndEngine(object):
             self.active_cutscene.draw(self.screen)
 
         if self.active_level:
-            self.surface.set_clip(self.camera.rect)
-            self.active_level.draw(self.surface)
+            self.draw_level()
             self.screen.blit(self.surface.subsurface(self.camera.rect), (0, 0))
 
         self.ui_manager.draw(self.screen)
@@ -310,8 +507,18 @@ class ForeverEndEngine(object):
                 self.clock.get_fps(),
                 self.player.rect.left, self.player.rect.top)
 
-            self.screen.blit(
-                self.ui_manager.small_font.render(debug_str, True, (255, 0, 0)),
-                (30, 10))
+            self.ui_manager.text_renderer.draw_glyphs(
+                self.screen, self.ui_manager.small_font, debug_str,
+                (255, 0, 0), (30, 10))
+
+            stats = self.rewind_buffer.get_stats()
+            rewind_str = 'Rewind: %0.1fs  %dKB  %0.2fms  %0.fB/tick  x%d' % (
+                stats['seconds'], stats['size_bytes'] / 1024,
+                stats['avg_encode_ms'], stats['avg_bytes_per_tick'],
+                stats['stride'])
+
+            self.ui_manager.text_renderer.draw_glyphs(
+                self.screen, self.ui_manager.small_font, rewind_str,
+                (255, 0, 0), (30, 25))
 
         pygame.display.flip()
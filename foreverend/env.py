@@ -0,0 +1,319 @@
+import multiprocessing
+import os
+import random
+
+import pygame
+from pygame.locals import *
+
+from foreverend.engine import ForeverEndEngine
+from foreverend.resources import load_image_atlas, load_image_bundle
+from foreverend.savestate import load_state, save_state
+
+
+# The keys held down for each action. Up and down go through doors, and
+# 1, 2 and 3 switch time periods.
+ACTIONS = [frozenset(keys) for keys in [
+    (),
+    (K_LEFT,),
+    (K_RIGHT,),
+    (K_SPACE,),
+    (K_LEFT, K_SPACE),
+    (K_RIGHT, K_SPACE),
+    (K_LSHIFT,),
+    (K_LEFT, K_LSHIFT),
+    (K_RIGHT, K_LSHIFT),
+    (K_UP,),
+    (K_DOWN,),
+    (K_1,),
+    (K_2,),
+    (K_3,),
+]]
+
+OBSERVE_VECTOR = 'vector'
+OBSERVE_FRAME = 'frame'
+
+
+def create_headless_engine(screen_size=(960, 720)):
+    """Creates an engine for running the game without a window."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+
+    engine = ForeverEndEngine(pygame.display.set_mode(screen_size, 0, 32))
+    load_image_atlas()
+    load_image_bundle()
+    engine.new_game()
+
+    return engine
+
+
+class ForeverEndEnv(object):
+    """A Gym-style environment for training agents on the levels.
+
+    Each step runs a single tick headless, with the keys for the action
+    held down. Observations are either a vector of the player's state
+    followed by the state of the nearest sprites (relative to the
+    player), or a downscaled frame of what's on screen.
+
+    The reward is the progress made to the right, with a bonus for
+    finishing the level and a penalty for dying. Dying or finishing the
+    level ends the episode.
+    """
+    NEARBY_SPRITES = 8
+    NEARBY_DISTANCE = 400
+    FRAME_SIZE = (96, 72)
+    MAX_TICKS = 120 * ForeverEndEngine.FPS
+
+    PROGRESS_REWARD = 0.01
+    DEAD_REWARD = -10.0
+    LEVEL_COMPLETE_REWARD = 100.0
+
+    # Player state, then each nearby sprite.
+    PLAYER_VECTOR_SIZE = 11
+    SPRITE_VECTOR_SIZE = 7
+
+    def __init__(self, engine=None, observation=OBSERVE_VECTOR,
+                 frame_size=FRAME_SIZE, max_ticks=MAX_TICKS):
+        assert observation in (OBSERVE_VECTOR, OBSERVE_FRAME)
+
+        self.engine = engine or create_headless_engine()
+        self.observation = observation
+        self.frame_size = frame_size
+        self.max_ticks = max_ticks
+        self.num_actions = len(ACTIONS)
+        self.level_num = 0
+        self.ticks = 0
+        self.best_x = 0
+        self.outcome = None
+
+        if observation == OBSERVE_VECTOR:
+            self.observation_size = (self.PLAYER_VECTOR_SIZE +
+                                     self.NEARBY_SPRITES *
+                                     self.SPRITE_VECTOR_SIZE)
+        else:
+            self.observation_size = frame_size + (3,)
+
+    def reset(self, level=0, seed=None):
+        engine = self.engine
+        player = engine.player
+
+        if seed is not None:
+            random.seed(seed)
+
+        player.lives = player.MAX_LIVES
+        player.health = player.MAX_HEALTH
+        engine.switch_level(level)
+        engine.active_cutscene = None
+        engine.paused = False
+
+        self.level_num = level
+        self.ticks = 0
+        self.best_x = player.rect.left
+        self.outcome = None
+
+        return self.get_observation()
+
+    def step(self, action):
+        engine = self.engine
+
+        engine.simulation = self
+
+        try:
+            engine.simulate_tick(ACTIONS[action])
+        finally:
+            engine.simulation = None
+
+        self.ticks += 1
+
+        x = engine.player.rect.left
+        reward = 0.0
+
+        if x > self.best_x:
+            reward += (x - self.best_x) * self.PROGRESS_REWARD
+            self.best_x = x
+
+        if self.outcome == 'level_complete':
+            reward += self.LEVEL_COMPLETE_REWARD
+        elif self.outcome:
+            reward += self.DEAD_REWARD
+
+        done = bool(self.outcome) or self.ticks >= self.max_ticks
+        info = {
+            'outcome': self.outcome,
+            'ticks': self.ticks,
+        }
+
+        return self.get_observation(), reward, done, info
+
+    def end(self, outcome):
+        # Called by the engine when the player dies or finishes the level.
+        if not self.outcome:
+            self.outcome = outcome
+
+    def get_state(self):
+        """Returns the state of the episode, to be passed to set_state."""
+        return (save_state(self.engine), self.engine.held_keys,
+                self.level_num, self.ticks, self.best_x, self.outcome)
+
+    def set_state(self, state):
+        data, held_keys, self.level_num, self.ticks, self.best_x, \
+            self.outcome = state
+        load_state(self.engine, data)
+        self.engine.held_keys = held_keys
+
+    def get_observation(self):
+        if self.observation == OBSERVE_VECTOR:
+            return self.get_vector()
+        else:
+            return self.get_frame()
+
+    def get_vector(self):
+        engine = self.engine
+        player = engine.player
+        level = engine.active_level
+        width, height = level.active_area.size
+        vector = [
+            float(player.rect.left) / width,
+            float(player.rect.top) / height,
+            player.velocity[0] / float(player.MOVE_SPEED),
+            player.velocity[1] / float(player.MOVE_SPEED),
+            float(player.falling),
+            float(player.jumping),
+            float(player.hovering),
+            float(player.reverse_gravity),
+            float(bool(player.tractor_beam.item)),
+            float(player.health) / player.MAX_HEALTH,
+            float(level.time_periods.index(level.active_time_period)),
+        ]
+
+        for sprite in self._get_nearby_sprites():
+            vector += [
+                float(sprite.rect.left - player.rect.left) /
+                self.NEARBY_DISTANCE,
+                float(sprite.rect.top - player.rect.top) /
+                self.NEARBY_DISTANCE,
+                float(sprite.rect.width) / self.NEARBY_DISTANCE,
+                float(sprite.rect.height) / self.NEARBY_DISTANCE,
+                float(sprite.collidable),
+                float(sprite.lethal),
+                float(sprite.grabbable),
+            ]
+
+        vector += [0.0] * (self.observation_size - len(vector))
+
+        return vector
+
+    def get_frame(self):
+        """Returns a downscaled frame of the screen, as a width x height x 3
+        array. This requires numpy.
+        """
+        self.engine.camera.update()
+
+        # The engine's view is only valid for this tick.
+        return self.engine.get_frame(self.frame_size).copy()
+
+    def _get_nearby_sprites(self):
+        player = self.engine.player
+        ignored = set([player, player.propulsion_below, player.tractor_beam])
+        search_rect = player.rect.inflate(self.NEARBY_DISTANCE * 2,
+                                          self.NEARBY_DISTANCE * 2)
+        quad_tree = self.engine.active_level.active_area.main_layer.quad_tree
+        distances = {}
+
+        # Sprites can be in more than one quadrant.
+        for sprite in quad_tree.get_sprites(search_rect):
+            if (sprite not in ignored and sprite not in distances and
+                sprite.visible and search_rect.colliderect(sprite.rect)):
+                dx = sprite.rect.centerx - player.rect.centerx
+                dy = sprite.rect.centery - player.rect.centery
+                distances[sprite] = dx * dx + dy * dy
+
+        sprites = sorted(distances.iterkeys(), key=distances.get)
+
+        return sprites[:self.NEARBY_SPRITES]
+
+
+class VectorForeverEndEnv(object):
+    """Steps several environments in lockstep.
+
+    There can only be one engine per process, so each environment runs
+    in its own worker process with its own engine, and is stepped there.
+    Environments that finish are reset right away, with the final
+    observation of the episode in the info as 'final_observation'.
+
+    close() must be called to shut down the workers.
+    """
+    def __init__(self, num_envs, **kwargs):
+        self.num_envs = num_envs
+        self.conns = []
+        self.workers = []
+
+        for i in xrange(num_envs):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_run_env_worker,
+                                             args=(worker_conn, kwargs))
+            worker.daemon = True
+            worker.start()
+            worker_conn.close()
+
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+        self.num_actions, self.observation_size = self.conns[0].recv()
+
+        for conn in self.conns[1:]:
+            conn.recv()
+
+    def reset(self, level=0, seed=None):
+        for i, conn in enumerate(self.conns):
+            if seed is None:
+                env_seed = None
+            else:
+                env_seed = seed + i
+
+            conn.send(('reset', (level, env_seed)))
+
+        return [conn.recv() for conn in self.conns]
+
+    def step(self, actions):
+        assert len(actions) == self.num_envs
+
+        for conn, action in zip(self.conns, actions):
+            conn.send(('step', (action,)))
+
+        results = [conn.recv() for conn in self.conns]
+
+        return map(list, zip(*results))
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', ()))
+            conn.close()
+
+        for worker in self.workers:
+            worker.join()
+
+        self.conns = []
+        self.workers = []
+
+
+def _run_env_worker(conn, kwargs):
+    env = ForeverEndEnv(**kwargs)
+    conn.send((env.num_actions, env.observation_size))
+
+    while True:
+        command, args = conn.recv()
+
+        if command == 'reset':
+            conn.send(env.reset(*args))
+        elif command == 'step':
+            observation, reward, done, info = env.step(*args)
+
+            if done:
+                info['final_observation'] = observation
+                observation = env.reset(env.level_num)
+
+            conn.send((observation, reward, done, info))
+        elif command == 'close':
+            break
+
+    conn.close()
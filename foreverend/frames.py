@@ -0,0 +1,131 @@
+import pygame
+
+try:
+    import numpy
+    import pygame.surfarray
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+
+class FrameExporter(object):
+    """Exposes the current frame as NumPy arrays, without copying it.
+
+    The full frame is a pixels3d view straight into the camera's region
+    of the surface the level is drawn to. Downscaled frames are scaled
+    into a surface kept for each size, and viewed the same way.
+    Greyscale frames are worked out into arrays kept for each size, so
+    nothing is allocated per frame.
+
+    Views lock the surfaces they refer to, so they're only valid until
+    the next frame is drawn, when they're released. The frame isn't
+    drawn again until the next tick, so a view stays valid (and
+    unchanged) for the rest of the tick it was taken in. Copy the array
+    to keep a frame around. A view that's kept anyway is left with the
+    surface it locked, and the frame is drawn to a copy from then on.
+    """
+    # Weights for the luma of each channel, out of 256.
+    GREY_WEIGHTS = (77, 150, 29)
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.frame_num = None
+        self.views = {}
+        self.scaled_surfaces = {}
+        self.grey_buffers = {}
+
+    def get_frame(self, size=None, greyscale=False):
+        """Returns a view of the current frame.
+
+        The view is a width x height x 3 array of RGB values, or a width x
+        height array for greyscale. If size is given, the frame is
+        downscaled to that size first.
+        """
+        if not has_numpy:
+            raise RuntimeError('Exporting frames requires numpy')
+
+        engine = self.engine
+
+        if self.frame_num != engine.frame_num:
+            engine.draw_level()
+
+        key = (size, greyscale)
+
+        try:
+            return self.views[key]
+        except KeyError:
+            pass
+
+        if greyscale:
+            view = self._get_grey_view(size)
+        elif size:
+            view = pygame.surfarray.pixels3d(self._get_scaled_surface(size))
+        else:
+            view = pygame.surfarray.pixels3d(
+                engine.surface.subsurface(engine.camera.rect))
+
+        self.views[key] = view
+
+        return view
+
+    def release(self):
+        """Releases the views, so the surfaces can be drawn to again.
+
+        This is called before each frame is drawn.
+        """
+        engine = self.engine
+        self.views = {}
+        self.frame_num = None
+
+        for size, surface in self.scaled_surfaces.items():
+            if surface.get_locked():
+                # A view is still using it. It's scaled into from scratch
+                # each frame, so a new one is made next time.
+                del self.scaled_surfaces[size]
+
+        if engine.surface.get_locked():
+            # The level may only redraw what's changed, so the frame is
+            # carried over. Locked surfaces can't be blitted from.
+            surface = pygame.Surface(engine.surface.get_size(), 0,
+                                     engine.surface)
+            pygame.surfarray.blit_array(
+                surface, pygame.surfarray.array2d(engine.surface))
+            engine.surface = surface
+
+    def _get_scaled_surface(self, size):
+        engine = self.engine
+
+        try:
+            surface = self.scaled_surfaces[size]
+        except KeyError:
+            surface = pygame.Surface(size, 0, 32)
+            self.scaled_surfaces[size] = surface
+
+        pygame.transform.scale(engine.surface.subsurface(engine.camera.rect),
+                               size, surface)
+
+        return surface
+
+    def _get_grey_view(self, size):
+        # Work from the (cheaper) scaled frame if there is one.
+        rgb = self.get_frame(size)
+        shape = rgb.shape[:2]
+
+        try:
+            grey, total, channel = self.grey_buffers[shape]
+        except KeyError:
+            grey = numpy.empty(shape, numpy.uint8)
+            total = numpy.empty(shape, numpy.uint16)
+            channel = numpy.empty(shape, numpy.uint16)
+            self.grey_buffers[shape] = (grey, total, channel)
+
+        total[...] = 0
+
+        for i, weight in enumerate(self.GREY_WEIGHTS):
+            channel[...] = rgb[:, :, i]
+            channel *= weight
+            total += channel
+
+        numpy.right_shift(total, 8, grey)
+
+        return grey
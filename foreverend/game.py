@@ -1,12 +1,66 @@
 #!/usr/bin/env python
 
+import multiprocessing
+import shlex
+from optparse import OptionParser
+
 import pygame
 from pygame.locals import *
 
+from foreverend.capture import FrameCapture
 from foreverend.engine import ForeverEndEngine
 
 
+def parse_options():
+    parser = OptionParser()
+    parser.add_option('--capture', metavar='FILE',
+                      help='capture each frame played as raw RGB to FILE')
+    parser.add_option('--capture-command', metavar='COMMAND',
+                      help='capture each frame played as raw RGB to the '
+                           'standard input of COMMAND, such as an encoder')
+    parser.add_option('--capture-frames', type='int', metavar='NUM',
+                      default=60 * ForeverEndEngine.FPS,
+                      help='the most frames to capture to FILE '
+                           '[default: %default]')
+    parser.add_option('--capture-block', action='store_true',
+                      default=False,
+                      help='wait for captured frames to be written, rather '
+                           'than dropping them')
+
+    options, args = parser.parse_args()
+
+    if options.capture and options.capture_command:
+        parser.error('--capture and --capture-command are exclusive')
+
+    return options
+
+
+def setup_capture(engine, options):
+    def on_level_changed():
+        # The camera, and so the frame size, only exists once the game's
+        # been set up.
+        if engine.frame_capture:
+            return
+
+        frame_capture = FrameCapture(engine, block=options.capture_block)
+
+        if options.capture:
+            frame_capture.open_file(options.capture, options.capture_frames)
+        else:
+            frame_capture.open_process(
+                shlex.split(options.capture_command))
+
+        engine.frame_capture = frame_capture
+
+    engine.level_changed.connect(on_level_changed)
+
+
 def main():
+    # Needed for the image decoding workers in frozen builds.
+    multiprocessing.freeze_support()
+
+    options = parse_options()
+
     pygame.init()
 
     version = pygame.__version__.split('.')
@@ -19,6 +73,10 @@ def main():
     pygame.display.set_caption("Forever End")
 
     engine = ForeverEndEngine(screen)
+
+    if options.capture or options.capture_command:
+        setup_capture(engine, options)
+
     engine.run()
 
     pygame.quit()
@@ -4,7 +4,9 @@ import pygame
 from pygame.locals import *
 
 from foreverend.eventbox import EventBox
+from foreverend.resources import list_images
 from foreverend.signals import Signal
+from foreverend.snapshot import LevelSnapshot
 from foreverend.sprites.common import Crossover
 from foreverend.sprites.items import Artifact
 from foreverend.timer import Timer
@@ -22,6 +24,10 @@ class QuadTree(object):
         self.cy = self.rect.centery
         self.moved_cnxs = {}
 
+        # Sprites re-indexed by reindex_sprites(), with the rects they were
+        # indexed at.
+        self.reindexed = {}
+
         if depth == 0:
             self.nw_tree = None
             self.ne_tree = None
@@ -48,7 +54,7 @@ class QuadTree(object):
         if not self.parent:
             assert sprite not in self.moved_cnxs
             self.moved_cnxs[sprite] = sprite.moved.connect(
-                lambda dx, dy: self._recompute_sprite(sprite))
+                lambda dx, dy: self._on_sprite_moved(sprite))
 
         # If it's overlapping all regions, or we're a leaf, it
         # belongs in items. Otherwise, stick it in as many regions as
@@ -97,6 +103,15 @@ class QuadTree(object):
     def __iter__(self):
         return self.get_sprites()
 
+    def get_all_sprites(self):
+        """Returns every sprite in the tree, once each.
+
+        This is quicker than walking the quadrants.
+        """
+        assert not self.parent
+
+        return self.moved_cnxs.keys()
+
     def _get_trees(self, rect):
         if self.depth > 0:
             if not rect or (rect.left <= self.cx and rect.top <= self.cy):
@@ -121,6 +136,23 @@ class QuadTree(object):
                 for leaf in tree._get_leaf_trees(rect):
                     yield leaf
 
+    def reindex_sprites(self, sprites):
+        """Re-indexes sprites whose rects were changed directly.
+
+        Until done_reindexing() is called, the moved signals for these
+        sprites won't re-index them again, unless they've moved since.
+        """
+        for sprite in sprites:
+            self._recompute_sprite(sprite)
+            self.reindexed[sprite] = pygame.Rect(sprite.rect)
+
+    def done_reindexing(self):
+        self.reindexed = {}
+
+    def _on_sprite_moved(self, sprite):
+        if self.reindexed.get(sprite) != sprite.rect:
+            self._recompute_sprite(sprite)
+
     def _recompute_sprite(self, sprite):
         assert sprite.quad_trees
 
@@ -130,38 +162,221 @@ class QuadTree(object):
             self.add(sprite)
 
 
+class ChunkCache(object):
+    """Pre-composites a layer's static sprites into fixed-size chunks.
+
+    Chunks are baked lazily as the camera nears them, and only the
+    visible ones are drawn. A chunk is thrown away when any sprite baked
+    into it is hidden, removed, moved or given a new image. Sprites that
+    change after being baked are handed back to the sprite group to be
+    drawn normally from then on.
+    """
+    CHUNK_SIZE = 512
+    BAKE_MARGIN = 256
+    MAX_CHUNKS = 32
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.chunks = {}
+
+    def invalidate(self, rect):
+        for key in self._get_chunk_keys(rect):
+            self.chunks.pop(key, None)
+
+    def clear(self):
+        self.chunks = {}
+
+    def draw(self, surface, camera_rect):
+        bake_rect = camera_rect.inflate(self.BAKE_MARGIN * 2,
+                                        self.BAKE_MARGIN * 2)
+        keys = list(self._get_chunk_keys(bake_rect))
+        baked_offscreen = False
+
+        if len(self.chunks) > self.MAX_CHUNKS:
+            # Drop the chunks the camera has left behind.
+            for key in set(self.chunks) - set(keys):
+                del self.chunks[key]
+
+        for key in keys:
+            chunk_rect = self._get_chunk_rect(key)
+            visible = chunk_rect.colliderect(camera_rect)
+            chunk = self.chunks.get(key)
+
+            if chunk and not self._validate_chunk(chunk):
+                chunk = None
+
+            if not chunk:
+                # Chunks near the camera are baked ahead of time, but only
+                # one per frame, to spread the cost out.
+                if not visible:
+                    if baked_offscreen:
+                        continue
+
+                    baked_offscreen = True
+
+                chunk = self._bake_chunk(chunk_rect)
+                self.chunks[key] = chunk
+
+            image = chunk[0]
+
+            if visible and image:
+                surface.blit(image, chunk_rect.topleft)
+
+    def _get_chunk_keys(self, rect):
+        rect = rect.clip(pygame.Rect((0, 0), self.layer.area.size))
+        size = self.CHUNK_SIZE
+
+        for row in xrange(rect.top / size, (rect.bottom - 1) / size + 1):
+            for col in xrange(rect.left / size, (rect.right - 1) / size + 1):
+                yield col, row
+
+    def _get_chunk_rect(self, key):
+        col, row = key
+        size = self.CHUNK_SIZE
+
+        return pygame.Rect(col * size, row * size, size, size).clip(
+            pygame.Rect((0, 0), self.layer.area.size))
+
+    def _bake_chunk(self, rect):
+        baked = []
+        seen = set()
+
+        for sprite in self.layer.quad_tree.get_sprites(rect):
+            if (sprite not in seen and sprite.can_bake and sprite.visible and
+                sprite.image and sprite.rect.colliderect(rect)):
+                seen.add(sprite)
+                baked.append((sprite, sprite.image, tuple(sprite.rect)))
+
+        if not baked:
+            return None, baked
+
+        image = pygame.Surface(rect.size).convert_alpha()
+        image.fill((0, 0, 0, 0))
+
+        for sprite, sprite_image, sprite_rect in baked:
+            image.blit(sprite_image,
+                       (sprite_rect[0] - rect.left, sprite_rect[1] - rect.top))
+
+        return image, baked
+
+    def _validate_chunk(self, chunk):
+        valid = True
+
+        for sprite, image, rect in chunk[1]:
+            if not sprite.can_bake or not sprite.visible:
+                valid = False
+            elif sprite.image is not image or tuple(sprite.rect) != rect:
+                # The sprite is changing, so stop baking it.
+                sprite.can_bake = False
+                self.invalidate(pygame.Rect(rect))
+                self.invalidate(sprite.rect)
+                self.layer.update_sprite(sprite)
+                valid = False
+
+        return valid
+
+
 class Layer(object):
-    def __init__(self, index, area):
+    SNAPSHOT_MAX_AGE_MS = 5000
+
+    def __init__(self, index, area, baked=False):
         self.area = area
         self.index = index
         self.quad_tree = QuadTree(pygame.Rect(0, 0, *self.area.size))
+        self.snapshot = None
+        self.snapshot_rect = None
+        self.snapshot_time = 0
+
+        if baked:
+            self.chunk_cache = ChunkCache(self)
+        else:
+            self.chunk_cache = None
 
     def __repr__(self):
         return 'Layer %s on time period %s' % (self.index, self.area)
 
     def add(self, *objs):
         for obj in objs:
-            obj.layer = self
-            self.update_sprite(obj)
-            self.quad_tree.add(obj)
+            self.attach(obj)
             obj.on_added(self)
 
     def remove(self, *objs):
         for obj in objs:
-            self.update_sprite(obj, True)
-            self.quad_tree.remove(obj)
+            self.detach(obj)
             obj.on_removed(self)
 
+    def attach(self, sprite):
+        """Places a sprite on the layer without notifying it.
+
+        This is used when restoring saved state, where anything the
+        sprite would do when added is already part of that state.
+        """
+        sprite.layer = self
+        self.update_sprite(sprite)
+        self.quad_tree.add(sprite)
+
+    def detach(self, sprite):
+        """Takes a sprite off the layer without notifying it."""
+        self.update_sprite(sprite, True)
+        self.quad_tree.remove(sprite)
+
     def update_sprite(self, sprite, force_remove=False):
         assert sprite.layer == self
 
-        sprite.update_image()
+        sprite.ensure_image()
 
-        if sprite.visible and not force_remove:
+        if self.chunk_cache and sprite.can_bake:
+            # The sprite is drawn as part of the baked chunks instead.
+            self.chunk_cache.invalidate(sprite.rect)
+            self.area.group.remove(sprite)
+        elif sprite.visible and not force_remove:
             self.area.group.add(sprite, layer=self.index)
         else:
             self.area.group.remove(sprite)
 
+    def get_snapshot(self, rect, region=None):
+        """Returns a rendering of the layer's sprites within rect.
+
+        The rendering is a subsurface of a cached snapshot of the layer,
+        covering region (or just rect, if not provided). The snapshot is
+        only rebuilt when it no longer covers rect or has grown older than
+        SNAPSHOT_MAX_AGE_MS.
+        """
+        area_rect = pygame.Rect((0, 0), self.area.size)
+        rect = rect.clip(area_rect)
+        now = pygame.time.get_ticks()
+
+        if (not self.snapshot or
+            not self.snapshot_rect.contains(rect) or
+            now - self.snapshot_time > self.SNAPSHOT_MAX_AGE_MS):
+            region = (region or rect).union(rect).clip(area_rect)
+            self._build_snapshot(region)
+            self.snapshot_time = now
+
+        return self.snapshot.subsurface(
+            rect.move(-self.snapshot_rect.left, -self.snapshot_rect.top))
+
+    def clear_snapshot(self):
+        self.snapshot = None
+        self.snapshot_rect = None
+
+    def _build_snapshot(self, rect):
+        # Any existing subsurfaces keep the old snapshot alive, so this
+        # always renders into a new surface.
+        snapshot = pygame.Surface(rect.size).convert_alpha()
+        snapshot.fill((0, 0, 0, 0))
+        seen = set()
+
+        for sprite in self.quad_tree.get_sprites(rect):
+            if sprite not in seen and sprite.visible:
+                seen.add(sprite)
+                snapshot.blit(sprite.image,
+                              (sprite.rect.left - rect.left,
+                               sprite.rect.top - rect.top))
+
+        self.snapshot = snapshot
+        self.snapshot_rect = rect
+
     def __iter__(self):
         return iter(self.quad_tree)
 
@@ -173,6 +388,17 @@ class Level(object):
     CROSSOVER_TIME_INTERVAL = (4000, 10000)
     MAX_CROSSOVERS = 3
 
+    # Areas are built the first time they're needed. Any left unbuilt are
+    # built in the background, a few at a time, once the level starts.
+    PREWARM_DELAY_MS = 1000
+    PREWARM_INTERVAL_MS = 250
+    PREWARM_BUDGET_MS = 8
+
+    # The asset manifest. Every image in asset_dirs (under data/) is
+    # considered used by the level, along with any images in assets.
+    asset_dirs = []
+    assets = []
+
     def __init__(self, engine):
         self.engine = engine
         self.time_periods = []
@@ -182,6 +408,8 @@ class Level(object):
         self.crossovers = []
         self.pending_crossovers = {}
         self.next_crossover_id = 0
+        self.prewarm_timer = None
+        self.snapshot = None
 
         self.engine.tick.connect(self.on_tick)
 
@@ -200,20 +428,100 @@ class Level(object):
                               y - self.artifact.rect.height - 50)
         self.artifact.grab_changed.connect(self.on_artifact_grabbed)
 
+    @classmethod
+    def get_assets(cls):
+        names = list(cls.assets)
+
+        for dirname in cls.asset_dirs:
+            names += list_images(dirname)
+
+        return names
+
     def reset(self):
-        self.active_area = None
-        self.active_time_period = None
-        self.time_periods = []
-        self._setup()
+        if self.snapshot:
+            # Put everything back the way it was after setup, rather
+            # than building it all again.
+            self.snapshot.restore()
+            self._start_prewarm()
+        else:
+            self.active_area = None
+            self.active_time_period = None
+            self.time_periods = []
+            self._setup()
 
     def setup(self):
         pass
 
     def _setup(self):
+        self.snapshot = LevelSnapshot(self)
+        running = self.snapshot.get_running()
         self.setup()
+        self.snapshot.capture_level(running)
+        self._start_prewarm()
+
+    def _start_prewarm(self):
+        if self.prewarm_timer:
+            self.prewarm_timer.stop()
+
+        self.prewarm_timer = Timer(self.PREWARM_DELAY_MS, self._prewarm_areas)
 
+    def get_built_areas(self):
         for time_period in self.time_periods:
-            time_period.setup()
+            for area in time_period.areas.itervalues():
+                if area.built:
+                    yield area
+
+    def get_unbuilt_areas(self):
+        for time_period in self.time_periods:
+            for area in time_period.areas.itervalues():
+                if not area.built:
+                    yield area
+
+    def build_area_for(self, sprite):
+        """Builds areas until one of them contains the given sprite.
+
+        Areas in the active time period are tried first.
+        """
+        areas = list(self.get_unbuilt_areas())
+
+        if self.active_time_period:
+            areas.sort(key=lambda area:
+                       area.time_period != self.active_time_period)
+
+        for area in areas:
+            if sprite.layer:
+                break
+
+            area.build()
+
+    def _prewarm_areas(self):
+        if self.engine.active_level != self:
+            return
+
+        self.prewarm_timer.ms = self.PREWARM_INTERVAL_MS
+        start_time = pygame.time.get_ticks()
+        built_any = False
+        skipped_any = False
+
+        for area in list(self.get_unbuilt_areas()):
+            if built_any:
+                remaining_ms = (self.PREWARM_BUDGET_MS -
+                                (pygame.time.get_ticks() - start_time))
+
+                # Don't start what won't fit. It's left for a later
+                # interval, which at least one area is always built in.
+                if area.get_build_cost() >= remaining_ms:
+                    skipped_any = True
+                    continue
+
+            area.build()
+            built_any = True
+
+        if skipped_any:
+            return
+
+        self.prewarm_timer.stop()
+        self.prewarm_timer = None
 
     def switch_area(self, area):
         if area == self.active_area:
@@ -224,11 +532,24 @@ class Level(object):
         if self.active_area:
             self.active_area.main_layer.remove(player)
 
+        if self.active_area:
+            # Only the active area needs its chunks baked.
+            for layer in self.active_area.layers:
+                if layer.chunk_cache:
+                    layer.chunk_cache.clear()
+
         self.active_area = area
+
+        # Snapshots are only used for areas seen through crossovers.
+        for layer in self.active_area.layers:
+            layer.clear_snapshot()
+
         self.active_area.main_layer.add(player)
         self.area_changed.emit()
         player.reset_gravity()
+        self.clear_crossovers()
 
+    def clear_crossovers(self):
         for crossover, timer in self.crossovers:
             timer.stop()
             crossover.remove()
@@ -250,6 +571,9 @@ class Level(object):
 
         player = self.engine.player
 
+        if area:
+            area.build()
+
         if (area and
             (not self.active_area or
              not list(player.get_collisions(tree=area.main_layer.quad_tree)))):
@@ -295,11 +619,13 @@ class Level(object):
 
         key = self.active_area.key
 
+        # Areas that haven't been built yet have nothing to show.
         time_periods = [
             time_period.areas[key]
             for time_period in self.time_periods
             if (time_period != self.active_time_period and
-                key in time_period.areas)
+                key in time_period.areas and
+                time_period.areas[key].built)
         ]
 
         if len(time_periods) - 1 <= 0:
@@ -308,8 +634,7 @@ class Level(object):
         i = random.randint(0, len(time_periods) - 1)
 
 
-        crossover_sprite = Crossover(time_periods[i])
-        crossover_sprite.rect = self.engine.camera.rect
+        crossover_sprite = Crossover(time_periods[i], self.engine.camera.rect)
 
         if random.randint(0, 5) <= 3:
             layer = self.active_area.bg_layer
@@ -345,28 +670,64 @@ class TimePeriod(object):
 
     def setup(self):
         for area in self.areas.itervalues():
-            area.setup()
+            area.build()
 
 
 class Area(object):
+    # How long each kind of area last took to build, in milliseconds.
+    build_costs = {}
+
     def __init__(self, level):
         assert isinstance(level, Level)
         self.key = 'default'
         self.level = level
         self.engine = level.engine
+        self.built = False
         self.layers = []
+        self.group = None
+        self.default_layer = None
+        self.bg_layer = None
+        self.main_layer = None
+        self.fg_layer = None
+        self.event_handlers = []
+        self.timers = []
+        self.particle_systems = []
+
+    def build(self):
+        """Builds the area's layers and sets it up, if not already built."""
+        if self.built:
+            return
+
+        start_time = pygame.time.get_ticks()
+        self.built = True
         self.group = pygame.sprite.LayeredDirty()
         self.default_layer = self.new_layer()
-        self.bg_layer = self.new_layer()
+        self.bg_layer = self.new_layer(baked=True)
         self.main_layer = self.new_layer()
         self.fg_layer = self.new_layer()
         self.layers = [self.bg_layer, self.main_layer, self.fg_layer]
-        self.event_handlers = []
-        self.timers = []
-        self.particle_systems = []
 
-    def new_layer(self):
-        layer = Layer(len(self.layers), self)
+        running = self.level.snapshot.get_running()
+        self.setup()
+        self.level.snapshot.capture_area(self, running)
+        Area.build_costs[type(self)] = pygame.time.get_ticks() - start_time
+
+    def get_build_cost(self):
+        """Returns how long the area is expected to take to build, in ms.
+
+        Kinds of areas not built before are expected to take as long as
+        the slowest seen so far.
+        """
+        try:
+            return self.build_costs[type(self)]
+        except KeyError:
+            return max(self.build_costs.values() or [0])
+
+    def setup(self):
+        pass
+
+    def new_layer(self, baked=False):
+        layer = Layer(len(self.layers), self, baked)
         layer.area = self
         self.layers.append(layer)
         return layer
@@ -375,7 +736,14 @@ class Area(object):
         pass
 
     def draw(self, screen):
+        camera_rect = self.engine.camera.rect
+
         self.draw_bg(screen)
+
+        for layer in self.layers:
+            if layer.chunk_cache:
+                layer.chunk_cache.draw(screen, camera_rect)
+
         self.group.draw(screen)
 
         if self.engine.debug_rects:
@@ -392,7 +760,9 @@ class Area(object):
                         pygame.draw.rect(screen, (255, 0, 0), rect, 1)
 
         for particle_system in self.particle_systems:
-            particle_system.draw(screen)
+            # Systems entirely off-screen aren't drawn.
+            if particle_system.is_visible(camera_rect):
+                particle_system.draw(screen)
 
     def register_for_events(self, obj):
         self.event_handlers.append(obj)
@@ -268,6 +268,12 @@ class Outside65000000BC(Level1Area):
 
 
 class Level1(Level):
+    asset_dirs = ['600ad', '1999ad', '65000000bc']
+    assets = ['artifact1', 'explosion', 'ground', 'mountain_bg',
+              'mountain_bottom', 'mountain_cover', 'mountain_top'] + \
+             ['mountain_left_%s' % i for i in range(1, 6)] + \
+             ['mountain_right_%s' % i for i in range(1, 6)]
+
     def __init__(self, *args, **kwargs):
         super(Level1, self).__init__(*args, **kwargs)
         self.name = 'Level 1'
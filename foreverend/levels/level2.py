@@ -407,6 +407,9 @@ class Pyramid2300AD(Level2PyramidArea):
 
 
 class Level2(Level):
+    asset_dirs = ['12000bc', '1000ad', '2300ad']
+    assets = ['artifact1', 'explosion']
+
     def __init__(self, *args, **kwargs):
         super(Level2, self).__init__(*args, **kwargs)
         self.name = 'Level 2'
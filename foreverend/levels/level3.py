@@ -560,6 +560,10 @@ class BlueBoxArea(Area):
 
 
 class Level3(Level):
+    asset_dirs = ['1ne', '300ne', '40000000ad']
+    assets = ['65000000bc/lava_pool', 'artifact1', 'explosion', 'probe_large',
+              'questionmark']
+
     def __init__(self, *args, **kwargs):
         super(Level3, self).__init__(*args, **kwargs)
         self.name = 'Level 3'
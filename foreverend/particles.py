@@ -41,6 +41,81 @@ class Particle(object):
         surface.blit(image, self.pos)
 
 
+class ParticlePool(object):
+    """A process-wide pool of Particles shared by all ParticleSystems.
+
+    Systems borrow particles when they start and hand them back when
+    they stop, so explosions don't churn through new allocations. At most
+    max_size free particles are kept around for reuse.
+    """
+    MAX_SIZE = 512
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.free_particles = []
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.allocated = 0
+        self.discarded = 0
+
+    def acquire(self, system, count):
+        particles = []
+
+        for i in range(count):
+            if self.free_particles:
+                particle = self.free_particles.pop()
+                particle.system = system
+            else:
+                particle = Particle(system)
+                self.allocated += 1
+
+            particle.lifetime = 0.0
+            particle.elapsed_time = 0.0
+            particles.append(particle)
+
+        self.in_use += count
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+        return particles
+
+    def release(self, particles):
+        for particle in particles:
+            particle.system = None
+
+            if len(self.free_particles) < self.max_size:
+                self.free_particles.append(particle)
+            else:
+                self.discarded += 1
+
+        self.in_use -= len(particles)
+
+    def reclaim(self, system, particles):
+        """Takes particles released by a system back out of the pool."""
+        for particle in particles:
+            particle.system = system
+
+            try:
+                self.free_particles.remove(particle)
+            except ValueError:
+                # It was discarded, or never released.
+                pass
+
+        self.in_use += len(particles)
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def get_stats(self):
+        return {
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'free': len(self.free_particles),
+            'allocated': self.allocated,
+            'discarded': self.discarded,
+        }
+
+
+particle_pool = ParticlePool()
+
+
 class ParticleSystem(object):
     def __init__(self, area):
         # Settings
@@ -67,6 +142,7 @@ class ParticleSystem(object):
         self.particles = []
         self.free_particles = []
         self.pos = None
+        self.bounding_rect = None
 
         self.timer = Timer(60, self.on_particle_update)
 
@@ -74,17 +150,14 @@ class ParticleSystem(object):
         assert self.pos is None
         self.pos = (x, y)
 
-        self.particles = []
-
-        for i in range(self.max_particles):
-            self.particles.append(Particle(self))
-
+        self.particles = particle_pool.acquire(self, self.max_particles)
         self.free_particles = list(self.particles)
 
         if not self.image:
             self.image = load_image(self.particle_filename).convert_alpha()
 
         self.add_particles()
+        self.update_bounding_rect()
         self.area.particle_systems.append(self)
         self.timer.start()
 
@@ -98,10 +171,43 @@ class ParticleSystem(object):
     def stop(self):
         self.timer.stop()
         self.pos = None
+        self.bounding_rect = None
         self.area.particle_systems.remove(self)
+        particle_pool.release(self.particles)
         self.particles = []
         self.free_particles = []
 
+    def get_state(self):
+        """Returns the state of the running system, for set_state."""
+        bounding_rect = self.bounding_rect and pygame.Rect(self.bounding_rect)
+
+        return (self.pos, bounding_rect, list(self.particles),
+                list(self.free_particles),
+                [dict(particle.__dict__) for particle in self.particles])
+
+    def set_state(self, state):
+        """Puts the system back the way it was when get_state was called.
+
+        The system is started again if it has stopped since, taking its
+        particles back from the pool.
+        """
+        if self.pos is not None:
+            self.stop()
+
+        (self.pos, bounding_rect, particles, free_particles,
+         particle_states) = state
+
+        particle_pool.reclaim(self, particles)
+        self.particles = list(particles)
+        self.free_particles = list(free_particles)
+        self.bounding_rect = bounding_rect and pygame.Rect(bounding_rect)
+
+        for particle, particle_state in zip(particles, particle_states):
+            particle.__dict__.update(particle_state)
+
+        self.area.particle_systems.append(self)
+        self.timer.start()
+
     def setup_particle(self, particle):
         direction = self.random_direction()
 
@@ -133,6 +239,37 @@ class ParticleSystem(object):
     def random_float(self, min_value, max_value):
         return min_value + random.random() * (max_value - min_value)
 
+    def update_bounding_rect(self):
+        """Computes a rectangle containing every live particle.
+
+        Particles are drawn rotated and scaled from their position, so
+        the rectangle is padded by the largest size a particle image
+        can grow to.
+        """
+        positions = [
+            particle.pos
+            for particle in self.particles
+            if particle.active
+        ]
+
+        if not positions:
+            self.bounding_rect = None
+            return
+
+        xs = [pos[0] for pos in positions]
+        ys = [pos[1] for pos in positions]
+
+        # Rotation can grow the image by up to sqrt(2) along either axis.
+        pad = int(max(self.image.get_size()) * self.max_scale * 1.5)
+
+        self.bounding_rect = pygame.Rect(min(xs) - pad, min(ys) - pad,
+                                         max(xs) - min(xs) + 2 * pad,
+                                         max(ys) - min(ys) + 2 * pad)
+
+    def is_visible(self, rect):
+        return (self.bounding_rect is not None and
+                self.bounding_rect.colliderect(rect))
+
     def draw(self, surface):
         for particle in self.particles:
             if particle.active:
@@ -151,8 +288,11 @@ class ParticleSystem(object):
 
         if not self.repeat and active_count == 0:
             self.stop()
-        elif self.repeat:
-            self.add_particles()
+        else:
+            if self.repeat:
+                self.add_particles()
+
+            self.update_bounding_rect()
 
 
 class ExplosionParticleSystem(ParticleSystem):
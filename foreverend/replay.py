@@ -0,0 +1,423 @@
+import bisect
+import os
+import struct
+
+import pygame
+from pygame.locals import KEYDOWN, KEYUP
+
+from foreverend.savestate import StateError, encode_varint, load_state, \
+                                 save_state
+
+
+MAGIC = 'FEREPLAY'
+VERSION = 1
+HEADER_FORMAT = '<8sI'
+
+RECORD_KEYFRAME = 'K'
+RECORD_INPUT = 'I'
+RECORD_INDEX = 'X'
+
+# The last thing in a finished replay. It points to the index record.
+TRAILER_MAGIC = 'FERPLEND'
+TRAILER_FORMAT = '<Q8s'
+
+
+class ReplayRecorder(object):
+    """Records a replay of the game to a file, as it's played.
+
+    A replay is a header, a stream of records, and (once finished) an
+    index. There are two kinds of records:
+
+    * Keyframes, holding the full save state, along with the inputs, at
+      the start of a tick. One is written every KEYFRAME_INTERVAL_SECS,
+      and whenever the game didn't carry on from the last recorded tick
+      (when rewound or switching levels). Those are marked as
+      discontinuities, and the player loads their state rather than
+      simulating up to them.
+
+    * Inputs, for a tick where they changed.
+
+    The inputs are the keys held down, the time period, and every key
+    pressed or released during the tick, in order. The key presses are
+    needed to replay keys pressed and released within a single tick.
+
+    Each record starts with its kind and tick, so the file can be read
+    as it's being written. When closed, an index of keyframe ticks and
+    offsets is written, followed by a trailer pointing to it, so a
+    player can seek straight to the keyframe nearest a tick.
+
+    record_tick() must be called at the start of every tick that's
+    played, after the events for it are handled.
+    """
+    KEYFRAME_INTERVAL_SECS = 10
+    FLUSH_INTERVAL_SECS = 1
+
+    def __init__(self, engine, filename):
+        self.engine = engine
+        self.file = open(filename, 'wb')
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION))
+        self.tick = 0
+        self.keyframes = []
+        self.level = None
+        self.inputs = None
+        self.next_frame_num = None
+        self.keyframe_pending = False
+        self.discontinuity_pending = False
+        self.keyframe_interval = self.KEYFRAME_INTERVAL_SECS * engine.FPS
+        self.flush_interval = self.FLUSH_INTERVAL_SECS * engine.FPS
+
+    def record_tick(self):
+        engine = self.engine
+        level = engine.active_level
+        inputs = (engine.held_keys,
+                  level.time_periods.index(level.active_time_period))
+        key_edges = engine.key_edges
+
+        if (level is not self.level or
+            engine.frame_num != self.next_frame_num):
+            self.discontinuity_pending = True
+
+        state = None
+
+        if (self.keyframe_pending or self.discontinuity_pending or
+            self.tick % self.keyframe_interval == 0):
+            try:
+                state = save_state(engine)
+            except StateError:
+                # This can't be saved until a scripted sequence is over,
+                # so try again next tick.
+                pass
+
+            self.keyframe_pending = state is None
+
+        if state is not None:
+            self.keyframes.append((self.tick, self.file.tell()))
+            self._write_record(RECORD_KEYFRAME, inputs, key_edges, state,
+                               self.discontinuity_pending)
+            self.discontinuity_pending = False
+            self.file.flush()
+        elif inputs != self.inputs or key_edges:
+            self._write_record(RECORD_INPUT, inputs, key_edges)
+
+        if self.tick % self.flush_interval == 0:
+            self.file.flush()
+
+        self.level = level
+        self.inputs = inputs
+        self.next_frame_num = engine.frame_num + 1
+        self.tick += 1
+
+    def mark_discontinuity(self):
+        """Makes the next tick start with a keyframe.
+
+        This must be called when the game state changes other than by
+        ticking, such as when rewinding.
+        """
+        self.next_frame_num = None
+
+    def close(self):
+        index_offset = self.file.tell()
+        chunks = [RECORD_INDEX, encode_varint(self.tick),
+                  encode_varint(len(self.keyframes))]
+
+        for tick, offset in self.keyframes:
+            chunks.append(encode_varint(tick))
+            chunks.append(encode_varint(offset))
+
+        self.file.write(''.join(chunks))
+        self.file.write(struct.pack(TRAILER_FORMAT, index_offset,
+                                    TRAILER_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def _write_record(self, kind, inputs, key_edges, state=None,
+                      discontinuity=False):
+        keys, time_period_num = inputs
+        chunks = [kind, encode_varint(self.tick), encode_varint(len(keys))]
+
+        for key in sorted(keys):
+            chunks.append(encode_varint(key))
+
+        chunks.append(encode_varint(time_period_num))
+        chunks.append(encode_varint(len(key_edges)))
+
+        for pressed, key in key_edges:
+            chunks.append(encode_varint(key << 1 | int(pressed)))
+
+        if state is not None:
+            chunks.append(encode_varint(int(discontinuity)))
+            chunks.append(encode_varint(len(state)))
+            chunks.append(state)
+
+        self.file.write(''.join(chunks))
+
+
+class ReplayRecord(object):
+    def __init__(self, kind, offset, tick=None, keys=None,
+                 time_period_num=None, key_edges=()):
+        self.kind = kind
+        self.offset = offset
+        self.end_offset = None
+        self.tick = tick
+        self.keys = keys
+        self.time_period_num = time_period_num
+        self.key_edges = key_edges
+        self.discontinuity = False
+        self.state_offset = None
+        self.state_len = 0
+
+
+class ReplayPlayer(object):
+    """Plays back a replay recorded by ReplayRecorder.
+
+    Seeking loads the nearest keyframe at or before the tick and
+    simulates forward from there, so it costs at most a keyframe
+    interval's worth of ticks, however long the replay is.
+
+    Playing on past a keyframe that marks a discontinuity loads its state,
+    since the game jumped there rather than ticking.
+
+    A replay that's still being recorded can be played. refresh() picks
+    up anything written since it was opened (or last refreshed).
+    """
+    def __init__(self, engine, filename):
+        self.engine = engine
+        self.file = open(filename, 'rb')
+        self.keyframes = []
+        self.keyframe_ticks = []
+        self.num_ticks = 0
+        self.finished = False
+        self.tick = None
+        self.keys = frozenset()
+        self.time_period_num = 0
+        self.next_record = None
+        self.next_offset = None
+        self.scan_offset = struct.calcsize(HEADER_FORMAT)
+        self.end_offset = None
+
+        magic, version = struct.unpack(
+            HEADER_FORMAT, self._read(0, struct.calcsize(HEADER_FORMAT)))
+
+        if magic != MAGIC:
+            raise StateError('This is not a replay')
+
+        if version != VERSION:
+            raise StateError('Unsupported replay version')
+
+        if not self._read_index():
+            self.refresh()
+
+    def close(self):
+        self.file.close()
+        self.file = None
+
+    def refresh(self):
+        """Reads any records added since the replay was last read."""
+        if self.finished or self._read_index():
+            return
+
+        offset = self.scan_offset
+
+        while True:
+            try:
+                record = self._read_record(offset)
+            except StateError:
+                # We've caught up with the recorder, possibly in the middle
+                # of a record.
+                break
+
+            if record.kind == RECORD_KEYFRAME:
+                self._add_keyframe(record.tick, record.offset)
+            elif record.kind != RECORD_INPUT:
+                break
+
+            self.num_ticks = max(self.num_ticks, record.tick + 1)
+            offset = record.end_offset
+
+        self.scan_offset = offset
+
+    def seek(self, tick):
+        """Puts the game at the start of the given tick of the replay."""
+        i = bisect.bisect_right(self.keyframe_ticks, tick) - 1
+
+        if i < 0:
+            raise StateError('There is no keyframe before tick %s' % tick)
+
+        self._load_keyframe(self._read_record(self.keyframes[i][1]))
+
+        while self.tick < tick and self.step():
+            pass
+
+    def step(self):
+        """Plays the next tick. Returns False at the end of the replay."""
+        if self.tick is None:
+            self.seek(0)
+        elif not self.next_record:
+            # More may have been recorded since.
+            self._read_next_record(self.next_offset)
+
+        key_edges = []
+
+        while self.next_record and self.next_record.tick <= self.tick:
+            record = self.next_record
+
+            if record.discontinuity:
+                # The game jumped here, so it can't be simulated up to.
+                # The state already reflects this tick's key presses.
+                self._load_keyframe(record)
+                key_edges = []
+            else:
+                self.keys = record.keys
+                self.time_period_num = record.time_period_num
+                key_edges += record.key_edges
+                self._read_next_record(record.end_offset)
+
+        if self.tick >= self.num_ticks:
+            return False
+
+        engine = self.engine
+        level = engine.active_level
+
+        if (level.time_periods.index(level.active_time_period) !=
+            self.time_period_num):
+            level.switch_time_period(self.time_period_num)
+
+        for pressed, key in key_edges:
+            if pressed:
+                event_type = KEYDOWN
+            else:
+                event_type = KEYUP
+
+            engine.handle_player_event(pygame.event.Event(event_type,
+                                                          key=key))
+
+        engine.simulate_tick(self.keys)
+        self.tick += 1
+
+        return True
+
+    def _load_keyframe(self, record):
+        load_state(self.engine, self._read(record.state_offset,
+                                           record.state_len))
+        self.engine.held_keys = record.keys
+        self.keys = record.keys
+        self.time_period_num = record.time_period_num
+        self.tick = record.tick
+        self._read_next_record(record.end_offset)
+
+    def _add_keyframe(self, tick, offset):
+        self.keyframes.append((tick, offset))
+        self.keyframe_ticks.append(tick)
+
+    def _read_index(self):
+        trailer_size = struct.calcsize(TRAILER_FORMAT)
+        self.file.seek(0, os.SEEK_END)
+        file_size = self.file.tell()
+
+        if file_size < struct.calcsize(HEADER_FORMAT) + trailer_size:
+            return False
+
+        index_offset, magic = struct.unpack(
+            TRAILER_FORMAT, self._read(file_size - trailer_size,
+                                       trailer_size))
+
+        if magic != TRAILER_MAGIC:
+            return False
+
+        self.file.seek(index_offset)
+
+        if self.file.read(1) != RECORD_INDEX:
+            raise StateError('The replay index is corrupt')
+
+        self.num_ticks = self._read_varint()
+        self.keyframes = []
+        self.keyframe_ticks = []
+
+        for i in xrange(self._read_varint()):
+            tick = self._read_varint()
+            self._add_keyframe(tick, self._read_varint())
+
+        self.end_offset = index_offset
+        self.finished = True
+
+        return True
+
+    def _read_next_record(self, offset):
+        self.next_offset = offset
+
+        if offset == self.end_offset:
+            self.next_record = None
+            return
+
+        try:
+            record = self._read_record(offset)
+        except StateError:
+            # Not written yet.
+            record = None
+
+        if record and record.kind not in (RECORD_KEYFRAME, RECORD_INPUT):
+            record = None
+
+        self.next_record = record
+
+    def _read_record(self, offset):
+        self.file.seek(offset)
+        kind = self.file.read(1)
+
+        if not kind:
+            raise StateError('The replay is truncated')
+
+        if kind == RECORD_INDEX:
+            return ReplayRecord(kind, offset)
+
+        tick = self._read_varint()
+        keys = frozenset([self._read_varint()
+                          for i in xrange(self._read_varint())])
+        time_period_num = self._read_varint()
+        key_edges = []
+
+        for i in xrange(self._read_varint()):
+            value = self._read_varint()
+            key_edges.append((bool(value & 1), value >> 1))
+
+        record = ReplayRecord(kind, offset, tick, keys, time_period_num,
+                              key_edges)
+
+        if kind == RECORD_KEYFRAME:
+            record.discontinuity = bool(self._read_varint())
+            record.state_len = self._read_varint()
+            record.state_offset = self.file.tell()
+            record.end_offset = record.state_offset + record.state_len
+
+            # Make sure the whole state has been written.
+            self._read(record.end_offset - 1, 1)
+        else:
+            record.end_offset = self.file.tell()
+
+        return record
+
+    def _read(self, offset, size):
+        self.file.seek(offset)
+        data = self.file.read(size)
+
+        if len(data) != size:
+            raise StateError('The replay is truncated')
+
+        return data
+
+    def _read_varint(self):
+        value = 0
+        shift = 0
+
+        while True:
+            c = self.file.read(1)
+
+            if not c:
+                raise StateError('The replay is truncated')
+
+            byte = ord(c)
+            value |= (byte & 0x7F) << shift
+            shift += 7
+
+            if not byte & 0x80:
+                return value
@@ -1,8 +1,506 @@
+import hashlib
+import json
+import mmap
+import multiprocessing
 import os
+import Queue
+import struct
+import threading
+from collections import OrderedDict
+
 import pygame
 
 
-image_cache = {}
+class ImageCache(object):
+    """A least-recently-used cache of loaded images.
+
+    The cache keeps track of how many bytes of pixel data it holds, and
+    evicts the least recently used images once that goes over the
+    budget. Pinned images (ones that are always in use, like the player
+    and the control panel) are never evicted.
+
+    Variants of an image (such as flipped copies) are keyed by a tuple
+    starting with the image's name. They share the image's pinning, and
+    are removed along with it.
+    """
+    DEFAULT_BUDGET_BYTES = 96 * 1024 * 1024
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.images = OrderedDict()
+        self.variants = {}
+        self.pinned = set()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, name):
+        return name in self.images
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, name):
+        try:
+            image = self.images.pop(name)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.images[name] = image
+
+        return image
+
+    def add(self, name, image):
+        self.remove(name)
+        self.images[name] = image
+        self.size_bytes += self._get_image_bytes(image)
+
+        if isinstance(name, tuple):
+            self.variants.setdefault(name[0], set()).add(name)
+
+        self.evict()
+
+    def remove(self, name):
+        image = self.images.pop(name, None)
+
+        if image is not None:
+            self.size_bytes -= self._get_image_bytes(image)
+
+        if isinstance(name, tuple):
+            self.variants.get(name[0], set()).discard(name)
+        else:
+            for key in self.variants.pop(name, []):
+                self.remove(key)
+
+    def pin(self, name):
+        self.pinned.add(name)
+
+    def unpin(self, name):
+        self.pinned.discard(name)
+
+    def evict(self, budget_bytes=None):
+        if budget_bytes is None:
+            budget_bytes = self.budget_bytes
+
+        for name in list(self.images.iterkeys()):
+            if self.size_bytes <= budget_bytes:
+                break
+
+            if isinstance(name, tuple):
+                base_name = name[0]
+            else:
+                base_name = name
+
+            # This may already be gone along with its base image.
+            if name in self.images and base_name not in self.pinned:
+                self.remove(name)
+                self.evictions += 1
+
+    def clear(self):
+        """Removes every image that isn't pinned."""
+        self.evict(0)
+
+    def get_stats(self):
+        return {
+            'images': len(self.images),
+            'size_bytes': self.size_bytes,
+            'budget_bytes': self.budget_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _get_image_bytes(self, image):
+        if image.get_parent():
+            # Subsurfaces (such as atlas images) share their parent's
+            # pixels, which are counted through the parent.
+            return 0
+
+        return image.get_pitch() * image.get_height()
+
+
+class ImagePrefetcher(object):
+    """Decodes images in a background thread ahead of when they're needed.
+
+    The decoding, and the scanning for the blit mode to use, happen in
+    the thread. The decoded images are converted and added to the image
+    cache on the main thread, through process().
+    """
+    def __init__(self):
+        self.pending = []
+        self.decoded = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def prefetch(self, names):
+        with self.lock:
+            for name in names:
+                if (name not in image_cache and
+                    name not in self.pending and
+                    not (image_atlas and name in image_atlas) and
+                    not (image_bundle and name in image_bundle)):
+                    self.pending.append(name)
+
+            if self.pending and not self.thread:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def process(self, max_ms=None):
+        """Adds decoded images to the cache, for up to max_ms.
+
+        At least one image is added if any are ready. With no max_ms,
+        every image ready is added.
+        """
+        start_time = pygame.time.get_ticks()
+
+        while True:
+            try:
+                name, image, mode = self.decoded.get_nowait()
+            except Queue.Empty:
+                break
+
+            if name not in image_cache:
+                image_cache.add(name, optimize_image(name, image, mode))
+
+            if (max_ms is not None and
+                pygame.time.get_ticks() - start_time >= max_ms):
+                break
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+
+                name = self.pending.pop(0)
+
+            try:
+                image = load_image_file(name)
+                mode = image_modes.get(name) or detect_image_mode(image)
+                self.decoded.put((name, image, mode))
+            except pygame.error:
+                # This will be reported if something actually loads it.
+                pass
+
+
+class ImageBundle(object):
+    """A single file of pre-decoded images, loaded through mmap.
+
+    Every image is stored already converted to the display's pixel
+    format, so loading one is just wrapping a surface around the mapped
+    pixels, with no decoding or conversion.
+
+    The file is a header, the pixel data for each image, and an index
+    at the end. The index records each image's size and location, along
+    with the size, modification time and SHA-1 hash of the source file,
+    which are used to tell if the bundle is out of date. Images that
+    couldn't be decoded are listed with no pixel data, so they're only
+    tried again once their file changes.
+
+    The blit mode for each image (see optimize_image) is worked out when
+    the bundle is built, and stored in the index along with its colorkey.
+    Opaque images are blitted straight from the mapped pixels, with the
+    alpha channel ignored. Colorkeyed images have their transparent
+    pixels filled in with the colorkey, so loading them needs no
+    scanning, but they're still copied without the alpha channel. SDL
+    can't RLE-accelerate a colorkey on a surface with one, which makes
+    blitting them many times slower.
+    """
+    MAGIC = 'FEIMGBND'
+    VERSION = 3
+    HEADER_FORMAT = '<8sI4sIQ'
+    ENTRY_FORMAT = '<IIQQdQ20sB3B'
+    ALIGNMENT = 16
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.layout = None
+        self.needs_convert = False
+        self.entries = {}
+        self.entry_offsets = {}
+        self.skipped = set()
+        self.file = None
+        self.mmap = None
+
+    def __contains__(self, name):
+        return name in self.entries and name not in self.skipped
+
+    @classmethod
+    def build(cls, filename, names, layout):
+        dirname = os.path.dirname(filename)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        temp_filename = filename + '.tmp'
+        entries = []
+        header_size = struct.calcsize(cls.HEADER_FORMAT)
+
+        with open(temp_filename, 'wb') as fp:
+            fp.write('\0' * header_size)
+            skipped = set(names)
+
+            for name, image in decode_images(names):
+                path = get_image_path(name)
+                mode = image_modes.get(name) or detect_image_mode(image)
+                colorkey = (0, 0, 0)
+
+                if mode == IMAGE_MODE_COLORKEY:
+                    colorkey = COLORKEY
+                    keyed_image = pygame.Surface(image.get_size(),
+                                                 pygame.SRCALPHA, image)
+                    keyed_image.fill(colorkey)
+                    keyed_image.blit(image, (0, 0))
+                    image = keyed_image
+
+                data = pygame.image.tostring(image, layout)
+
+                offset = fp.tell()
+                padding = -offset % cls.ALIGNMENT
+                fp.write('\0' * padding)
+                offset += padding
+                fp.write(data)
+
+                width, height = image.get_size()
+                entries.append((name, width, height, offset, len(data),
+                                os.path.getmtime(path),
+                                os.path.getsize(path),
+                                cls._hash_file(path),
+                                IMAGE_MODES.index(mode)) + colorkey)
+                skipped.discard(name)
+
+            for name in sorted(skipped):
+                path = get_image_path(name)
+                entries.append((name, 0, 0, 0, 0, os.path.getmtime(path),
+                                os.path.getsize(path),
+                                cls._hash_file(path), 0, 0, 0, 0))
+
+            index_offset = fp.tell()
+
+            for entry in entries:
+                name = entry[0]
+                fp.write(struct.pack('<H', len(name)))
+                fp.write(name)
+                fp.write(struct.pack(cls.ENTRY_FORMAT, *entry[1:]))
+
+            fp.seek(0)
+            fp.write(struct.pack(cls.HEADER_FORMAT, cls.MAGIC, cls.VERSION,
+                                 layout, len(entries), index_offset))
+
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+        os.rename(temp_filename, filename)
+
+    def open(self):
+        self.file = open(self.filename, 'rb')
+
+        # Copy-on-write, so nothing drawn onto a bundled image can ever
+        # reach the file.
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        magic, version, self.layout, count, index_offset = \
+            struct.unpack(self.HEADER_FORMAT, self.mmap[:header_size])
+
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError('%s is not a valid image bundle' % self.filename)
+
+        entry_size = struct.calcsize(self.ENTRY_FORMAT)
+        pos = index_offset
+
+        for i in range(count):
+            name_len, = struct.unpack('<H', self.mmap[pos:pos + 2])
+            pos += 2
+            name = self.mmap[pos:pos + name_len]
+            pos += name_len
+            entry = struct.unpack(self.ENTRY_FORMAT,
+                                  self.mmap[pos:pos + entry_size])
+            self.entries[name] = entry
+            self.entry_offsets[name] = pos
+            pos += entry_size
+
+            if entry[3] == 0:
+                # It couldn't be decoded when the bundle was built.
+                self.skipped.add(name)
+
+    def close(self):
+        if self.mmap:
+            self.mmap.close()
+            self.mmap = None
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+        self.entries = {}
+        self.entry_offsets = {}
+        self.skipped = set()
+
+    def is_stale(self, names, layout):
+        if layout != self.layout or set(names) != set(self.entries):
+            return True
+
+        touched = []
+
+        for name in names:
+            path = get_image_path(name)
+            entry = self.entries[name]
+            mtime, file_size, file_hash, mode_index = entry[4:8]
+
+            if (name in image_modes and name not in self.skipped and
+                image_modes[name] != IMAGE_MODES[mode_index]):
+                return True
+
+            # Only hash the file if it looks like it may have changed.
+            if (os.path.getmtime(path) != mtime or
+                os.path.getsize(path) != file_size):
+                if self._hash_file(path) != file_hash:
+                    return True
+
+                touched.append(name)
+
+        if touched:
+            # Otherwise these would be hashed again on every launch.
+            try:
+                self._update_mtimes(touched)
+            except EnvironmentError:
+                pass
+
+        return False
+
+    def get_image(self, name):
+        """Returns an image, ready to be blitted in its stored mode."""
+        entry = self.entries[name]
+        width, height, offset, length = entry[:4]
+        mode = IMAGE_MODES[entry[7]]
+        image = pygame.image.frombuffer(buffer(self.mmap, offset, length),
+                                        (width, height), self.layout)
+
+        if mode in (IMAGE_MODE_OPAQUE, IMAGE_MODE_COLORKEY):
+            image.set_alpha(None)
+
+            if mode == IMAGE_MODE_OPAQUE and not self.needs_convert:
+                return image
+
+            # Otherwise convert() keeps the alpha channel.
+            image = image.convert()
+
+            if mode == IMAGE_MODE_COLORKEY:
+                image.set_colorkey(entry[8:], pygame.RLEACCEL)
+
+            return image
+        elif self.needs_convert:
+            return image.convert_alpha()
+        else:
+            return image
+
+    def _update_mtimes(self, names):
+        # The index is updated in place. The mapping is copy-on-write,
+        # so this goes through the file.
+        mtime_offset = struct.calcsize(self.ENTRY_FORMAT[:5])
+
+        with open(self.filename, 'r+b') as fp:
+            for name in names:
+                mtime = os.path.getmtime(get_image_path(name))
+                fp.seek(self.entry_offsets[name] + mtime_offset)
+                fp.write(struct.pack('<d', mtime))
+                entry = self.entries[name]
+                self.entries[name] = entry[:4] + (mtime,) + entry[5:]
+
+    @staticmethod
+    def _hash_file(path):
+        with open(path, 'rb') as fp:
+            return hashlib.sha1(fp.read()).digest()
+
+
+class ImageAtlas(object):
+    """An index of small images packed together into atlas sheets.
+
+    The sheets and the index are built by foreverend.atlas. A packed
+    image is loaded as a subsurface of its sheet, so all the images on
+    a sheet share a single file, decode and surface. Images are packed
+    onto sheets by their blit mode, and each sheet is optimized for its
+    mode.
+    """
+    def __init__(self, filename):
+        with open(filename, 'r') as fp:
+            index = json.load(fp)
+
+        index_mtime = os.path.getmtime(filename)
+        self.sheets = [str(sheet_name) for sheet_name in index['sheets']]
+        self.sheet_modes = dict(zip(self.sheets, index['sheet_modes']))
+        self.rects = {}
+        self.changed = set()
+        self.indexed = set(map(str, index.get('unpacked', [])))
+
+        for name, (sheet, x, y, w, h) in index['images'].iteritems():
+            name = str(name)
+            path = get_image_path(name)
+            self.indexed.add(name)
+
+            # Anything changed since the atlas was built is loaded from
+            # its own file until the atlas is rebuilt.
+            if (os.path.exists(path) and
+                os.path.getmtime(path) <= index_mtime):
+                self.rects[name] = (self.sheets[sheet],
+                                    pygame.Rect(x, y, w, h))
+            else:
+                self.changed.add(name)
+
+    def __contains__(self, name):
+        return name in self.rects
+
+    def get_image(self, name):
+        sheet_name, rect = self.rects[name]
+
+        return load_image(sheet_name).subsurface(rect)
+
+    def get_sheet(self, sheet_name):
+        """Loads a sheet, optimized for the mode of its images."""
+        mode = self.sheet_modes[sheet_name]
+        sheet = optimize_image(sheet_name, load_image_file(sheet_name), mode)
+
+        if mode == IMAGE_MODE_COLORKEY:
+            # An RLE-accelerated surface drops its pixels once it's
+            # encoded, and its subsurfaces still point at them.
+            sheet.set_colorkey(COLORKEY)
+
+        return sheet
+
+    def is_stale(self):
+        """Returns whether images have been added or changed since the
+        atlas was built.
+        """
+        names = set([
+            name
+            for name in list_all_images()
+            if not name.startswith(ATLAS_DIR + '/')
+        ])
+
+        return bool(self.changed) or names != self.indexed
+
+
+IMAGE_MODE_OPAQUE = 'opaque'
+IMAGE_MODE_COLORKEY = 'colorkey'
+IMAGE_MODE_ALPHA = 'alpha'
+IMAGE_MODES = (IMAGE_MODE_OPAQUE, IMAGE_MODE_COLORKEY, IMAGE_MODE_ALPHA)
+
+COLORKEY = (255, 0, 255)
+
+
+image_cache = ImageCache()
+image_modes = {}
+_display_alpha_masks = None
+image_prefetcher = ImagePrefetcher()
+image_atlas = None
+image_bundle = None
 
 DATA_PY = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.normpath(os.path.join(DATA_PY, '..', 'data'))
@@ -11,37 +509,434 @@ DATA_DIR = os.path.normpath(os.path.join(DATA_PY, '..', 'data'))
 if not os.path.exists(DATA_DIR):
     DATA_DIR = os.path.normpath(os.path.join(DATA_PY, '..', '..', 'data'))
 
+ATLAS_DIR = 'atlas'
+ATLAS_INDEX_FILENAME = os.path.join(DATA_DIR, ATLAS_DIR, 'index.json')
+
+BUNDLE_FILENAME = os.path.join(os.path.expanduser('~'), '.foreverend',
+                               'images.bundle')
+
 
 def get_cached_image(name, create_func):
     assert name
 
-    if name not in image_cache:
-        image_cache[name] = create_func().convert_alpha()
+    image = image_cache.get(name)
 
-    return image_cache[name]
+    if image is None:
+        image = optimize_image(name, create_func())
+        image_cache.add(name, image)
 
+    return image
+
+
+def get_image_path(name):
+    if not name.endswith('.png') and not name.endswith('.jpg'):
+        filename = name + '.png'
+    else:
+        filename = name
+
+    return os.path.join(DATA_DIR, *filename.split('/'))
 
-def load_image(name):
-    def _load_image_file():
-        if not name.endswith('.png') and not name.endswith('.jpg'):
-            filename = name + '.png'
-        else:
-            filename = name
 
-        path = os.path.join(DATA_DIR, *filename.split('/'))
+def load_image_file(name):
+    return pygame.image.load(get_image_path(name))
 
+
+def load_image(name):
+    def _load_image_file():
         try:
-            return pygame.image.load(path)
+            return load_image_file(name)
         except pygame.error, message:
-            print 'Unable to load image %s' % path
+            print 'Unable to load image %s' % get_image_path(name)
             assert False
 
+    if name not in image_cache:
+        image = _get_packed_image(name)
+
+        if image:
+            image_cache.add(name, image)
+        else:
+            # It may have been decoded in the background already.
+            image_prefetcher.process()
+
     return get_cached_image(name, _load_image_file)
 
 
+def load_flipped_image(name, flip_h, flip_v):
+    """Returns a flipped copy of an image, shared by everything using it.
+
+    The copy is cached alongside the image, and unloaded with it.
+    """
+    if not flip_h and not flip_v:
+        return load_image(name)
+
+    key = (name, flip_h, flip_v)
+    image = image_cache.get(key)
+
+    if image is None:
+        image = pygame.transform.flip(load_image(name), flip_h, flip_v)
+        image_cache.add(key, image)
+
+    return image
+
+
+def load_tiled_image(name, tiles_x, tiles_y):
+    """Returns an image tiled a number of times across and down.
+
+    Like flipped images, the composite is cached alongside the image,
+    shared by every sprite using it, and unloaded with the image.
+    """
+    key = (name, 'tiled', tiles_x, tiles_y)
+    image = image_cache.get(key)
+
+    if image is None:
+        tile = load_image(name)
+        tile_width, tile_height = tile.get_size()
+
+        # Match the tile's pixel format, so the composite keeps the blit
+        # mode chosen for the tile.
+        image = pygame.Surface((tiles_x * tile_width, tiles_y * tile_height),
+                               tile.get_flags() & pygame.SRCALPHA, tile)
+        colorkey = tile.get_colorkey()
+
+        if colorkey:
+            image.fill(colorkey)
+            image.set_colorkey(colorkey, pygame.RLEACCEL)
+        elif image.get_flags() & pygame.SRCALPHA:
+            image.fill((0, 0, 0, 0))
+
+        for y in range(tiles_y):
+            for x in range(tiles_x):
+                image.blit(tile, (x * tile_width, y * tile_height))
+
+        image_cache.add(key, image)
+
+    return image
+
+
+def _get_packed_image(name):
+    """Returns an image from the atlas or bundle, if it's in either.
+
+    The image is ready to be cached. Atlas images are left as
+    subsurfaces of their sheet, rather than optimized into copies.
+    """
+    if image_atlas and name in image_atlas:
+        return image_atlas.get_image(name)
+    elif image_atlas and name in image_atlas.sheet_modes:
+        return image_atlas.get_sheet(name)
+    elif image_bundle and name in image_bundle:
+        return image_bundle.get_image(name)
+    else:
+        return None
+
+
+def set_image_mode(name, mode):
+    """Overrides the detected blit mode for an image.
+
+    mode is one of IMAGE_MODE_OPAQUE, IMAGE_MODE_COLORKEY or
+    IMAGE_MODE_ALPHA, or None to go back to detecting it. The modes of
+    bundled images are stored in the bundle, so this must be called
+    before load_image_bundle.
+    """
+    if mode is None:
+        image_modes.pop(name, None)
+    else:
+        assert mode in (IMAGE_MODE_OPAQUE, IMAGE_MODE_COLORKEY,
+                        IMAGE_MODE_ALPHA)
+        image_modes[name] = mode
+
+
+def detect_image_mode(image):
+    """Returns the cheapest blit mode that can draw the image correctly.
+
+    Images without any transparency are opaque. Images whose pixels are
+    all either fully opaque or fully transparent can use a colorkey.
+    Anything else needs per-pixel alpha.
+    """
+    if not image.get_flags() & pygame.SRCALPHA:
+        if image.get_colorkey():
+            return IMAGE_MODE_COLORKEY
+        else:
+            return IMAGE_MODE_OPAQUE
+
+    width, height = image.get_size()
+
+    # Masks set the pixels with an alpha above the threshold.
+    num_opaque = pygame.mask.from_surface(image, 254).count()
+
+    if num_opaque == width * height:
+        return IMAGE_MODE_OPAQUE
+    elif num_opaque == pygame.mask.from_surface(image, 0).count():
+        return IMAGE_MODE_COLORKEY
+    else:
+        return IMAGE_MODE_ALPHA
+
+
+def optimize_image(name, image, mode=None):
+    """Converts an image to the display format best suited for blitting.
+
+    Opaque images are converted without alpha. Images with only fully
+    transparent or fully opaque pixels get an RLE-accelerated colorkey
+    instead of per-pixel alpha. Only the rest keep per-pixel alpha.
+
+    If the mode has already been detected, it can be passed in to save
+    scanning the image again.
+    """
+    mode = mode or image_modes.get(name) or detect_image_mode(image)
+
+    if mode == IMAGE_MODE_OPAQUE:
+        # Otherwise convert() keeps the alpha channel.
+        image.set_alpha(None)
+
+        return image.convert()
+    elif mode == IMAGE_MODE_COLORKEY:
+        # Any opaque pixel that exactly matches COLORKEY will become
+        # transparent. Use set_image_mode for images that need that color.
+        if (image.get_flags() & pygame.SRCALPHA and
+            image.get_masks() != _get_display_alpha_masks()):
+            # Blending from other alpha layouts can be off by one.
+            image = image.convert_alpha()
+
+        new_image = pygame.Surface(image.get_size()).convert()
+        new_image.fill(COLORKEY)
+        new_image.blit(image, (0, 0))
+        new_image.set_colorkey(COLORKEY, pygame.RLEACCEL)
+
+        return new_image
+    elif (image.get_flags() & pygame.SRCALPHA and
+          image.get_masks() == _get_display_alpha_masks()):
+        # Already in the display's alpha format.
+        return image
+    else:
+        return image.convert_alpha()
+
+
+def _get_display_alpha_masks():
+    global _display_alpha_masks
+
+    if _display_alpha_masks is None:
+        surface = pygame.Surface((1, 1), pygame.SRCALPHA).convert_alpha()
+        _display_alpha_masks = surface.get_masks()
+
+    return _display_alpha_masks
+
+
+def load_image_atlas(filename=ATLAS_INDEX_FILENAME):
+    """Loads the atlas, building it if it's missing or stale.
+
+    If the atlas can't be built, images are loaded from their own files
+    as normal.
+    """
+    global image_atlas
+
+    # The atlas is built using the loaders in this module.
+    from foreverend.atlas import build_atlases
+
+    try:
+        atlas = ImageAtlas(filename)
+    except (EnvironmentError, ValueError, KeyError):
+        atlas = None
+
+    if atlas is None or atlas.is_stale():
+        try:
+            build_atlases(filename)
+            atlas = ImageAtlas(filename)
+        except (EnvironmentError, pygame.error), e:
+            print 'Unable to build the image atlas %s: %s' % (filename, e)
+            atlas = None
+
+    image_atlas = atlas
+
+    if atlas:
+        # The sheets are shared by many images, so keep them around.
+        pin_image(*atlas.sheets)
+
+
+def list_images(dirname):
+    """Returns the names of all images in a directory under data/.
+
+    An empty dirname lists the images directly in data/.
+    """
+    names = []
+
+    for filename in sorted(os.listdir(os.path.join(DATA_DIR, dirname))):
+        if filename.endswith('.png'):
+            filename = filename[:-len('.png')]
+        elif not filename.endswith('.jpg'):
+            continue
+
+        if dirname:
+            names.append('%s/%s' % (dirname, filename))
+        else:
+            names.append(filename)
+
+    return names
+
+
+def list_all_images():
+    names = list_images('')
+
+    for dirname in sorted(os.listdir(DATA_DIR)):
+        if os.path.isdir(os.path.join(DATA_DIR, dirname)):
+            names += list_images(dirname)
+
+    return names
+
+
+def get_display_layout():
+    """Returns the byte layout of the display's alpha pixel format.
+
+    This is the layout to pass to pygame.image.tostring/frombuffer for
+    surfaces that need no conversion to be blitted. If the pixel format
+    can't be expressed by this version of pygame, this returns None.
+    """
+    surface = pygame.Surface((1, 1), pygame.SRCALPHA).convert_alpha()
+    surface.fill((1, 2, 3, 4))
+    raw = surface.get_buffer().raw
+
+    for layout in ('BGRA', 'ARGB', 'RGBA'):
+        try:
+            if pygame.image.tostring(surface, layout) == raw:
+                return layout
+        except ValueError:
+            # This version of pygame doesn't support the layout.
+            pass
+
+    return None
+
+
+def load_image_bundle(filename=BUNDLE_FILENAME):
+    """Opens the image bundle, rebuilding it if it's missing or stale.
+
+    This must be called after the display mode is set. If the bundle
+    can't be written, images are loaded from data/ as normal.
+    """
+    global image_bundle
+
+    # Images packed into the atlas are loaded through their sheets.
+    names = [
+        name
+        for name in list_all_images()
+        if not (image_atlas and name in image_atlas)
+    ]
+    layout = get_display_layout()
+    bundle = ImageBundle(filename)
+
+    if layout is None:
+        # Store plain RGBA, and convert images as they're loaded.
+        layout = 'RGBA'
+        bundle.needs_convert = True
+
+    try:
+        bundle.open()
+    except (EnvironmentError, ValueError, struct.error):
+        bundle.close()
+
+    if bundle.is_stale(names, layout):
+        bundle.close()
+
+        try:
+            ImageBundle.build(filename, names, layout)
+            bundle.open()
+        except (EnvironmentError, ValueError, struct.error), e:
+            print 'Unable to build the image bundle %s: %s' % (filename, e)
+            bundle.close()
+            bundle = None
+
+    image_bundle = bundle
+
+
+def _decode_image(name):
+    """Decodes an image into raw RGBA bytes.
+
+    This runs in the worker processes used by decode_images.
+    """
+    try:
+        image = load_image_file(name)
+    except pygame.error:
+        return name, None, None
+
+    return name, image.get_size(), pygame.image.tostring(image, 'RGBA')
+
+
+def decode_images(names, processes=None):
+    """Decodes images in parallel, yielding each name and surface.
+
+    The images are decoded across a pool of worker processes (one per
+    core by default). Each worker hands back the raw RGBA pixels, which
+    are turned into surfaces here on the main thread. Images that fail
+    to decode are skipped, and will be reported if something loads them.
+    """
+    if not names:
+        return
+
+    if processes is None:
+        try:
+            processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            processes = 1
+
+    processes = min(processes, len(names))
+    pool = None
+
+    if processes > 1:
+        try:
+            pool = multiprocessing.Pool(processes)
+        except (OSError, ImportError):
+            pool = None
+
+    if pool:
+        results = pool.imap_unordered(_decode_image, names, chunksize=4)
+    else:
+        results = (_decode_image(name) for name in names)
+
+    try:
+        for name, size, data in results:
+            if data is not None:
+                image = pygame.image.frombuffer(data, size, 'RGBA')
+                yield name, image.convert_alpha()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+
+def warm_up_images(names, processes=None):
+    """Loads images into the image cache ahead of time.
+
+    Images in the atlas or the image bundle are loaded from there.
+    Anything else is decoded in parallel through decode_images.
+    """
+    to_decode = []
+
+    for name in names:
+        if name not in image_cache:
+            image = _get_packed_image(name)
+
+            if image:
+                image_cache.add(name, image)
+            else:
+                to_decode.append(name)
+
+    for name, image in decode_images(to_decode, processes):
+        if name not in image_cache:
+            image_cache.add(name, optimize_image(name, image))
+
+
+def prefetch_images(names):
+    image_prefetcher.prefetch(names)
+
+
+def process_prefetched_images(max_ms=None):
+    image_prefetcher.process(max_ms)
+
+
+def pin_image(*names):
+    for name in names:
+        image_cache.pin(name)
+
+
 def unload_image(name):
-    if name in image_cache:
-        del image_cache[name]
+    image_cache.remove(name)
 
 
 def unload_images():
@@ -0,0 +1,236 @@
+import binascii
+import math
+import re
+import time
+from collections import deque
+
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+from foreverend.savestate import StateError, can_save_state, decode_varint, \
+                                 encode_varint, load_state, save_state
+
+
+# Runs of changed bytes. Short unchanged gaps are folded into a run, as
+# they cost less than starting a new one.
+DELTA_RUN_RE = re.compile(r'[^\x00]+(?:\x00{1,3}[^\x00]+)*')
+
+
+def xor_strings(a, b):
+    assert len(a) == len(b)
+
+    if not a:
+        return a
+
+    if has_numpy:
+        return numpy.bitwise_xor(numpy.frombuffer(a, numpy.uint8),
+                                 numpy.frombuffer(b, numpy.uint8)).tostring()
+
+    value = (int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16))
+
+    return binascii.unhexlify(('%x' % value).zfill(len(a) * 2))
+
+
+def encode_delta(old, new):
+    """Encodes the difference between two states of the same length.
+
+    The states are XORed together, and each run of changed bytes is
+    stored as the varint distance from the previous run, the varint
+    length of the run and the XORed bytes.
+    """
+    xored = xor_strings(old, new)
+    chunks = []
+    pos = 0
+
+    for match in DELTA_RUN_RE.finditer(xored):
+        start, end = match.span()
+        chunks.append(encode_varint(start - pos))
+        chunks.append(encode_varint(end - start))
+        chunks.append(xored[start:end])
+        pos = end
+
+    return ''.join(chunks)
+
+
+def decode_delta(old, delta):
+    chunks = []
+    pos = 0
+    state_pos = 0
+
+    while pos < len(delta):
+        gap, pos = decode_varint(delta, pos)
+        length, pos = decode_varint(delta, pos)
+        chunks.append('\x00' * gap)
+        chunks.append(delta[pos:pos + length])
+        pos += length
+        state_pos += gap + length
+
+    chunks.append('\x00' * (len(old) - state_pos))
+
+    return xor_strings(old, ''.join(chunks))
+
+
+class RewindBuffer(object):
+    """Records the game state every tick, so it can be scrubbed back.
+
+    States are stored in a ring buffer as a keyframe every
+    KEYFRAME_INTERVAL frames, with XOR deltas against the previous frame
+    in between. When the buffer grows past max_bytes, the oldest keyframe
+    and its deltas are dropped.
+
+    Recording is kept within a per-tick budget. If saving frames takes
+    longer than MAX_RECORD_MS on average, frames are only recorded every
+    few ticks (up to every MAX_STRIDE ticks), enough to keep the cost per
+    tick within the budget, returning to every tick once it's cheap
+    again. The average is a running one, so a single slow frame (say,
+    from garbage collection) doesn't count for much.
+    """
+    KEYFRAME_INTERVAL = 30
+    DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+    MAX_RECORD_MS = 2.0
+    MAX_STRIDE = 8
+
+    # How much each frame's encode time counts toward the running average.
+    RECENT_WEIGHT = 0.1
+
+    def __init__(self, engine, max_bytes=DEFAULT_MAX_BYTES):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        # Each frame is (is_keyframe, data, ticks covered).
+        self.frames = deque()
+        self.size_bytes = 0
+        self.last_state = None
+        self.frames_since_keyframe = 0
+        self.stride = 1
+        self.pending_ticks = 0
+
+        # Stats
+        self.frames_recorded = 0
+        self.ticks_skipped = 0
+        self.bytes_recorded = 0
+        self.encode_ms = 0
+        self.last_encode_ms = 0
+        self.recent_encode_ms = 0
+
+    def record(self):
+        self.pending_ticks += 1
+
+        if self.pending_ticks < self.stride:
+            self.ticks_skipped += 1
+            return
+
+        start_time = time.time()
+
+        try:
+            state = save_state(self.engine)
+        except StateError:
+            # Something's running that can't be restored, such as a
+            # scripted sequence. The next frame recorded covers this tick.
+            self.ticks_skipped += 1
+            return
+
+        if (self.last_state is None or
+            len(state) != len(self.last_state) or
+            self.frames_since_keyframe >= self.KEYFRAME_INTERVAL):
+            frame = (True, state, self.pending_ticks)
+            self.frames_since_keyframe = 0
+        else:
+            frame = (False, encode_delta(self.last_state, state),
+                     self.pending_ticks)
+            self.frames_since_keyframe += 1
+
+        self.frames.append(frame)
+        self.size_bytes += len(frame[1])
+        self.last_state = state
+        self.pending_ticks = 0
+
+        while self.size_bytes > self.max_bytes and self.frames:
+            self._drop_oldest_keyframe()
+
+        elapsed_ms = (time.time() - start_time) * 1000
+        self.frames_recorded += 1
+        self.bytes_recorded += len(frame[1])
+        self.encode_ms += elapsed_ms
+        self.last_encode_ms = elapsed_ms
+        self.recent_encode_ms += ((elapsed_ms - self.recent_encode_ms) *
+                                  self.RECENT_WEIGHT)
+
+        # Spread the cost of recording over enough ticks to keep within
+        # the budget.
+        self.stride = max(1, min(int(math.ceil(self.recent_encode_ms /
+                                               self.MAX_RECORD_MS)),
+                                 self.MAX_STRIDE))
+
+    def rewind(self, num_frames=1):
+        """Goes back num_frames recorded frames and loads that state.
+
+        The frames after it are discarded, so recording continues from
+        there. Returns False if there's nothing left to rewind to, or
+        if a scripted sequence is running, as loading a state would stop
+        it partway through (see can_save_state).
+        """
+        index = len(self.frames) - 1 - num_frames
+
+        if index < 0 or not can_save_state(self.engine):
+            return False
+
+        keyframe_index = index
+
+        while not self.frames[keyframe_index][0]:
+            keyframe_index -= 1
+
+        state = self.frames[keyframe_index][1]
+
+        for i in xrange(keyframe_index + 1, index + 1):
+            state = decode_delta(state, self.frames[i][1])
+
+        while len(self.frames) > index + 1:
+            self.size_bytes -= len(self.frames.pop()[1])
+
+        load_state(self.engine, state)
+        self.last_state = state
+        self.frames_since_keyframe = index - keyframe_index
+        self.pending_ticks = 0
+
+        return True
+
+    def get_stats(self):
+        if self.frames_recorded:
+            avg_encode_ms = self.encode_ms / self.frames_recorded
+            avg_bytes = float(self.bytes_recorded) / self.frames_recorded
+        else:
+            avg_encode_ms = 0
+            avg_bytes = 0
+
+        ticks = self.frames_recorded + self.ticks_skipped
+
+        return {
+            'frames': len(self.frames),
+            'keyframes': len([frame for frame in self.frames if frame[0]]),
+            'size_bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+            'seconds': (sum([frame[2] for frame in self.frames]) /
+                        float(self.engine.FPS)),
+            'stride': self.stride,
+            'last_encode_ms': self.last_encode_ms,
+            'recent_encode_ms': self.recent_encode_ms,
+            'avg_encode_ms': avg_encode_ms,
+            'avg_bytes_per_frame': avg_bytes,
+            'avg_bytes_per_tick': ticks and float(self.bytes_recorded) / ticks,
+        }
+
+    def _drop_oldest_keyframe(self):
+        self.size_bytes -= len(self.frames.popleft()[1])
+
+        while self.frames and not self.frames[0][0]:
+            self.size_bytes -= len(self.frames.popleft()[1])
+
+        if not self.frames:
+            # Everything was dropped, so the next frame must be a keyframe.
+            self.last_state = None
@@ -0,0 +1,749 @@
+import random
+import struct
+
+import pygame
+
+from foreverend.effects import Effect
+from foreverend.particles import ParticleSystem
+from foreverend.timer import Timer
+
+
+MAGIC = 'FESTATE'
+VERSION = 1
+
+TAG_NONE = 'n'
+TAG_TRUE = 't'
+TAG_FALSE = 'f'
+TAG_INT = 'i'
+TAG_FLOAT = 'd'
+TAG_STR = 's'
+TAG_RECT = 'r'
+TAG_TUPLE = 'u'
+TAG_REF = '@'
+
+REF_SPRITE = 0
+REF_AREA = 1
+REF_LAYER = 2
+REF_EFFECT = 3
+REF_LEVEL = 4
+
+# Structural attributes of levels and areas that are never saved.
+IGNORED_ATTRS = set(['active_time_period', 'built', 'engine', 'key', 'level',
+                     'time_period'])
+
+RNG_STATE_SIZE = 625
+
+# Varints below this are looked up rather than encoded, as most values
+# saved are small.
+NUM_CACHED_VARINTS = 1 << 14
+
+
+class StateError(Exception):
+    pass
+
+
+def encode_varint(value):
+    assert value >= 0
+
+    if value < NUM_CACHED_VARINTS:
+        return _cached_varints[value]
+
+    return _encode_varint(value)
+
+
+def decode_varint(data, pos):
+    """Decodes a varint at pos, returning it and the position after it."""
+    value = 0
+    shift = 0
+
+    while True:
+        if pos >= len(data):
+            raise StateError('The save state is truncated')
+
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            return value, pos
+
+
+def _encode_varint(value):
+    chunks = []
+
+    while value > 0x7F:
+        chunks.append(chr((value & 0x7F) | 0x80))
+        value >>= 7
+
+    chunks.append(chr(value))
+    return ''.join(chunks)
+
+
+_cached_varints = [_encode_varint(i) for i in xrange(NUM_CACHED_VARINTS)]
+
+
+def _zigzag(value):
+    if value >= 0:
+        return value << 1
+    else:
+        return ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    if value & 1:
+        return -((value + 1) >> 1)
+    else:
+        return value >> 1
+
+
+class StateWriter(object):
+    """Writes values in the compact, tagged binary form used by save states.
+
+    Integers are written as zig-zag varints, and references to sprites,
+    areas and other known objects as a kind and an index.
+    """
+    def __init__(self, refs):
+        self.refs = refs
+        self.chunks = []
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+    def write_varint(self, value):
+        self.chunks.append(encode_varint(value))
+
+    def write_bytes(self, data):
+        self.write_varint(len(data))
+        self.chunks.append(data)
+
+    def is_encodable(self, value):
+        if value is None or isinstance(value, (bool, int, long, float, str,
+                                               pygame.Rect)):
+            return True
+        elif isinstance(value, tuple):
+            for item in value:
+                if not self.is_encodable(item):
+                    return False
+
+            return True
+        else:
+            try:
+                return value in self.refs
+            except TypeError:
+                # Unhashable.
+                return False
+
+    def write_value(self, value):
+        chunks = self.chunks
+        value_type = type(value)
+
+        # Exact types are checked first, as isinstance() is slow enough
+        # to matter when saving every tick.
+        if value_type is int or value_type is long:
+            chunks.append(TAG_INT)
+            chunks.append(encode_varint(_zigzag(value)))
+        elif value is True:
+            chunks.append(TAG_TRUE)
+        elif value is False:
+            chunks.append(TAG_FALSE)
+        elif value is None:
+            chunks.append(TAG_NONE)
+        elif value_type is pygame.Rect:
+            chunks.append(TAG_RECT)
+
+            for i in value:
+                chunks.append(encode_varint(_zigzag(i)))
+        elif value_type is float:
+            chunks.append(TAG_FLOAT)
+            chunks.append(struct.pack('<d', value))
+        elif value_type is str:
+            chunks.append(TAG_STR)
+            chunks.append(encode_varint(len(value)))
+            chunks.append(value)
+        elif value_type is tuple:
+            chunks.append(TAG_TUPLE)
+            chunks.append(encode_varint(len(value)))
+
+            for item in value:
+                self.write_value(item)
+        elif isinstance(value, (int, long)):
+            self.write_value(long(value))
+        elif isinstance(value, float):
+            self.write_value(float(value))
+        elif isinstance(value, str):
+            self.write_value(str(value))
+        elif isinstance(value, pygame.Rect):
+            self.write_value(pygame.Rect(value))
+        elif isinstance(value, tuple):
+            self.write_value(tuple(value))
+        else:
+            try:
+                kind, index = self.refs[value]
+            except (KeyError, TypeError):
+                raise StateError('%r cannot be saved' % (value,))
+
+            chunks.append(TAG_REF)
+            chunks.append(chr(kind))
+            chunks.append(encode_varint(index))
+
+
+class StateReader(object):
+    def __init__(self, data, objects):
+        self.data = data
+        self.objects = objects
+        self.pos = 0
+
+    def read(self, size):
+        data = self.data[self.pos:self.pos + size]
+
+        if len(data) != size:
+            raise StateError('The save state is truncated')
+
+        self.pos += size
+        return data
+
+    def read_varint(self):
+        value, self.pos = decode_varint(self.data, self.pos)
+        return value
+
+    def read_bytes(self):
+        return self.read(self.read_varint())
+
+    def read_value(self):
+        pos = self.pos
+        tag = self.data[pos:pos + 1]
+
+        if not tag:
+            raise StateError('The save state is truncated')
+
+        self.pos = pos + 1
+
+        if tag == TAG_TRUE:
+            return True
+        elif tag == TAG_FALSE:
+            return False
+        elif tag == TAG_NONE:
+            return None
+        elif tag == TAG_INT:
+            return _unzigzag(self.read_varint())
+        elif tag == TAG_FLOAT:
+            return struct.unpack('<d', self.read(8))[0]
+        elif tag == TAG_STR:
+            return self.read_bytes()
+        elif tag == TAG_RECT:
+            return pygame.Rect([_unzigzag(self.read_varint())
+                                for i in xrange(4)])
+        elif tag == TAG_TUPLE:
+            return tuple([self.read_value()
+                          for i in xrange(self.read_varint())])
+        elif tag == TAG_REF:
+            kind = ord(self.read(1))
+            return self.objects[kind][self.read_varint()]
+        else:
+            raise StateError('Unknown value tag %r' % tag)
+
+
+def get_state_objects(engine, built_areas=None):
+    """Returns the objects a save state of the active level refers to.
+
+    This is a list of sprites, areas, layers, effects and levels, indexed
+    by reference kind. Only the layers and sprites in built_areas (by
+    default, every area built so far) are included. The order is stable
+    for a given set of built areas, so indexes can be shared between a
+    save and a load.
+    """
+    level = engine.active_level
+    player = engine.player
+    layer_sprites = dict(level.snapshot.layers)
+    sprites = [player, player.propulsion_below, player.tractor_beam]
+    seen = set(sprites)
+    areas = []
+    layers = []
+
+    for time_period in level.time_periods:
+        for key in sorted(time_period.areas.iterkeys()):
+            area = time_period.areas[key]
+            areas.append(area)
+
+            if built_areas is not None and area not in built_areas:
+                continue
+
+            for layer in area.layers:
+                layers.append(layer)
+
+                for sprite in layer_sprites.get(layer, []):
+                    if sprite not in seen:
+                        seen.add(sprite)
+                        sprites.append(sprite)
+
+    effects = []
+    effect_types = _get_subclasses(Effect)
+
+    for sprite in sprites:
+        attrs = sprite.__dict__
+
+        # Most sprites have no effects, and this is quicker to rule out
+        # by type than with isinstance().
+        if effect_types.isdisjoint(map(type, attrs.itervalues())):
+            continue
+
+        for key in sorted(attrs.iterkeys()):
+            value = attrs[key]
+
+            if isinstance(value, Effect) and value not in effects:
+                effects.append(value)
+
+    return {
+        REF_SPRITE: sprites,
+        REF_AREA: areas,
+        REF_LAYER: layers,
+        REF_EFFECT: effects,
+        REF_LEVEL: [level],
+    }
+
+
+def _get_subclasses(cls):
+    subclasses = set([cls])
+
+    for subclass in cls.__subclasses__():
+        subclasses.update(_get_subclasses(subclass))
+
+    return subclasses
+
+
+def _get_refs(objects):
+    refs = {}
+
+    for kind, objs in objects.iteritems():
+        for i, obj in enumerate(objs):
+            refs[obj] = (kind, i)
+
+    return refs
+
+
+def _get_level_timers(engine):
+    for callback in engine.tick.callbacks:
+        timer = getattr(callback, '__self__', None)
+
+        if isinstance(timer, Timer) and timer.level == engine.active_level:
+            yield timer
+
+
+def _get_unrestorable(engine, refs):
+    level = engine.active_level
+
+    # Crossovers are thrown away when loading, rather than restored.
+    ignored = set(level.pending_crossovers.itervalues())
+
+    for crossover, timer in level.crossovers:
+        ignored.add(timer)
+        ignored.add(getattr(crossover, 'effect', None))
+
+    unrestorable = [
+        animation
+        for animation in engine.animation_manager.animations
+        if animation not in refs and animation not in ignored
+    ]
+
+    for timer in _get_level_timers(engine):
+        owner = getattr(timer.cb, '__self__', None)
+
+        # Particle systems are only for show, and are left running.
+        if (timer not in ignored and owner not in refs and
+            not isinstance(owner, ParticleSystem)):
+            unrestorable.append(timer)
+
+    return unrestorable
+
+
+def can_save_state(engine):
+    """Returns whether the game is in a state that can be saved and loaded.
+
+    Only effects kept on sprites, and timers calling methods of objects
+    in the state, can be restored. The effects and timers started by a
+    scripted sequence (such as the end of a level) are closures, which
+    would be lost, so nothing can be saved or loaded while one is
+    running.
+    """
+    if not engine.active_level:
+        return False
+
+    refs = _get_refs(get_state_objects(engine))
+
+    return not _get_unrestorable(engine, refs)
+
+
+def save_state(engine):
+    """Saves the dynamic state of the engine and active level to a string.
+
+    This covers the player, the dynamic fields of every sprite the level
+    set up, any attributes of the level and its areas that can be saved,
+    the running effects of those sprites, pending timers that call back
+    into any of these objects, and the state of the random number
+    generator. The objects themselves aren't saved, so the state can only
+    be loaded into the same game.
+
+    StateError is raised if anything is running that couldn't be restored
+    (see can_save_state).
+    """
+    level = engine.active_level
+    objects = get_state_objects(engine)
+    refs = _get_refs(objects)
+    unrestorable = _get_unrestorable(engine, refs)
+
+    if unrestorable:
+        raise StateError('%r cannot be saved' % unrestorable[0])
+
+    writer = StateWriter(refs)
+
+    writer.chunks.append(MAGIC)
+    writer.write_varint(VERSION)
+    writer.write_varint(engine.levels.index(level))
+
+    # Random number generator
+    version, internal_state, gauss_next = random.getstate()
+    writer.write_varint(version)
+    writer.chunks.append(struct.pack('<%dI' % RNG_STATE_SIZE,
+                                     *internal_state))
+    writer.write_value(gauss_next)
+
+    # Areas
+    areas = objects[REF_AREA]
+    writer.write_varint(len(areas))
+
+    for area in areas:
+        writer.write_value(area.built)
+
+    if level.active_time_period:
+        writer.write_value(
+            level.time_periods.index(level.active_time_period))
+    else:
+        writer.write_value(None)
+
+    _write_attrs(writer, level)
+
+    for area in areas:
+        if area.built:
+            _write_attrs(writer, area)
+
+    # Sprites
+    sprites = objects[REF_SPRITE]
+    writer.write_varint(len(sprites))
+
+    for sprite in sprites:
+        _write_fields(writer, sprite)
+
+        if sprite.quad_trees:
+            writer.write_value(sprite.layer)
+        else:
+            writer.write_value(None)
+
+    # Effects
+    effects = objects[REF_EFFECT]
+    writer.write_varint(len(effects))
+
+    for effect in effects:
+        writer.write_value(effect.running)
+        _write_fields(writer, effect)
+
+    # Timers. Only those calling back into a known object can be saved.
+    timers = []
+
+    for timer in _get_level_timers(engine):
+        owner = getattr(timer.cb, '__self__', None)
+
+        if owner in refs:
+            timers.append((timer, owner))
+
+    writer.write_varint(len(timers))
+
+    for timer, owner in timers:
+        attr_name = None
+
+        for key, value in owner.__dict__.iteritems():
+            if value is timer:
+                attr_name = key
+                break
+
+        writer.write_value(owner)
+        writer.write_value(timer.cb.__name__)
+        writer.write_value(attr_name)
+        writer.write_value(timer.ms)
+        writer.write_value(timer.one_shot)
+        writer.write_value(timer.tick_count)
+
+    return writer.getvalue()
+
+
+def load_state(engine, data):
+    """Loads a save state made by save_state into the running game.
+
+    Anything not part of the state, such as crossovers, is stopped.
+    StateError is raised if anything is running that couldn't be restored
+    afterward (see can_save_state), as stopping it could leave the game
+    stuck partway through a sequence.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise StateError('This is not a save state')
+
+    reader = StateReader(data, {})
+    reader.pos = len(MAGIC)
+
+    if reader.read_varint() != VERSION:
+        raise StateError('Unsupported save state version')
+
+    level_num = reader.read_varint()
+
+    if (not engine.active_level or
+        engine.levels.index(engine.active_level) != level_num):
+        engine.switch_level(level_num)
+
+    level = engine.active_level
+    player = engine.player
+    animation_manager = engine.animation_manager
+    live_objects = get_state_objects(engine)
+    unrestorable = _get_unrestorable(engine, _get_refs(live_objects))
+
+    if unrestorable:
+        raise StateError('A state cannot be loaded while %r is running'
+                         % unrestorable[0])
+
+    # Random number generator
+    version = reader.read_varint()
+    internal_state = struct.unpack('<%dI' % RNG_STATE_SIZE,
+                                   reader.read(4 * RNG_STATE_SIZE))
+    random.setstate((version, internal_state, reader.read_value()))
+
+    # The areas must be built before anything in them can be referenced.
+    areas = get_state_objects(engine)[REF_AREA]
+
+    if reader.read_varint() != len(areas):
+        raise StateError('The save state is for a different level')
+
+    built_areas = []
+
+    for area in areas:
+        if reader.read_value():
+            area.build()
+            built_areas.append(area)
+
+    # Areas built since the state was saved are left as they are.
+    objects = get_state_objects(engine, built_areas)
+    reader.objects = objects
+    old_area = level.active_area
+
+    # Stop anything that isn't part of the state. Timers calling into
+    # objects outside of it, such as particle systems, are left alone.
+    refs = _get_refs(objects)
+
+    for timer in list(_get_level_timers(engine)):
+        owner = getattr(timer.cb, '__self__', None)
+
+        if owner is None or owner in refs:
+            timer.stop()
+
+    # The effects in areas built since the state was saved are left
+    # running, like everything else in them.
+    kept_animations = [
+        animation
+        for animation in animation_manager.animations
+        if (animation in live_objects[REF_EFFECT] and
+            animation not in refs)
+    ]
+
+    for animation in animation_manager.animations:
+        if animation not in kept_animations:
+            animation.running = False
+
+    animation_manager.clear()
+    animation_manager.animations = kept_animations
+    player.stop_riding()
+
+    # Anything else on the layers, such as crossovers, is taken off them.
+    # The sprites in the state are only moved if they need to be, below.
+    state_sprites = set(objects[REF_SPRITE])
+
+    for area in built_areas:
+        for layer in area.layers:
+            for sprite in layer.quad_tree.get_all_sprites():
+                if sprite not in state_sprites:
+                    layer.detach(sprite)
+
+    level.crossovers = []
+    level.pending_crossovers = {}
+
+    time_period_num = reader.read_value()
+
+    if time_period_num is None:
+        level.active_time_period = None
+    else:
+        level.active_time_period = level.time_periods[time_period_num]
+
+    _read_attrs(reader, level)
+
+    for area in built_areas:
+        _read_attrs(reader, area)
+
+    # Sprites
+    sprites = objects[REF_SPRITE]
+
+    if reader.read_varint() != len(sprites):
+        raise StateError('The save state is for a different level')
+
+    sprite_states = [
+        (sprite, _read_field_values(reader, sprite), reader.read_value())
+        for sprite in sprites
+    ]
+
+    for sprite, values, layer in sprite_states:
+        fields = dict(zip(sprite.STATE_FIELDS, values))
+
+        if sprite.quad_trees:
+            old_layer = sprite.layer
+        else:
+            old_layer = None
+
+        # Re-indexing sprites is the slowest part of loading a state, so
+        # it's only done for sprites whose place or image has changed.
+        # The old layer may be in an area built since the state was
+        # saved.
+        image_changed = (
+            fields['_direction'] != sprite._direction or
+            fields['reverse_gravity'] != sprite.reverse_gravity or
+            fields['name'] != sprite.name)
+        moved = (image_changed or layer is not old_layer or
+                 fields['rect'] != sprite.rect or
+                 fields['visible'] != sprite.visible)
+
+        if moved and old_layer:
+            old_layer.detach(sprite)
+
+        _set_fields(sprite, values)
+        sprite.dirty = sprite.visible and 2 or 1
+
+        if image_changed:
+            sprite.invalidate_image()
+
+        if moved and layer:
+            layer.attach(sprite)
+
+    if player.vehicle:
+        player.vehicle_moved_cnx = \
+            player.vehicle.moved.connect(player.on_vehicle_moved)
+
+    player.calculate_collision_rects()
+
+    # Effects
+    effects = objects[REF_EFFECT]
+
+    if reader.read_varint() != len(effects):
+        raise StateError('The save state is for a different level')
+
+    for effect in effects:
+        running = reader.read_value()
+
+        if running:
+            animation_manager.add(effect)
+
+        _read_fields(reader, effect)
+        effect.running = running
+
+    # Timers
+    for i in xrange(reader.read_varint()):
+        owner = reader.read_value()
+        cb = getattr(owner, reader.read_value())
+        attr_name = reader.read_value()
+        ms = reader.read_value()
+        one_shot = reader.read_value()
+        tick_count = reader.read_value()
+
+        timer = None
+
+        if attr_name:
+            timer = getattr(owner, attr_name, None)
+
+        if not isinstance(timer, Timer):
+            timer = Timer(0, cb, one_shot)
+
+        timer.ms = ms
+        timer.cb = cb
+        timer.one_shot = one_shot
+        timer.level = level
+        timer.start()
+        timer.tick_count = tick_count
+
+        if attr_name:
+            setattr(owner, attr_name, timer)
+
+    if level.active_area != old_area:
+        level.time_period_changed.emit()
+        level.area_changed.emit()
+
+
+def _write_fields(writer, obj):
+    chunks = writer.chunks
+    writer.write_varint(len(obj.STATE_FIELDS))
+
+    for name in obj.STATE_FIELDS:
+        value = getattr(obj, name, None)
+
+        # Most fields are flags, which are written here directly, as this
+        # runs for every sprite on every tick recorded for rewinding.
+        if value is True:
+            chunks.append(TAG_TRUE)
+        elif value is False:
+            chunks.append(TAG_FALSE)
+        else:
+            num_chunks = len(chunks)
+
+            try:
+                writer.write_value(value)
+            except StateError:
+                # Most likely a reference to a sprite created during play.
+                del chunks[num_chunks:]
+                chunks.append(TAG_NONE)
+
+
+def _read_fields(reader, obj):
+    _set_fields(obj, _read_field_values(reader, obj))
+
+
+def _read_field_values(reader, obj):
+    if reader.read_varint() != len(obj.STATE_FIELDS):
+        raise StateError('The save state is from an older version of %s'
+                         % type(obj).__name__)
+
+    return [reader.read_value() for name in obj.STATE_FIELDS]
+
+
+def _set_fields(obj, values):
+    for name, value in zip(obj.STATE_FIELDS, values):
+        current = getattr(obj, name, None)
+
+        if isinstance(value, pygame.Rect) and isinstance(current, pygame.Rect):
+            # Rects are often shared with event boxes and collision rects.
+            current.topleft = value.topleft
+            current.size = value.size
+        elif value is not None or hasattr(obj, name):
+            setattr(obj, name, value)
+
+
+def _write_attrs(writer, obj):
+    attrs = [
+        (key, value)
+        for key, value in sorted(obj.__dict__.iteritems())
+        if key not in IGNORED_ATTRS and writer.is_encodable(value)
+    ]
+
+    writer.write_varint(len(attrs))
+
+    for key, value in attrs:
+        writer.write_value(key)
+        writer.write_value(value)
+
+
+def _read_attrs(reader, obj):
+    for i in xrange(reader.read_varint()):
+        key = reader.read_value()
+        setattr(obj, key, reader.read_value())
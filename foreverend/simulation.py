@@ -0,0 +1,265 @@
+import pygame
+
+from foreverend.savestate import load_state, save_state
+from foreverend.timer import Timer
+
+
+class Fork(object):
+    """A copy of the simulation at a given tick, which can be run forward.
+
+    Only the mutable state is copied: sprite rects, velocities and flags,
+    running effects and timers, and the random number generator (see
+    save_state). Everything else, such as the images, masks and quad
+    trees, belongs to the live game and is shared between every fork.
+    The state is an immutable string, so forks are cheap to make and
+    keep around, and can be branched any number of times.
+
+    The keys held down at the time are kept as well, so that a rollout
+    releases them properly.
+    """
+    def __init__(self, engine, state, held_keys=frozenset(), ticks=0):
+        self.engine = engine
+        self.state = state
+        self.held_keys = frozenset(held_keys)
+        self.ticks = ticks
+
+    def clone(self):
+        return Fork(self.engine, self.state, self.held_keys, self.ticks)
+
+    def rollout(self, inputs, num_ticks=None):
+        """Runs a copy of this fork forward, headless, and returns a Rollout.
+
+        inputs is a sequence of the keys held down on each tick (such as
+        K_LEFT, K_RIGHT, K_SPACE and K_LSHIFT). If num_ticks is longer
+        than inputs, the last keys are held for the remaining ticks.
+
+        The rollout stops early if the player dies or finishes the level.
+        The live game is left exactly as it was.
+        """
+        return self.rollouts([inputs], num_ticks)[0]
+
+    def rollouts(self, input_sequences, num_ticks=None):
+        """Runs a rollout for each sequence of inputs, returning a list of
+        Rollouts.
+
+        See rollout(). The live game is only saved and put back once for
+        the whole batch, which is most of the cost of a short rollout.
+        """
+        engine = self.engine
+        live_fork = engine.clone()
+        live_state = LiveState(engine)
+        paused = engine.paused
+        rollouts = []
+
+        assert not engine.simulation
+        engine.paused = False
+
+        try:
+            for inputs in input_sequences:
+                rollout = Rollout(self)
+                engine.simulation = rollout
+                self._run(rollout, inputs, num_ticks)
+                rollouts.append(rollout)
+        finally:
+            engine.simulation = None
+            engine.paused = paused
+            live_fork.restore()
+            live_state.restore()
+
+        return rollouts
+
+    def _run(self, rollout, inputs, num_ticks):
+        engine = self.engine
+        keys = self.held_keys
+
+        if num_ticks is None:
+            num_ticks = len(inputs)
+
+        load_state(engine, self.state)
+        engine.held_keys = self.held_keys
+
+        for i in xrange(num_ticks):
+            if i < len(inputs):
+                keys = frozenset(inputs[i])
+
+            rollout.held_keys = keys
+            engine.simulate_tick(keys)
+            rollout.ticks += 1
+
+            if rollout.outcome:
+                break
+
+        rollout.state = save_state(engine)
+
+    def restore(self):
+        """Loads this fork into the live game."""
+        load_state(self.engine, self.state)
+        self.engine.held_keys = self.held_keys
+
+        # The UI isn't part of the state.
+        self.engine.player.health_changed.emit()
+        self.engine.player.lives_changed.emit()
+
+
+class LiveState(object):
+    """Captures what save states leave out of the live game.
+
+    Save states only hold what can be restored within a level, so a
+    rollout could otherwise leave things running in the live game that
+    weren't there before it, or stop things that were. This covers the
+    tick callbacks (and so every timer) and running effects as a whole,
+    the particle systems and their particles, the crossovers on screen,
+    the attributes of the level and its built areas, and the frame
+    number.
+
+    Like load_state, areas built during the rollout are left as they
+    are, along with whatever their setup started.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.level = engine.active_level
+        self.frame_num = engine.frame_num
+        self.tick_callbacks = list(engine.tick.callbacks)
+        self.timers = []
+        self.animations = [
+            (animation, dict(animation.__dict__))
+            for animation in engine.animation_manager.animations
+        ]
+        self.built_areas = []
+        self.particle_systems = []
+        self.states = {}
+
+        for callback in self.tick_callbacks:
+            timer = getattr(callback, '__self__', None)
+
+            if isinstance(timer, Timer):
+                self.timers.append((timer, dict(timer.__dict__)))
+
+        if self.level:
+            self.num_setup_timers = len(self.level.snapshot.timers)
+            self.num_setup_animations = len(self.level.snapshot.animations)
+            self.built_areas = list(self.level.get_built_areas())
+            self._capture_object(self.level)
+
+            for area in self.built_areas:
+                self._capture_object(area)
+
+                for particle_system in area.particle_systems:
+                    self.particle_systems.append(
+                        (particle_system, particle_system.get_state()))
+
+    def restore(self):
+        engine = self.engine
+        level = engine.active_level
+        animation_manager = engine.animation_manager
+
+        if not level or level is not self.level:
+            return
+
+        # Particles may have moved between systems, so every system is
+        # stopped before any are put back.
+        for area in self.built_areas:
+            for particle_system in list(area.particle_systems):
+                particle_system.stop()
+
+        for particle_system, state in self.particle_systems:
+            particle_system.set_state(state)
+
+        # Attributes the state couldn't hold, such as timers and particle
+        # systems, may have been replaced.
+        for obj, state in self.states.iteritems():
+            for key in obj.__dict__.keys():
+                if key not in state:
+                    del obj.__dict__[key]
+
+            for key, value in state.iteritems():
+                current = obj.__dict__.get(key)
+
+                if (isinstance(value, pygame.Rect) and
+                    isinstance(current, pygame.Rect)):
+                    # Event boxes and collision rects may share the rect.
+                    current.topleft = value.topleft
+                    current.size = value.size
+                else:
+                    obj.__dict__[key] = self._copy_value(value)
+
+        # Keep what was started by building areas during the rollout.
+        new_timers = set(level.snapshot.timers[self.num_setup_timers:])
+        new_animations = \
+            level.snapshot.animations[self.num_setup_animations:]
+
+        for area in level.get_built_areas():
+            if area not in self.built_areas:
+                for particle_system in area.particle_systems:
+                    new_timers.add(particle_system.timer)
+
+        kept_callbacks = [
+            callback
+            for callback in engine.tick.callbacks
+            if getattr(callback, '__self__', None) in new_timers
+        ]
+        kept_animations = [
+            animation
+            for animation in new_animations
+            if animation in animation_manager.animations
+        ]
+
+        engine.tick.callbacks = self.tick_callbacks + kept_callbacks
+
+        for timer, state in self.timers:
+            timer.__dict__.update(state)
+
+        animation_manager.animations = []
+
+        for animation, state in self.animations:
+            animation.__dict__.update(state)
+            animation_manager.animations.append(animation)
+
+        animation_manager.animations += kept_animations
+
+        # Loading the state took the crossovers off their layers.
+        for crossover, timer in level.crossovers:
+            if not crossover.quad_trees:
+                crossover.layer.attach(crossover)
+
+        engine.frame_num = self.frame_num
+
+    def _capture_object(self, obj):
+        self.states[obj] = dict(
+            (key, self._copy_value(value))
+            for key, value in obj.__dict__.iteritems())
+
+    def _copy_value(self, value):
+        if isinstance(value, pygame.Rect):
+            return pygame.Rect(value)
+        elif isinstance(value, list):
+            return list(value)
+        elif isinstance(value, set):
+            return set(value)
+        elif isinstance(value, dict):
+            return dict(value)
+        else:
+            return value
+
+
+class Rollout(object):
+    """The result of running a fork forward.
+
+    outcome is None if all the ticks were run, or 'dead', 'game_over' or
+    'level_complete' if the rollout stopped early.
+    """
+    def __init__(self, fork):
+        self.fork = fork
+        self.ticks = 0
+        self.outcome = None
+        self.state = None
+        self.held_keys = fork.held_keys
+
+    def end(self, outcome):
+        if not self.outcome:
+            self.outcome = outcome
+
+    def get_fork(self):
+        """Returns a fork at the end of the rollout, to branch from."""
+        return Fork(self.fork.engine, self.state, self.held_keys,
+                    self.fork.ticks + self.ticks)
@@ -0,0 +1,218 @@
+import pygame
+
+from foreverend.eventbox import EventBox
+from foreverend.signals import Signal
+from foreverend.sprites.base import Sprite
+from foreverend.timer import Timer
+
+
+class LevelSnapshot(object):
+    """Captures a level's state after setup, so it can be restored in place.
+
+    The level is captured after its setup, and each area after it's
+    built. Restoring puts the attributes of every captured object, the
+    sprites on each layer, and the timers and effects started during
+    setup back the way they were, without rebuilding anything.
+    """
+    # These are managed by the layers and sprite groups.
+    IGNORED_ATTRS = set(['quad_trees', '_layer', '_Sprite__g'])
+
+    def __init__(self, level):
+        self.level = level
+        self.engine = level.engine
+        self.states = {}
+        self.signals = {}
+        self.layers = []
+        self.timers = []
+        self.animations = []
+
+    def get_running(self):
+        """Returns the level's timers and the animations currently running.
+
+        This should be passed back when capturing, so that only what was
+        started during setup is restarted when restoring.
+        """
+        return (set(self._get_running_timers()),
+                set(self.engine.animation_manager.animations))
+
+    def capture_level(self, running):
+        self._capture_started(running)
+        self._capture_object(self.level)
+        self._capture_references(self.level)
+
+    def capture_area(self, area, running):
+        self._capture_started(running)
+
+        for layer in area.layers:
+            sprites = self._get_layer_sprites(layer)
+            self.layers.append((layer, sprites))
+
+            for sprite in sprites:
+                self._capture_object(sprite)
+
+        for obj in area.event_handlers:
+            self._capture_object(obj)
+
+        self._capture_object(area)
+        self._capture_references(area)
+
+        # Setting up an area can add to the level, such as the artifact.
+        self._capture_object(self.level, new_only=True)
+        self._capture_references(self.level)
+
+    def restore(self):
+        level = self.level
+        player = self.engine.player
+        animation_manager = self.engine.animation_manager
+
+        if (level.active_area and
+            player.layer == level.active_area.main_layer and
+            player.quad_trees):
+            level.active_area.main_layer.remove(player)
+
+        # Stop everything that's going on. What was started during setup
+        # is started again below.
+        for timer in list(self._get_running_timers()):
+            timer.stop()
+
+        for animation in animation_manager.animations:
+            animation.running = False
+
+        animation_manager.clear()
+
+        for area in level.get_built_areas():
+            for particle_system in list(area.particle_systems):
+                particle_system.stop()
+
+            for layer in area.layers:
+                for sprite in self._get_layer_sprites(layer):
+                    layer.detach(sprite)
+
+                if layer.chunk_cache:
+                    layer.chunk_cache.clear()
+
+                layer.clear_snapshot()
+
+        for obj, state in self.states.iteritems():
+            for key in obj.__dict__.keys():
+                if key not in state and key not in self.IGNORED_ATTRS:
+                    del obj.__dict__[key]
+
+            for key, value in state.iteritems():
+                current = obj.__dict__.get(key)
+
+                if (isinstance(value, pygame.Rect) and
+                    isinstance(current, pygame.Rect)):
+                    # Other objects (event boxes, collision rects) may
+                    # share the rect, so it's updated in place.
+                    current.topleft = value.topleft
+                    current.size = value.size
+                else:
+                    obj.__dict__[key] = self._copy_value(value)
+
+        for signal, callbacks in self.signals.iteritems():
+            signal.callbacks = list(callbacks)
+
+        added = set()
+
+        for layer, sprites in self.layers:
+            for sprite in sprites:
+                if sprite not in added:
+                    added.add(sprite)
+                    layer.attach(sprite)
+
+        for timer in self.timers:
+            timer.start()
+
+        for animation in self.animations:
+            if not animation.running:
+                animation.start()
+
+    def _get_running_timers(self):
+        for callback in self.engine.tick.callbacks:
+            timer = getattr(callback, '__self__', None)
+
+            if isinstance(timer, Timer) and timer.level == self.level:
+                yield timer
+
+    def _get_layer_sprites(self, layer):
+        # Keep the drawing order of the sprites in the group.
+        sprites = []
+        seen = set([self.engine.player])
+
+        for sprite in (layer.area.group.get_sprites_from_layer(layer.index) +
+                       list(layer.quad_tree)):
+            if sprite not in seen:
+                seen.add(sprite)
+                sprites.append(sprite)
+
+        return sprites
+
+    def _get_quad_tree_callbacks(self):
+        callbacks = set()
+
+        for area in self.level.get_built_areas():
+            for layer in area.layers:
+                for cnx in layer.quad_tree.moved_cnxs.itervalues():
+                    callbacks.add(cnx.cb)
+
+        return callbacks
+
+    def _capture_started(self, running):
+        timers, animations = running
+
+        for timer in self._get_running_timers():
+            if timer not in timers:
+                self.timers.append(timer)
+
+        for animation in self.engine.animation_manager.animations:
+            if animation not in animations:
+                self.animations.append(animation)
+
+    def _capture_object(self, obj, new_only=False):
+        state = self.states.setdefault(obj, {})
+        quad_tree_callbacks = None
+
+        for key, value in obj.__dict__.iteritems():
+            if key in self.IGNORED_ATTRS or (new_only and key in state):
+                continue
+
+            if isinstance(value, Signal):
+                # The quad trees connect to the sprites themselves when
+                # the sprites are added back.
+                if quad_tree_callbacks is None:
+                    quad_tree_callbacks = self._get_quad_tree_callbacks()
+
+                self.signals[value] = [
+                    callback
+                    for callback in value.callbacks
+                    if callback not in quad_tree_callbacks
+                ]
+
+            state[key] = self._copy_value(value)
+
+    def _capture_references(self, obj):
+        """Captures any sprites and helper objects obj refers to directly.
+
+        This covers objects such as items owned by the level, or sprite
+        groupings like Mountain and Volcano, that aren't on a layer.
+        """
+        for value in obj.__dict__.values():
+            if (isinstance(value, (Sprite, EventBox)) or
+                (hasattr(value, '__dict__') and
+                 type(value).__module__.startswith('foreverend.sprites'))):
+                if (value is not self.engine.player and
+                    value not in self.states):
+                    self._capture_object(value)
+
+    def _copy_value(self, value):
+        if isinstance(value, pygame.Rect):
+            return pygame.Rect(value)
+        elif isinstance(value, list):
+            return list(value)
+        elif isinstance(value, set):
+            return set(value)
+        elif isinstance(value, dict):
+            return dict(value)
+        else:
+            return value
@@ -1,7 +1,8 @@
 import pygame
 from pygame.locals import *
 
-from foreverend.resources import load_image
+from foreverend.resources import load_flipped_image, load_image, \
+                                 load_tiled_image
 from foreverend.signals import Signal
 
 
@@ -15,6 +16,12 @@ class Direction(object):
 class Sprite(pygame.sprite.DirtySprite):
     FALL_SPEED = 6
 
+    # The dynamic state saved in save states, in order.
+    STATE_FIELDS = ('rect', 'velocity', 'name', '_direction',
+                    'reverse_gravity', 'obey_gravity', 'falling',
+                    'collidable', 'grabbed', 'grabbable', 'lethal',
+                    'should_check_collisions', 'visible')
+
     def __init__(self, name, flip_image=False, obey_gravity=False):
         super(Sprite, self).__init__()
 
@@ -27,8 +34,11 @@ class Sprite(pygame.sprite.DirtySprite):
         self.rect = pygame.Rect(0, 0, 0, 0)
         self.quad_trees = set()
         self.layer = None
+        self._image = None
+        self._image_version = 0
+        self._generated_image_version = -1
+        self._name = None
         self.name = name
-        self.image = None
         self.visible = 1
         self.dirty = 2
         self.velocity = (0, 0)
@@ -41,12 +51,13 @@ class Sprite(pygame.sprite.DirtySprite):
         self.grabbable = False
         self.should_check_collisions = False
         self.use_pixel_collisions = False
+        self.can_bake = True
         self.flip_image = flip_image
+        self.can_turn = False
         self.collision_rects = []
         self.collision_masks = []
         self._colliding_objects = set()
         self._direction = Direction.RIGHT
-        self._flipped_images = {}
 
     def __repr__(self):
         return 'Sprite %s (%s, %s, %s, %s)' % \
@@ -57,16 +68,48 @@ class Sprite(pygame.sprite.DirtySprite):
         if self.reverse_gravity != reverse_gravity:
             self.reverse_gravity = reverse_gravity
             self.velocity = (self.velocity[0], -self.velocity[1])
-            self.update_image()
+            self.invalidate_image()
             self.reverse_gravity_changed.emit()
 
     def _set_direction(self, direction):
         if self.direction != direction:
             self._direction = direction
             self.direction_changed.emit()
-            self.update_image()
+            self.invalidate_image()
     direction = property(lambda self: self._direction, _set_direction)
 
+    def _set_name(self, name):
+        if self._name != name:
+            self._name = name
+            self.invalidate_image()
+    name = property(lambda self: self._name, _set_name)
+
+    def _get_image(self):
+        if self._name and self.is_image_stale():
+            self.update_image()
+
+        return self._image
+
+    def _set_image(self, image):
+        self._image = image
+        self._generated_image_version = self._image_version
+    image = property(_get_image, _set_image)
+
+    def invalidate_image(self):
+        """Marks the image as needing to be regenerated.
+
+        The image isn't regenerated until it's next needed, either when
+        drawn or when the sprite is (re)placed on a layer.
+        """
+        self._image_version += 1
+
+    def is_image_stale(self):
+        return self._generated_image_version != self._image_version
+
+    def ensure_image(self):
+        if self.is_image_stale():
+            self.update_image()
+
     def show(self):
         if not self.visible:
             self.visible = 1
@@ -109,22 +152,18 @@ class Sprite(pygame.sprite.DirtySprite):
             # Must be a custom sprite.
             return self.image
 
-        image = load_image(self.name)
-
-        if (self.flip_image and
-            (self._direction == Direction.LEFT or self.reverse_gravity)):
-            flip_h = (self.direction == Direction.LEFT)
-            flip_v = self.reverse_gravity
+        if not self.flip_image:
+            return load_image(self.name)
 
-            key = (self.name, flip_h, flip_v)
+        flip_h = (self._direction == Direction.LEFT)
+        flip_v = self.reverse_gravity
 
-            if key not in self._flipped_images:
-                self._flipped_images[key] = \
-                    pygame.transform.flip(image, flip_h, flip_v)
+        if self.can_turn:
+            # Have the image for the other direction ready too, so turning
+            # around never has to wait on a flip.
+            load_flipped_image(self.name, not flip_h, flip_v)
 
-            image = self._flipped_images[key]
-
-        return image
+        return load_flipped_image(self.name, flip_h, flip_v)
 
     def move_to(self, x, y, check_collisions=False):
         self.move_by(x - self.rect.x, y - self.rect.y, check_collisions)
@@ -312,22 +351,5 @@ class TiledSprite(Sprite):
         self.tiles_x = tiles_x
         self.tiles_y = tiles_y
 
-    def update_image(self):
-        super(TiledSprite, self).update_image()
-
-        tile_width = self.rect.width
-        tile_height = self.rect.height
-
-        self.rect.width = self.tiles_x * self.rect.width
-        self.rect.height = self.tiles_y * self.rect.height
-
-        new_image = pygame.Surface(self.rect.size).convert_alpha()
-        new_image.fill((0, 0, 0, 0))
-
-        for y in range(0, self.tiles_y):
-            for x in range(0, self.tiles_x):
-                new_image.blit(self.image,
-                               (self.rect.x + x * tile_width,
-                                self.rect.y + y * tile_height))
-
-        self.image = new_image
+    def generate_image(self):
+        return load_tiled_image(self.name, self.tiles_x, self.tiles_y)
@@ -34,11 +34,33 @@ class Button(Sprite):
 
 
 class Crossover(Sprite):
-    def __init__(self, area):
+    MIN_SIZE = 300
+    MAX_SIZE = 600
+
+    def __init__(self, area, view_rect=None):
         super(Crossover, self).__init__(None)
         self.collidable = False
+        self.can_bake = False
         self.obey_gravity = False
+        self.set_view(area, view_rect or self.rect)
+
+    def set_view(self, area, view_rect):
+        """Sets the area to show, and the part of it to show it within.
+
+        A new piece of the area is picked the next time the image is
+        needed.
+        """
         self.crossover_area = area
+        self.view_rect = pygame.Rect(view_rect)
+        self.rect = pygame.Rect(view_rect)
+        self.invalidate_image()
+
+    def _get_image(self):
+        # Crossovers have no name, so the image is regenerated here
+        # rather than by Sprite.
+        self.ensure_image()
+        return self._image
+    image = property(_get_image, Sprite.image.fset)
 
     def on_added(self, layer):
         self.effect = ShakeEffect(self)
@@ -48,45 +70,50 @@ class Crossover(Sprite):
         self.effect.stop()
 
     def update_image(self):
-        if not self.image:
-            possible_sprites = []
-            new_rect = pygame.Rect(0, 0, 0, 0)
-
-            for layer in self.crossover_area.layers:
-                if layer.index == self.layer.index:
-                    for sprite in layer.quad_tree.get_sprites(self.rect):
-                        if new_rect.width == 0:
-                            new_rect = sprite.rect
-                        else:
-                            new_rect = new_rect.union(sprite.rect)
-
-                    break
-
-            if new_rect.width == 0:
-                self.hide()
-                return
-
-            w = random.randint(300, 600)
-            h = random.randint(300, 600)
-
-            try:
-                x = random.randint(max(new_rect.left, self.rect.left),
-                                   min(new_rect.right, self.rect.right))
-                y = random.randint(max(new_rect.top, self.rect.top),
-                                   min(new_rect.bottom, self.rect.bottom))
-            except ValueError:
-                self.hide()
-                return
-
-            self.rect = pygame.Rect(x, y, w, h)
-
-            self.image = pygame.Surface(self.rect.size).convert_alpha()
-            self.image.fill((0, 0, 0, 0))
-
-            for sprite in layer.quad_tree.get_sprites(self.rect):
-                pos = (sprite.rect.left - self.rect.left,
-                       sprite.rect.top - self.rect.top)
-                self.image.blit(sprite.image, pos)
+        possible_sprites = []
+        new_rect = pygame.Rect(0, 0, 0, 0)
+        view_rect = self.view_rect
+
+        for layer in self.crossover_area.layers:
+            if layer.index == self.layer.index:
+                for sprite in layer.quad_tree.get_sprites(view_rect):
+                    if new_rect.width == 0:
+                        new_rect = sprite.rect
+                    else:
+                        new_rect = new_rect.union(sprite.rect)
+
+                break
+
+        if new_rect.width == 0:
+            self._show_nothing()
+            return
+
+        w = random.randint(self.MIN_SIZE, self.MAX_SIZE)
+        h = random.randint(self.MIN_SIZE, self.MAX_SIZE)
+
+        try:
+            x = random.randint(max(new_rect.left, view_rect.left),
+                               min(new_rect.right, view_rect.right))
+            y = random.randint(max(new_rect.top, view_rect.top),
+                               min(new_rect.bottom, view_rect.bottom))
+        except ValueError:
+            self._show_nothing()
+            return
+
+        # Any crossover shown from this view fits within this region,
+        # so the snapshot can be shared between them.
+        region = pygame.Rect(view_rect.left, view_rect.top,
+                             view_rect.width + self.MAX_SIZE,
+                             view_rect.height + self.MAX_SIZE)
+        self.image = layer.get_snapshot(pygame.Rect(x, y, w, h), region)
+        self.rect = pygame.Rect((x, y), self.image.get_size())
+
+    def _show_nothing(self):
+        # There's nothing from the other area here. This also marks the
+        # image as up to date, so it isn't tried again until the view
+        # changes.
+        self.image = pygame.Surface((0, 0))
+        self.hide()
 
 
 class Door(Sprite):
@@ -107,8 +134,11 @@ class Door(Sprite):
             assert isinstance(self.destination, Door)
 
             player = self.layer.area.engine.player
-            dest_rect = self.destination.rect
 
+            if not self.destination.layer:
+                self.layer.area.level.build_area_for(self.destination)
+
+            dest_rect = self.destination.rect
             dest_area = self.destination.layer.area
             assert dest_area.level == self.layer.area.level
 
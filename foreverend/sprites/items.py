@@ -14,11 +14,16 @@ class Item(Sprite):
         self.grabbable = True
         self.flip_image = True
 
+        # Items face the player's way while they're being carried.
+        self.can_turn = True
+
         # Signals
         self.grab_changed = Signal()
 
 
 class Artifact(Item):
+    STATE_FIELDS = Item.STATE_FIELDS + ('floating',)
+
     def __init__(self, area, num):
         super(Artifact, self).__init__('artifact%s' % num)
         self.obey_gravity = False
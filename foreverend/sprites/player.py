@@ -2,6 +2,7 @@ import pygame
 from pygame.locals import *
 
 from foreverend import get_engine
+from foreverend.resources import pin_image
 from foreverend.signals import Signal
 from foreverend.sprites.base import Direction, Sprite
 from foreverend.sprites.items import Item, Vehicle
@@ -12,8 +13,13 @@ class TractorBeam(Sprite):
     HORIZ_OFFSET_ALLOWANCE = -32
     VERT_OFFSET_ALLOWANCE = 6
 
+    STATE_FIELDS = Sprite.STATE_FIELDS + ('item', 'freeze_item_y',
+                                          'item_offset',
+                                          'old_item_obey_gravity')
+
     def __init__(self, player, name='tractor_beam'):
         super(TractorBeam, self).__init__(name, flip_image=True)
+        self.can_turn = True
         self.player = player
         self.item = None
         self.ungrab()
@@ -162,9 +168,17 @@ class Player(Sprite):
 
     PROPULSION_BELOW_OFFSET = 8
 
+    STATE_FIELDS = Sprite.STATE_FIELDS + ('jumping', 'hovering',
+                                          'block_events', 'jump_origin',
+                                          'hover_time_ms', 'health', 'lives',
+                                          'last_safe_spot', 'vehicle')
+
     def __init__(self):
         super(Player, self).__init__('player', flip_image=True,
                                      obey_gravity=True)
+        self.can_turn = True
+        pin_image('player', 'propulsion_below', 'tractor_beam',
+                  'tractor_beam_wide')
         self.engine = get_engine()
         self.should_check_collisions = True
 
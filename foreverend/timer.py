@@ -4,6 +4,7 @@ from foreverend import get_engine
 class Timer(object):
     def __init__(self, ms, cb, one_shot=False):
         self.engine = get_engine()
+        self.level = self.engine.active_level
         self.ms = ms
         self.cb = cb
         self.tick_count_count = 0
@@ -1,12 +1,92 @@
+from collections import OrderedDict
+
 import pygame
 from pygame.locals import *
 
-from foreverend.resources import get_font_filename, load_image
+from foreverend.resources import get_font_filename, load_image, pin_image
 from foreverend.signals import Signal
 from foreverend.sprites.player import Player
 from foreverend.timer import Timer
 
 
+class GlyphAtlas(object):
+    """A single surface holding every printable character for a font/color.
+
+    This is used for strings that change constantly (such as the debug
+    line), where caching whole lines wouldn't help. Drawing text is then
+    just a blit per character from the atlas.
+    """
+    CHARACTERS = ''.join([chr(i) for i in range(32, 127)])
+
+    def __init__(self, font, color):
+        self.surface = font.render(self.CHARACTERS, True, color)
+        self.rects = {}
+
+        height = self.surface.get_height()
+        x = 0
+
+        # Measure by prefix so that the offsets line up with how the
+        # characters were actually laid out in the atlas.
+        for i, c in enumerate(self.CHARACTERS):
+            next_x = font.size(self.CHARACTERS[:i + 1])[0]
+            self.rects[c] = pygame.Rect(x, 0, next_x - x, height)
+            x = next_x
+
+    def draw(self, surface, text, pos):
+        x, y = pos
+        space_rect = self.rects[' ']
+
+        for c in text:
+            rect = self.rects.get(c, space_rect)
+            surface.blit(self.surface, (x, y), rect)
+            x += rect.width
+
+
+class TextRenderer(object):
+    """Renders text for the UI, caching the results.
+
+    Rendered lines are kept in an LRU cache keyed by the font (which is
+    specific to a font file and size), the text and the color, so
+    repeated UI text only costs a blit.
+    """
+    MAX_CACHED_LINES = 128
+
+    def __init__(self):
+        self.lines = OrderedDict()
+        self.atlases = {}
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color=(255, 255, 255)):
+        key = (font, text, color)
+
+        try:
+            surface = self.lines.pop(key)
+            self.hits += 1
+        except KeyError:
+            surface = font.render(text, True, color)
+            self.misses += 1
+
+            if len(self.lines) >= self.MAX_CACHED_LINES:
+                self.lines.popitem(last=False)
+
+        self.lines[key] = surface
+
+        return surface
+
+    def draw_glyphs(self, surface, font, text, color, pos):
+        key = (font, color)
+
+        if key not in self.atlases:
+            self.atlases[key] = GlyphAtlas(font, color)
+
+        self.atlases[key].draw(surface, text, pos)
+
+    def clear(self):
+        self.lines.clear()
+        self.atlases.clear()
+
+
 class Widget(object):
     def __init__(self, ui_manager):
         self.ui_manager = ui_manager
@@ -68,7 +148,7 @@ class TextBox(Widget):
                 attrs, text = column
                 font = attrs.get('font', self.ui_manager.font)
 
-                text_surface = font.render(text, True, (255, 255, 255))
+                text_surface = self.ui_manager.text_renderer.render(font, text)
                 column_surfaces.append((attrs, text_surface))
                 column_height = text_surface.get_height()
 
@@ -122,6 +202,8 @@ class ControlPanel(Widget):
         self._level = None
         self.resize(self.ui_manager.size[0], 40)
         self.surface = pygame.Surface(self.rect.size)
+
+        pin_image('heart', 'heart_lost', 'life', 'life_lost')
         self.heart_image = load_image('heart')
         self.heart_lost_image = load_image('heart_lost')
         self.life_image = load_image('life')
@@ -149,8 +231,8 @@ class ControlPanel(Widget):
     def render(self):
         self.surface.fill((0, 0, 0))
 
-        text_surface = self.ui_manager.font.render(
-            self.level.active_time_period.name, True, (255, 255, 255))
+        text_surface = self.ui_manager.text_renderer.render(
+            self.ui_manager.font, self.level.active_time_period.name)
         self.surface.blit(text_surface,
                           ((self.rect.width - text_surface.get_width()) / 2,
                            (self.rect.height - text_surface.get_height()) / 2))
@@ -207,6 +289,7 @@ class UIManager(object):
         #self.default_font = pygame.font.get_default_font()
         self.font = pygame.font.Font(self.default_font, 20)
         self.small_font = pygame.font.Font(self.default_font, 16)
+        self.text_renderer = TextRenderer()
 
         self.engine.level_changed.connect(self.on_level_changed)
 
@@ -235,6 +318,9 @@ class UIManager(object):
         timer = Timer(2000, lambda: self.close(widget), one_shot=True)
         timer.start()
 
+        # This isn't part of the level, so it's left out of save states.
+        timer.level = None
+
         return widget
 
     def show_textbox(self, text, **kwargs):
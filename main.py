@@ -1,4 +1,5 @@
 #!/usr/bin/env python
 from foreverend.game import main
 
-main()
+if __name__ == '__main__':
+    main()
@@ -35,7 +35,7 @@ METADATA = dict(
         'pygame',
     ],
     include_package_data=True,
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests']),
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: End Users/Desktop',
@@ -0,0 +1,3 @@
+# The sprites and levels import each other, so they can only be imported
+# once the engine has been.
+import foreverend.engine
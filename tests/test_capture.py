@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from foreverend.capture import FrameCapture
+from tests.utils import EngineTestCase
+
+
+class FrameCaptureTests(EngineTestCase):
+    SIZE = (16, 12)
+
+    def setUp(self):
+        super(FrameCaptureTests, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'frames.rgb')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_dropped_frames(self):
+        """Testing that frames are dropped and counted when the writer
+        falls behind
+        """
+        frame_capture = FrameCapture(self.engine, self.SIZE)
+        num_frames = FrameCapture.NUM_BUFFERS + 2
+
+        # Without an output, nothing's ever written to free a buffer.
+        results = self._capture(frame_capture, num_frames)
+        self.assertEqual(results.count(False), 2)
+        self.assertEqual(frame_capture.frames_captured,
+                         FrameCapture.NUM_BUFFERS)
+        self.assertEqual(frame_capture.frames_dropped, 2)
+
+    def test_blocking(self):
+        """Testing that blocking captures wait for the writer instead of
+        dropping frames
+        """
+        frame_capture = FrameCapture(self.engine, self.SIZE, block=True)
+        num_frames = FrameCapture.NUM_BUFFERS * 4
+        frame_capture.open_file(self.filename, num_frames)
+
+        try:
+            results = self._capture(frame_capture, num_frames)
+        finally:
+            frame_capture.close()
+
+        self.assertTrue(all(results))
+        self.assertEqual(frame_capture.frames_dropped, 0)
+        self.assertEqual(os.path.getsize(self.filename),
+                         num_frames * frame_capture.frame_bytes)
+
+    def _capture(self, frame_capture, num_frames):
+        results = []
+
+        for i in xrange(num_frames):
+            self.run_ticks(1)
+            self.engine.draw_level()
+            results.append(frame_capture.capture())
+
+        return results
+
+
+if __name__ == '__main__':
+    unittest.main()
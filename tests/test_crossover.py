@@ -0,0 +1,60 @@
+import random
+import unittest
+
+import pygame
+
+from foreverend.sprites.common import Crossover
+from tests.utils import EngineTestCase
+
+
+class CrossoverTests(EngineTestCase):
+    def setUp(self):
+        super(CrossoverTests, self).setUp()
+        random.seed(0)
+
+        level = self.engine.active_level
+        area = level.active_area
+        self.other_area = [
+            time_period.areas[area.key]
+            for time_period in level.time_periods
+            if time_period != level.active_time_period
+        ][0]
+        self.other_area.build()
+        self.layer = area.main_layer
+        self.camera_rect = pygame.Rect(self.engine.camera.rect)
+        self.crossover = Crossover(self.other_area, self.camera_rect)
+
+    def tearDown(self):
+        if self.crossover.layer:
+            self.crossover.remove()
+
+    def test_new_crossover_is_stale(self):
+        """Testing that a new crossover generates its image when needed"""
+        self.assertTrue(self.crossover.is_image_stale())
+
+    def test_draw(self):
+        """Testing that drawing shows a piece of the other area"""
+        self.layer.add(self.crossover)
+        self.engine.draw_level()
+
+        self.assertFalse(self.crossover.is_image_stale())
+        self.assertTrue(self.crossover.visible)
+        self.assertNotEqual(self.crossover.rect.width, 0)
+        self.assertNotEqual(self.crossover.rect.height, 0)
+        self.assertEqual(self.crossover.rect.size,
+                         self.crossover.image.get_size())
+        self.assertTrue(self.crossover.rect.colliderect(self.camera_rect))
+
+    def test_set_view_invalidates_image(self):
+        """Testing that changing the view regenerates the image"""
+        self.layer.add(self.crossover)
+        image = self.crossover.image
+
+        self.crossover.set_view(self.other_area, self.camera_rect)
+        self.assertTrue(self.crossover.is_image_stale())
+        self.assertFalse(self.crossover.image is image)
+        self.assertFalse(self.crossover.is_image_stale())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from pygame.locals import K_2, K_LEFT, K_RIGHT
+
+from foreverend.env import ACTIONS, ForeverEndEnv, VectorForeverEndEnv
+from tests.utils import EngineTestCase, get_engine
+
+
+LEFT = ACTIONS.index(frozenset([K_LEFT]))
+RIGHT = ACTIONS.index(frozenset([K_RIGHT]))
+
+
+class ForeverEndEnvTests(EngineTestCase):
+    level_num = 1
+
+    def test_time_period_action(self):
+        """Testing that an action can switch time periods"""
+        env = ForeverEndEnv(self.engine)
+        env.reset(1)
+        level = self.engine.active_level
+        self.assertEqual(level.time_periods.index(level.active_time_period),
+                         0)
+
+        env.step(ACTIONS.index(frozenset([K_2])))
+        self.assertEqual(level.time_periods.index(level.active_time_period),
+                         1)
+
+
+class VectorForeverEndEnvTests(unittest.TestCase):
+    def setUp(self):
+        # The workers are forked from an engine that's already loaded.
+        get_engine()
+
+    def test_envs_independent(self):
+        """Testing that each environment only sees its own actions"""
+        vector_env = VectorForeverEndEnv(2)
+        single_env = VectorForeverEndEnv(1)
+
+        try:
+            vector_env.reset(0, seed=1)
+            single_env.reset(0, seed=1)
+
+            for i in xrange(30):
+                observations = vector_env.step([RIGHT, LEFT])[0]
+                single_observations = single_env.step([RIGHT])[0]
+                self.assertEqual(observations[0], single_observations[0])
+
+            self.assertTrue(observations[0][0] > observations[1][0])
+        finally:
+            vector_env.close()
+            single_env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from tests.utils import EngineTestCase
+
+
+class FrameExporterTests(EngineTestCase):
+    SIZE = (16, 12)
+
+    def setUp(self):
+        super(FrameExporterTests, self).setUp()
+        self.engine.camera.update()
+
+    def test_view_kept_past_tick(self):
+        """Testing that frames can still be drawn while a view from an
+        earlier tick is kept
+        """
+        engine = self.engine
+        view = engine.get_frame()
+        scaled_view = engine.get_frame(self.SIZE)
+        frame = view.copy()
+        scaled_frame = scaled_view.copy()
+        surface = engine.surface
+
+        self.run_ticks(1)
+        engine.draw_level()
+        self.assertFalse(engine.surface is surface)
+        self.assertFalse(engine.surface.get_locked())
+        self.assertTrue((engine.get_frame() == frame).all())
+        self.assertTrue((engine.get_frame(self.SIZE) == scaled_frame).all())
+
+        # The kept views are left as they were.
+        self.assertTrue((view == frame).all())
+        self.assertTrue((scaled_view == scaled_frame).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
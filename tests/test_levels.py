@@ -0,0 +1,70 @@
+import unittest
+
+from foreverend.levels.base import Area
+from foreverend.particles import ExplosionParticleSystem
+from tests.utils import EngineTestCase
+
+
+class PrewarmTests(EngineTestCase):
+    level_num = 1
+
+    def setUp(self):
+        self.build_costs = dict(Area.build_costs)
+
+        # Start with a new level, so nothing's been prewarmed.
+        super(PrewarmTests, self).setUp()
+        self.engine.levels[self.level_num] = None
+        self.engine.switch_level(self.level_num)
+        self.level = self.engine.active_level
+        self.level.prewarm_timer.stop()
+
+    def tearDown(self):
+        Area.build_costs.clear()
+        Area.build_costs.update(self.build_costs)
+
+    def test_prewarm_within_budget(self):
+        """Testing that prewarming doesn't start areas that won't fit in
+        the budget
+        """
+        unbuilt_areas = list(self.level.get_unbuilt_areas())
+        self.assertTrue(len(unbuilt_areas) > 1)
+
+        for area in unbuilt_areas:
+            Area.build_costs[type(area)] = self.level.PREWARM_BUDGET_MS
+
+        # At least one area is always built.
+        self.level._prewarm_areas()
+        self.assertEqual(len(list(self.level.get_unbuilt_areas())),
+                         len(unbuilt_areas) - 1)
+        self.assertTrue(self.level.prewarm_timer)
+
+        self.level.PREWARM_BUDGET_MS = 60 * 1000
+        self.level._prewarm_areas()
+        self.assertEqual(list(self.level.get_unbuilt_areas()), [])
+        self.assertEqual(self.level.prewarm_timer, None)
+
+
+class ParticleCullingTests(EngineTestCase):
+    def test_bounds_follow_particles(self):
+        """Testing that a particle system's bounds hold its particles after
+        every update, whether or not it's drawn
+        """
+        area = self.engine.active_level.active_area
+        particle_system = ExplosionParticleSystem(area)
+        particle_system.start(*area.engine.player.rect.center)
+
+        try:
+            for i in xrange(5):
+                particle_system.on_particle_update()
+                bounding_rect = particle_system.bounding_rect
+
+                for particle in particle_system.particles:
+                    if particle.active:
+                        self.assertTrue(
+                            bounding_rect.collidepoint(particle.pos))
+        finally:
+            particle_system.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygame
+from pygame.locals import K_LEFT, K_RIGHT, KEYDOWN, KEYUP
+
+from foreverend.replay import ReplayPlayer, ReplayRecorder
+from foreverend.savestate import load_state, save_state
+from tests.utils import EngineTestCase
+
+
+class ReplayTests(EngineTestCase):
+    def setUp(self):
+        super(ReplayTests, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.replay')
+        self.recorder = ReplayRecorder(self.engine, self.filename)
+        self.start_state = save_state(self.engine)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_key_tapped_within_tick(self):
+        """Testing that a key pressed and released within a tick is
+        replayed
+        """
+        positions = self._record(10)
+        positions += self._record(1, [(KEYDOWN, K_LEFT), (KEYUP, K_LEFT)])
+        positions += self._record(20, [(KEYDOWN, K_RIGHT)])
+
+        # The tap turned the player around.
+        self.assertNotEqual(positions[9][1], positions[10][1])
+        self.assertEqual(self._play(), positions)
+
+    def test_discontinuity(self):
+        """Testing that playing past a jump in the game loads its state"""
+        positions = self._record(10, [(KEYDOWN, K_RIGHT)])
+        state = save_state(self.engine)
+        positions += self._record(10)
+
+        # Jump back, as rewinding would.
+        load_state(self.engine, state)
+        self.recorder.mark_discontinuity()
+        positions += self._record(10, [(KEYUP, K_RIGHT)])
+
+        self.assertEqual(self._play(), positions)
+
+    def _record(self, num_ticks, events=()):
+        engine = self.engine
+        positions = []
+
+        for i in xrange(num_ticks):
+            engine.key_edges = []
+
+            if i == 0:
+                for event_type, key in events:
+                    engine.handle_player_event(
+                        pygame.event.Event(event_type, key=key))
+
+            self.recorder.record_tick()
+            engine.tick.emit()
+            engine.animation_manager.tick()
+            engine.frame_num += 1
+            positions.append(self._get_position())
+
+        return positions
+
+    def _get_position(self):
+        player = self.engine.player
+
+        return player.rect.topleft, player.direction
+
+    def _play(self):
+        self.recorder.close()
+        load_state(self.engine, self.start_state)
+        self.engine.held_keys = frozenset()
+
+        player = ReplayPlayer(self.engine, self.filename)
+        positions = []
+
+        try:
+            while player.step():
+                positions.append(self._get_position())
+        finally:
+            player.close()
+
+        return positions
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,306 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygame
+
+from foreverend import resources
+from foreverend.resources import ATLAS_DIR, COLORKEY, IMAGE_MODE_ALPHA, \
+                                 IMAGE_MODE_COLORKEY, IMAGE_MODE_OPAQUE, \
+                                 ImageAtlas, ImageBundle, ImagePrefetcher, \
+                                 detect_image_mode, image_cache, \
+                                 load_image, load_image_atlas, \
+                                 load_image_file, optimize_image
+from foreverend.sprites.base import Sprite
+from tests.utils import get_engine
+
+
+class ImageBundleTests(unittest.TestCase):
+    NAMES = ['good', 'bad', 'keyed', 'opaque']
+    LAYOUT = 'RGBA'
+
+    def setUp(self):
+        get_engine()
+        self.data_dir = resources.DATA_DIR
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'bundle', 'images.bundle')
+
+        shutil.copy(os.path.join(self.data_dir, 'tractor_beam.png'),
+                    os.path.join(self.tempdir, 'good.png'))
+
+        with open(os.path.join(self.tempdir, 'bad.png'), 'wb') as fp:
+            fp.write('This is not a PNG')
+
+        image = pygame.Surface((4, 4), pygame.SRCALPHA)
+        image.fill((10, 20, 30, 255))
+        image.fill((0, 0, 0, 0), pygame.Rect(0, 0, 2, 4))
+        pygame.image.save(image, os.path.join(self.tempdir, 'keyed.png'))
+
+        image.fill((10, 20, 30, 255))
+        pygame.image.save(image, os.path.join(self.tempdir, 'opaque.png'))
+
+        resources.DATA_DIR = self.tempdir
+        ImageBundle.build(self.filename, self.NAMES, self.LAYOUT)
+        self.bundle = self._open()
+
+    def tearDown(self):
+        self.bundle.close()
+        resources.DATA_DIR = self.data_dir
+        shutil.rmtree(self.tempdir)
+
+    def test_skipped_images(self):
+        """Testing that images that can't be decoded don't make the bundle
+        stale
+        """
+        self.assertTrue('good' in self.bundle)
+        self.assertFalse('bad' in self.bundle)
+        self.assertFalse(self.bundle.is_stale(self.NAMES, self.LAYOUT))
+
+        with open(os.path.join(self.tempdir, 'bad.png'), 'wb') as fp:
+            fp.write('Still not a PNG')
+
+        self.assertTrue(self.bundle.is_stale(self.NAMES, self.LAYOUT))
+
+    def test_touched_image(self):
+        """Testing that an image touched but not changed updates the
+        bundle's index
+        """
+        path = os.path.join(self.tempdir, 'good.png')
+        mtime = os.path.getmtime(path) + 100
+        os.utime(path, (mtime, mtime))
+        mtime = os.path.getmtime(path)
+
+        self.assertFalse(self.bundle.is_stale(self.NAMES, self.LAYOUT))
+        self.assertEqual(self.bundle.entries['good'][4], mtime)
+
+        bundle = self._open()
+
+        try:
+            self.assertEqual(bundle.entries['good'][4], mtime)
+            self.assertEqual(bundle.get_image('good').get_size(),
+                             self.bundle.get_image('good').get_size())
+        finally:
+            bundle.close()
+
+    def test_stored_modes(self):
+        """Testing that images are loaded in the mode found when the bundle
+        was built
+        """
+        self.assertEqual(detect_image_mode(self.bundle.get_image('good')),
+                         IMAGE_MODE_ALPHA)
+        self.assertEqual(detect_image_mode(self.bundle.get_image('opaque')),
+                         IMAGE_MODE_OPAQUE)
+
+        # Opaque images are used straight from the bundle, unless it isn't
+        # in the display's layout.
+        image = self.bundle.get_image('opaque')
+        self.assertEqual(image.get_masks()[3], 0xff000000)
+        self.assertEqual(image.get_at((0, 0)), (10, 20, 30, 255))
+
+        self.bundle.needs_convert = True
+        image = self.bundle.get_image('opaque')
+        self.assertEqual(image.get_masks()[3], 0)
+        self.assertEqual(image.get_at((0, 0)), (10, 20, 30, 255))
+        self.bundle.needs_convert = False
+
+        image = self.bundle.get_image('keyed')
+        self.assertEqual(detect_image_mode(image), IMAGE_MODE_COLORKEY)
+        self.assertEqual(image.get_at((3, 0)), (10, 20, 30, 255))
+
+        surface = pygame.Surface((4, 4)).convert()
+        surface.fill((0, 0, 0))
+        surface.blit(image, (0, 0))
+        self.assertEqual(surface.get_at((0, 0)), (0, 0, 0, 255))
+        self.assertEqual(surface.get_at((3, 0)), (10, 20, 30, 255))
+
+    def _open(self):
+        bundle = ImageBundle(self.filename)
+        bundle.open()
+
+        return bundle
+
+
+class ImageAtlasTests(unittest.TestCase):
+    NAMES = ['small', 'big', 'added', 'keyed', 'opaque']
+    SHEET_NAME = ATLAS_DIR + '/sheet0'
+    SHEET_NAMES = [ATLAS_DIR + '/sheet%s' % i for i in range(3)]
+
+    def setUp(self):
+        get_engine()
+        self.data_dir = resources.DATA_DIR
+        self.image_atlas = resources.image_atlas
+        self.image_bundle = resources.image_bundle
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, ATLAS_DIR, 'index.json')
+
+        image = pygame.Surface((8, 6), pygame.SRCALPHA)
+        image.fill((10, 20, 30, 255))
+        image.fill((200, 100, 50, 128), pygame.Rect(0, 0, 4, 3))
+        image.fill((0, 0, 0, 0), pygame.Rect(4, 3, 4, 3))
+        pygame.image.save(image, os.path.join(self.tempdir, 'small.png'))
+
+        image = pygame.Surface((200, 10), pygame.SRCALPHA)
+        pygame.image.save(image, os.path.join(self.tempdir, 'big.png'))
+
+        # The game's own sheet shares the name of the one built here.
+        resources.DATA_DIR = self.tempdir
+        resources.image_bundle = None
+        self._uncache()
+        load_image_atlas(self.filename)
+
+    def tearDown(self):
+        self._uncache()
+        resources.DATA_DIR = self.data_dir
+        resources.image_atlas = self.image_atlas
+        resources.image_bundle = self.image_bundle
+        shutil.rmtree(self.tempdir)
+
+    def test_sprites_loaded_from_atlas(self):
+        """Testing that sprites load small images from the atlas built at
+        startup
+        """
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertTrue('small' in resources.image_atlas)
+        self.assertFalse('big' in resources.image_atlas)
+
+        sprite = Sprite('small')
+        sprite.ensure_image()
+        self.assertTrue(sprite.image.get_parent() is
+                        load_image(self.SHEET_NAME))
+        self.assertEqual(sprite.rect.size, (8, 6))
+
+        image = load_image_file('small')
+
+        for x in xrange(8):
+            for y in xrange(6):
+                self.assertEqual(sprite.image.get_at((x, y)),
+                                 image.get_at((x, y)))
+
+        sprite = Sprite('big')
+        sprite.ensure_image()
+        self.assertEqual(sprite.image.get_parent(), None)
+
+    def test_rebuilt_when_stale(self):
+        """Testing that the atlas is rebuilt when images are added or
+        changed
+        """
+        self.assertFalse(ImageAtlas(self.filename).is_stale())
+
+        shutil.copy(os.path.join(self.tempdir, 'small.png'),
+                    os.path.join(self.tempdir, 'added.png'))
+        self.assertTrue(ImageAtlas(self.filename).is_stale())
+
+        load_image_atlas(self.filename)
+        self.assertTrue('added' in resources.image_atlas)
+        self.assertFalse(resources.image_atlas.is_stale())
+
+        path = os.path.join(self.tempdir, 'small.png')
+        mtime = os.path.getmtime(self.filename) + 100
+        os.utime(path, (mtime, mtime))
+
+        atlas = ImageAtlas(self.filename)
+        self.assertFalse('small' in atlas)
+        self.assertTrue(atlas.is_stale())
+
+    def test_sheets_by_mode(self):
+        """Testing that atlas images get the blit mode detected for them,
+        with their pixels intact
+        """
+        image = pygame.Surface((5, 5), pygame.SRCALPHA)
+        image.fill((40, 50, 60, 255))
+        pygame.image.save(image, os.path.join(self.tempdir, 'opaque.png'))
+
+        image.fill((0, 0, 0, 0), pygame.Rect(0, 0, 2, 2))
+        pygame.image.save(image, os.path.join(self.tempdir, 'keyed.png'))
+
+        load_image_atlas(self.filename)
+        self.assertEqual(sorted(resources.image_atlas.sheet_modes.values()),
+                         [IMAGE_MODE_ALPHA, IMAGE_MODE_COLORKEY,
+                          IMAGE_MODE_OPAQUE])
+
+        image = load_image('opaque')
+        self.assertTrue(image.get_parent())
+        self.assertFalse(image.get_flags() & pygame.SRCALPHA)
+        self.assertEqual(image.get_colorkey(), None)
+        self.assertEqual(image.get_at((0, 0)), (40, 50, 60, 255))
+
+        image = load_image('keyed')
+        self.assertTrue(image.get_parent())
+        self.assertFalse(image.get_flags() & pygame.SRCALPHA)
+        self.assertTrue(image.get_colorkey())
+
+        source = load_image_file('keyed')
+        screen = pygame.Surface((5, 5), 0, 32)
+
+        for color in [(0, 0, 0), (255, 255, 255)]:
+            screen.fill(color)
+            screen.blit(image, (0, 0))
+
+            for x in xrange(5):
+                for y in xrange(5):
+                    if source.get_at((x, y)).a:
+                        expected = source.get_at((x, y))
+                    else:
+                        expected = color
+
+                    self.assertEqual(screen.get_at((x, y))[:3],
+                                     tuple(expected)[:3])
+
+        image = load_image('small')
+        self.assertTrue(image.get_flags() & pygame.SRCALPHA)
+
+    def _uncache(self):
+        for name in self.NAMES + self.SHEET_NAMES:
+            image_cache.remove(name)
+
+
+class OptimizeImageTests(unittest.TestCase):
+    def setUp(self):
+        get_engine()
+
+    def test_colorkey_pixels(self):
+        """Testing that images given a colorkey keep their exact colors"""
+        image = pygame.Surface((4, 4), pygame.SRCALPHA, 32,
+                               (0xff, 0xff00, 0xff0000, 0xff000000))
+        image.fill((40, 50, 60, 255))
+        image.fill((0, 0, 0, 0), pygame.Rect(0, 0, 2, 2))
+
+        image = optimize_image('keyed', image, IMAGE_MODE_COLORKEY)
+        self.assertEqual(image.get_at((3, 3)), (40, 50, 60, 255))
+        self.assertEqual(image.get_at((0, 0)), COLORKEY + (255,))
+
+
+class ImagePrefetcherTests(unittest.TestCase):
+    NAMES = ['prefetched_%s' % i for i in range(3)]
+
+    def setUp(self):
+        get_engine()
+        self.prefetcher = ImagePrefetcher()
+
+        for name in self.NAMES:
+            image = pygame.Surface((4, 4), pygame.SRCALPHA)
+            self.prefetcher.decoded.put((name, image, IMAGE_MODE_OPAQUE))
+
+    def tearDown(self):
+        for name in self.NAMES:
+            image_cache.remove(name)
+
+    def test_process(self):
+        """Testing that processing adds images within the time budget,
+        in the mode found by the thread
+        """
+        self.prefetcher.process(0)
+        self.assertEqual([name in image_cache for name in self.NAMES],
+                         [True, False, False])
+
+        self.prefetcher.process()
+        self.assertEqual([name in image_cache for name in self.NAMES],
+                         [True, True, True])
+
+        image = image_cache.get(self.NAMES[0])
+        self.assertFalse(image.get_flags() & pygame.SRCALPHA)
+
+
+if __name__ == '__main__':
+    unittest.main()
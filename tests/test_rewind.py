@@ -0,0 +1,111 @@
+import unittest
+
+from pygame.locals import K_RIGHT
+
+from foreverend.rewind import RewindBuffer, decode_delta, encode_delta
+from tests.utils import EndSequenceTestCase, EngineTestCase
+
+
+class RewindBufferTests(EndSequenceTestCase):
+    def setUp(self):
+        super(RewindBufferTests, self).setUp()
+        self.buffer = RewindBuffer(self.engine)
+
+        # Record every tick, however long it takes.
+        self.buffer.MAX_RECORD_MS = 1000
+
+    def test_rewind(self):
+        """Testing that rewinding goes back to a recorded frame"""
+        positions = self._record(20, frozenset([K_RIGHT]))
+        self.assertNotEqual(positions[-6], positions[-1])
+
+        self.assertTrue(self.buffer.rewind(5))
+        self.assertEqual(self.engine.player.rect.topleft, positions[-6])
+        self.assertEqual(len(self.buffer.frames), 15)
+
+    def test_rewind_during_sequence(self):
+        """Testing that a scripted sequence can't be rewound"""
+        self._record(10)
+        self.area.start_end_sequence()
+        self._record(5)
+        num_frames = len(self.buffer.frames)
+        rect = self.engine.player.rect.copy()
+
+        self.assertFalse(self.buffer.rewind(1))
+        self.assertEqual(len(self.buffer.frames), num_frames)
+        self.assertEqual(self.engine.player.rect, rect)
+        self.assertTrue(self.engine.animation_manager.animations)
+
+    def test_delta(self):
+        """Testing that a delta between two states decodes back to the
+        new state
+        """
+        old = 'abc\x00\x01\x02' * 100
+        new = old[:10] + 'xyz' + old[13:290] + 'q' + old[291:]
+        delta = encode_delta(old, new)
+
+        self.assertTrue(len(delta) < 20)
+        self.assertEqual(decode_delta(old, delta), new)
+        self.assertEqual(decode_delta(old, encode_delta(old, old)), old)
+
+    def test_record_budget(self):
+        """Testing that frames are recorded less often when they take
+        longer than the budget, and every tick when they don't
+        """
+        self.buffer.MAX_RECORD_MS = 0.000001
+        self._record(10)
+        self.assertEqual(self.buffer.stride, self.buffer.MAX_STRIDE)
+
+        self.buffer.MAX_RECORD_MS = 1000
+        self._record(self.buffer.MAX_STRIDE)
+        self.assertEqual(self.buffer.stride, 1)
+
+    def _record(self, num_ticks, keys=frozenset()):
+        positions = []
+
+        for i in xrange(num_ticks):
+            self.run_ticks(1, keys)
+            self.buffer.record()
+            positions.append(self.engine.player.rect.topleft)
+
+        return positions
+
+
+class LazyAreaRewindTests(EngineTestCase):
+    level_num = 2
+
+    def setUp(self):
+        # Start with a new level, so the areas are built as they're used.
+        super(LazyAreaRewindTests, self).setUp()
+        self.engine.levels[self.level_num] = None
+        self.engine.switch_level(self.level_num)
+        self.level = self.engine.active_level
+        self.level.prewarm_timer.stop()
+        self.buffer = RewindBuffer(self.engine)
+        self.buffer.MAX_RECORD_MS = 1000
+
+    def test_rewind_past_area_built(self):
+        """Testing that rewinding to before an area was built leaves it
+        usable
+        """
+        area = self.level.time_periods[1].default_area
+        self.assertFalse(area.built)
+
+        for i in xrange(3):
+            self.run_ticks(1)
+            self.buffer.record()
+
+        self.level.switch_time_period(1)
+        self.run_ticks(1)
+        self.buffer.record()
+        self.assertTrue(area.built)
+
+        self.assertTrue(self.buffer.rewind(2))
+        self.assertNotEqual(self.level.active_area, area)
+
+        self.level.switch_time_period(1)
+        self.assertEqual(self.level.active_area, area)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+from foreverend.savestate import StateError, can_save_state, load_state, \
+                                 save_state
+from tests.utils import EndSequenceTestCase, EngineTestCase
+
+
+class SaveStateTests(EngineTestCase):
+    def test_load_state(self):
+        """Testing that loading a state plays out the same way again"""
+        self.run_ticks(10)
+        state = save_state(self.engine)
+        positions = self._get_positions(30)
+
+        self.run_ticks(15)
+        load_state(self.engine, state)
+        self.assertEqual(self._get_positions(30), positions)
+
+    def _get_positions(self, num_ticks):
+        positions = []
+
+        for i in xrange(num_ticks):
+            self.run_ticks(1)
+            positions.append(self.engine.player.rect.topleft)
+
+        return positions
+
+
+class LazyAreaSaveStateTests(EngineTestCase):
+    level_num = 2
+
+    def setUp(self):
+        # Start with a new level, so the areas are built as they're used.
+        super(LazyAreaSaveStateTests, self).setUp()
+        self.engine.levels[self.level_num] = None
+        self.engine.switch_level(self.level_num)
+        self.level = self.engine.active_level
+        self.level.prewarm_timer.stop()
+
+    def test_load_state_after_area_built(self):
+        """Testing that loading a state takes the player out of areas
+        built since it was saved
+        """
+        area = self.level.time_periods[1].default_area
+        self.assertFalse(area.built)
+
+        state = save_state(self.engine)
+        self.level.switch_time_period(1)
+        self.assertTrue(area.built)
+
+        load_state(self.engine, state)
+        self.assertFalse(self.engine.player in
+                         list(area.main_layer.quad_tree))
+
+        self.level.switch_time_period(1)
+        self.assertEqual(self.level.active_area, area)
+
+
+class SequenceSaveStateTests(EndSequenceTestCase, SaveStateTests):
+    def test_load_state_mid_sequence(self):
+        """Testing that loading a state taken mid-sequence plays it out"""
+        self.area.start_end_sequence()
+        self._run_until_savable()
+
+        # The player hops onto the platform from here.
+        state = save_state(self.engine)
+        positions = self._get_positions(30)
+        self.assertNotEqual(positions[0], positions[-1])
+
+        load_state(self.engine, state)
+        self.assertEqual(self._get_positions(30), positions)
+
+    def test_save_state_unrestorable(self):
+        """Testing that states can't be saved or loaded while running
+        effects that can't be restored
+        """
+        state = save_state(self.engine)
+        self.area.start_end_sequence()
+        self.run_ticks(1)
+
+        self.assertFalse(can_save_state(self.engine))
+        self.assertRaises(StateError, save_state, self.engine)
+        self.assertRaises(StateError, load_state, self.engine, state)
+
+    def _run_until_savable(self):
+        for i in xrange(5 * self.engine.FPS):
+            self.run_ticks(1)
+
+            if can_save_state(self.engine):
+                return
+
+        self.fail('The sequence never reached a state that can be saved')
+
+
+if __name__ == '__main__':
+    unittest.main()
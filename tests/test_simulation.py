@@ -0,0 +1,82 @@
+import unittest
+
+from pygame.locals import K_LEFT, K_RIGHT, K_SPACE
+
+from foreverend.particles import particle_pool
+from foreverend.savestate import save_state
+from tests.utils import EngineTestCase
+
+
+class ForkTests(EngineTestCase):
+    def setUp(self):
+        super(ForkTests, self).setUp()
+        self.level = self.engine.active_level
+        self.area = self.level.time_periods[2].default_area
+
+        # Otherwise they'd be built in the background during a rollout,
+        # and left built.
+        for area in list(self.level.get_unbuilt_areas()):
+            area.build()
+
+    def test_rollout_with_explosion(self):
+        """Testing that an explosion in a rollout doesn't reach the live
+        game
+        """
+        self.area.on_dynamite_placed(self.level.dynamite)
+        self.run_ticks(5)
+        live_state = self._get_live_state()
+
+        # The dynamite goes off partway through.
+        rollout = self.engine.clone().rollout([()], self.engine.FPS + 10)
+        self.assertEqual(rollout.outcome, None)
+        self.assertEqual(self._get_live_state(), live_state)
+
+        rollout.get_fork().restore()
+        self.assertEqual(self.level.dynamite, None)
+
+    def test_rollout_during_explosion(self):
+        """Testing that a rollout leaves a running explosion as it was"""
+        self.area.on_dynamite_placed(self.level.dynamite)
+        self.area.start_explosion()
+        self.run_ticks(3)
+        live_state = self._get_live_state()
+        self.assertTrue(live_state[3])
+
+        self.engine.clone().rollout([()], self.engine.FPS)
+        self.assertEqual(self._get_live_state(), live_state)
+
+    def test_rollouts(self):
+        """Testing that a batch of rollouts matches rolling out one by one"""
+        fork = self.engine.clone()
+        live_state = self._get_live_state()
+        input_sequences = [[(K_LEFT,)] * 10, [(K_RIGHT, K_SPACE)] * 10, [()]]
+
+        rollouts = fork.rollouts(input_sequences)
+        self.assertEqual(self._get_live_state(), live_state)
+        self.assertEqual(
+            [rollout.state for rollout in rollouts],
+            [fork.rollout(inputs).state for inputs in input_sequences])
+        self.assertNotEqual(rollouts[0].state, rollouts[1].state)
+
+    def _get_live_state(self):
+        engine = self.engine
+        particle_systems = [
+            (particle_system, particle_system.pos,
+             [(particle.pos, particle.elapsed_time)
+              for particle in particle_system.particles])
+            for area in self.level.get_built_areas()
+            for particle_system in area.particle_systems
+        ]
+        timers = [
+            (callback, getattr(callback, '__self__', None) and
+                       getattr(callback.__self__, 'tick_count', None))
+            for callback in engine.tick.callbacks
+        ]
+
+        return (save_state(engine), engine.frame_num, timers,
+                particle_systems, list(engine.animation_manager.animations),
+                particle_pool.in_use)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+import pygame
+
+from foreverend.resources import image_cache
+from foreverend.sprites.base import Direction, Sprite
+from tests.utils import EngineTestCase
+
+
+class SpriteImageTests(EngineTestCase):
+    def test_named_sprite_generates_image(self):
+        """Testing that a new named sprite generates its image"""
+        sprite = Sprite('ground')
+
+        self.assertTrue(sprite.is_image_stale())
+        sprite.ensure_image()
+
+        self.assertFalse(sprite.is_image_stale())
+        self.assertTrue(isinstance(sprite.image, pygame.Surface))
+        self.assertNotEqual(sprite.rect.width, 0)
+        self.assertNotEqual(sprite.rect.height, 0)
+
+    def test_image_generated_when_added(self):
+        """Testing that adding a sprite to a layer generates its image"""
+        sprite = Sprite('ground')
+        layer = self.engine.active_level.active_area.main_layer
+        layer.add(sprite)
+
+        try:
+            self.assertFalse(sprite.is_image_stale())
+            self.assertEqual(sprite.rect.size, sprite.image.get_size())
+        finally:
+            layer.remove(sprite)
+
+    def test_direction_change_invalidates_image(self):
+        """Testing that changing direction regenerates a flipped image"""
+        sprite = Sprite('player', flip_image=True)
+        sprite.ensure_image()
+        image = sprite.image
+
+        sprite.direction = Direction.LEFT
+        self.assertTrue(sprite.is_image_stale())
+        self.assertFalse(sprite.image is image)
+        self.assertFalse(sprite.is_image_stale())
+
+    def test_flipped_image_ready_before_turn(self):
+        """Testing that a sprite that can turn has its flipped image made
+        before it turns around
+        """
+        key = ('ground', True, False)
+        image_cache.remove(key)
+
+        sprite = Sprite('ground', flip_image=True)
+        sprite.can_turn = True
+        sprite.ensure_image()
+        self.assertTrue(key in image_cache)
+        flipped_image = image_cache.get(key)
+
+        sprite.direction = Direction.LEFT
+        sprite.ensure_image()
+        self.assertTrue(sprite.image is flipped_image)
+
+    def test_flipped_image_loaded_on_turn(self):
+        """Testing that a flipped image is only made once a sprite that
+        isn't expected to turn around does
+        """
+        key = ('ground', True, False)
+        image_cache.remove(key)
+
+        sprite = Sprite('ground', flip_image=True)
+        sprite.ensure_image()
+        self.assertFalse(key in image_cache)
+
+        sprite.direction = Direction.LEFT
+        sprite.ensure_image()
+        self.assertTrue(key in image_cache)
+        self.assertTrue(sprite.image is image_cache.get(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import unittest
+
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+_engine = None
+
+
+def get_engine():
+    """Returns a headless engine shared by all the tests.
+
+    Only one engine can exist at a time, so it's created on first use
+    and kept for the rest of the run.
+    """
+    global _engine
+
+    if not _engine:
+        from foreverend.env import create_headless_engine
+        _engine = create_headless_engine()
+
+    return _engine
+
+
+class EngineTestCase(unittest.TestCase):
+    """Base class for tests that need a running engine and level."""
+    level_num = 0
+
+    def setUp(self):
+        self.engine = get_engine()
+        self.engine.paused = False
+        self.engine.active_cutscene = None
+        self.engine.switch_level(self.level_num)
+
+    def run_ticks(self, num_ticks, keys=frozenset()):
+        for i in xrange(num_ticks):
+            self.engine.simulate_tick(keys)
+
+
+class EndSequenceTestCase(EngineTestCase):
+    """Base class for tests of level 3's scripted ending.
+
+    The key is brought over to the keyhole, ready for
+    start_end_sequence() to be called.
+    """
+    level_num = 2
+
+    def setUp(self):
+        super(EndSequenceTestCase, self).setUp()
+        level = self.engine.active_level
+        level.time_periods[0].areas['bluebox'].build()
+        level.switch_time_period(2)
+        self.area = level.active_area
+
+        # Bring the key over from the blue box.
+        key = level.triangle_key
+        key.remove()
+        self.area.main_layer.add(key)
+        key.show()
+        key.move_to(*self.area.container.rect.topright)